@@ -126,12 +126,12 @@ def new(project_dir: Path, system: str):
 
 
 def pf2e_foundry(parent: _SubParsersAction):
-    def start_mongo(rebuild: bool):
+    def start_mongo(rebuild: bool, jobs: int, full: bool):
         from ttrpg_scribe.pf2e_compendium import foundry
 
         logging.basicConfig(level=logging.INFO,
                             format='%(name)s @ %(levelname)s: %(message)s')
-        foundry.initialise(rebuild)
+        foundry.initialise(rebuild or full, jobs, full)
         logging.info('Mongo server ready')
         try:
             while True:  # Keep server alive until termination
@@ -150,8 +150,11 @@ def pf2e_foundry(parent: _SubParsersAction):
     add_subcommand(subparsers, 'dir', lambda _: print_dir())
 
     mongo_parser = add_subcommand(subparsers, 'mongo',
-                                  lambda args: start_mongo(rebuild=args.rebuild))
+                                  lambda args: start_mongo(rebuild=args.rebuild, jobs=args.jobs,
+                                                           full=args.full))
     mongo_parser.add_argument('--rebuild', action='store_true')
+    mongo_parser.add_argument('--full', action='store_true')
+    mongo_parser.add_argument('--jobs', type=int, default=1)
 
 
 def update(update_package: Path | None):
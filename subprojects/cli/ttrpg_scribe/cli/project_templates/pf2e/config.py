@@ -32,3 +32,11 @@ CULTURES = {
 
 PARTY = ['Alice', 'Bob', 'Charlie', 'Danielle']
 PARTY_LEVEL = 1
+
+# Compendium database connections, waitress serves requests on 4 threads by default
+COMPENDIUM_MONGO_MAX_POOL_SIZE = 100
+COMPENDIUM_MONGO_MIN_POOL_SIZE = 0
+COMPENDIUM_MONGO_WARM_CONNECTIONS = 4
+
+# Memory for the typo tolerant name search
+COMPENDIUM_FUZZY_INDEX_BYTES = 32 * 2**20
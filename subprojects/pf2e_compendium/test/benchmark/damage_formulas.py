@@ -0,0 +1,73 @@
+import time
+from argparse import ArgumentParser
+from typing import Callable
+
+import enrich_throughput
+
+from ttrpg_scribe.pf2e_compendium.foundry.enrich import damage, syntax
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.args import Args
+
+_SYNTHETIC = [
+    '2d6[fire]', '(1d6 + 3)[fire]', '5d6[acid],5d6[cold],5d6[fire]',
+    '(2d6 + 4 + (2d6[precision]))[slashing]', '(5[splash])[fire]', '1d6[persistent,fire]',
+    '(@actor.level)d6[fire]', '(floor(@actor.level/2))d8[cold]',
+    'ternary(gte(@item.rank,5),4,2)d6[bludgeoning]', '(max(1,@actor.level-2))[mental]',
+]
+
+
+def formulas(texts: list[str]) -> list[str]:
+    return [Args(segment.args, arg_sep='|', key_value_sep=':', error_context='').consume_index(0)
+            for text in texts
+            for segment in syntax.parse(text)
+            if isinstance(segment, syntax.Enricher) and segment.name == 'Damage']
+
+
+def timed(name: str, formulas: list[str], repeat: int, run: Callable[[str], object]):
+    failures = 0
+    best = float('inf')
+    for _ in range(repeat):
+        failures = 0
+        start = time.perf_counter()
+        for formula in formulas:
+            try:
+                run(formula)
+            except Exception:
+                failures += 1
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:>9}: {best / len(formulas) * 1e6:7.2f}µs per formula, best of {repeat}'
+          f' ({failures} failed)')
+
+
+def main():
+    parser = ArgumentParser('damage_formulas')
+    # Without --synthetic, every @Damage formula in the initialised compendium is measured
+    parser.add_argument('--synthetic', type=int)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        all_formulas = [_SYNTHETIC[i % len(_SYNTHETIC)] for i in range(args.synthetic)]
+    else:
+        all_formulas = formulas(enrich_throughput.compendium_descriptions())
+    print(f'{len(all_formulas):,} formulas, {len(set(all_formulas)):,} distinct')
+    context = enrich_throughput.CONTEXT
+
+    def render(compiled: damage.CompiledFormula | str):
+        if isinstance(compiled, damage.CompiledFormula):
+            compiled.render(context, short_label=False)
+
+    def stats(compiled: damage.CompiledFormula | str):
+        if isinstance(compiled, damage.CompiledFormula):
+            compiled.stats(context)
+
+    uncached = damage.compile_formula.__wrapped__
+    timed('compiling', all_formulas, args.repeat, lambda formula: render(uncached(formula)))
+    timed('cached', all_formulas, args.repeat,
+          lambda formula: render(damage.compile_formula(formula)))
+    timed('stats', all_formulas, args.repeat,
+          lambda formula: stats(damage.compile_formula(formula)))
+    print(f'Compiled formula cache: {damage.compile_formula.cache_info()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import random
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Any, Iterator
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.enrich import (enrich,
+                                                         enrichment_cache,
+                                                         syntax)
+
+CONTEXT = {'actor': {'level': 5}, 'item': {'level': 5, 'rank': 3}}
+
+_SYNTHETIC_PARTS = [
+    '<p>The creature makes a Strike. ',
+    '@Damage[2d6[fire]] damage',
+    '@Damage[(2d6 + 4 + (2d6[precision]))[slashing]]{2d6+4 slashing}',
+    ' with a @Check[reflex|dc:25|basic] save. ',
+    '@UUID[Compendium.pf2e.conditionitems.Item.Frightened]{Frightened 1}',
+    ' for [[/r 1d4 #rounds]]{1d4 rounds}, ',
+    'within a @Template[type:emanation|distance:30]. ',
+    '[[/act escape dc=20]]</p>',
+    '<hr />\n<p><strong>Critical Success</strong> The target is unaffected.</p>',
+]
+
+
+def descriptions(doc: Any) -> Iterator[str]:
+    match doc:
+        case {'description': {'value': str() as value}, **rest}:
+            yield value
+            yield from descriptions(rest)
+        case dict():
+            for value in doc.values():
+                yield from descriptions(value)
+        case list():
+            for value in doc:
+                yield from descriptions(value)
+
+
+def compendium_descriptions() -> list[str]:
+    foundry.initialise()
+    by_collection: defaultdict[str, list[str]] = defaultdict(list)
+    for entry in storage.backend().search_entries():
+        by_collection[entry['doc_type']].append(entry['_id'])
+    return [text
+            for collection, ids in by_collection.items()
+            for doc in storage.get_documents(collection, ids).values()
+            for text in descriptions(doc)]
+
+
+def synthetic_descriptions(count: int, rng: random.Random) -> list[str]:
+    return [''.join(rng.choices(_SYNTHETIC_PARTS, k=rng.randint(3, 30))) for _ in range(count)]
+
+
+def run(texts: list[str]) -> tuple[float, int]:
+    failures = 0
+    start = time.perf_counter()
+    for text in texts:
+        try:
+            enrich(text, CONTEXT)
+        except Exception:
+            failures += 1
+    return time.perf_counter() - start, failures
+
+
+def main():
+    parser = ArgumentParser('enrich_throughput')
+    # Without --synthetic, every description in the initialised compendium is enriched
+    parser.add_argument('--synthetic', type=int)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        texts = synthetic_descriptions(args.synthetic, random.Random(args.seed))
+    else:
+        texts = compendium_descriptions()
+    megabytes = sum(map(len, texts)) / 2**20
+    print(f'{len(texts):,} descriptions, {megabytes:.1f} MiB')
+
+    # cold parses and enriches everything, parsed reuses parses, memoised reuses output too
+    for label, clear_parses, clear_output in [('cold', True, True), ('parsed', False, True),
+                                              ('memoised', False, False)]:
+        timings = []
+        for _ in range(args.repeat):
+            if clear_parses:
+                syntax.parse.cache_clear()
+            if clear_output:
+                enrichment_cache.clear()
+            seconds, failures = run(texts)
+            timings.append(seconds)
+        best = min(timings)
+        print(f'{label}: {best:.3f}s best of {args.repeat} ({len(texts) / best:,.0f}'
+              f' descriptions/s, {megabytes / best:.1f} MiB/s, {failures} failed)')
+    print(f'Enrichment cache: {enrichment_cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import random
+import statistics
+import string
+import sys
+import time
+from argparse import ArgumentParser
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.fuzzy import TrigramIndex
+from ttrpg_scribe.pf2e_compendium.foundry.storage import Document
+
+
+def synthetic_entries(count: int, rng: random.Random) -> list[Document]:
+    consonants, vowels = 'bcdfghjklmnprstvwz', 'aeiou'
+
+    def word():
+        return ''.join(rng.choice(consonants) + rng.choice(vowels)
+                       + (rng.choice(consonants) if rng.random() < 0.4 else '')
+                       for _ in range(rng.randint(1, 3)))
+
+    # Word frequencies in names are roughly Zipfian, "of" and "lesser" are everywhere
+    vocabulary = [word() for _ in range(count // 5)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    entries = []
+    for i in range(count):
+        name = ' '.join(rng.choices(vocabulary, weights, k=rng.randint(1, 3))).title()
+        entries.append({'_id': f'bench/{i}', 'doc_type': 'npc', 'name': name,
+                        'base_name': name})
+    return entries
+
+
+def typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(len(name))
+    match rng.choice(['delete', 'substitute', 'transpose']):
+        case 'delete':
+            return name[:i] + name[i + 1:]
+        case 'substitute':
+            return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+        case _:
+            i = min(i, len(name) - 2)
+            return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def main():
+    parser = ArgumentParser('fuzzy_search')
+    # Without --synthetic, the initialised compendium is indexed
+    parser.add_argument('--synthetic', type=int)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--budget', type=int, default=32 * 2**20)
+    parser.add_argument('--seed', type=int, default=0)
+    # Fail if the median query takes longer than this many milliseconds
+    parser.add_argument('--fail-above', type=float)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    if args.synthetic is not None:
+        entries = synthetic_entries(args.synthetic, rng)
+    else:
+        foundry.initialise()
+        entries = list(storage.backend().search_entries())
+
+    start = time.perf_counter()
+    index = TrigramIndex(entries, args.budget)
+    build = time.perf_counter() - start
+    print(f'{len(entries):,} names indexed in {build:.2f}s, {index.nbytes() / 2**20:.1f} MiB, '
+          f'{index.dropped} grams dropped for the {args.budget / 2**20:.0f} MiB budget')
+
+    targets = rng.choices(entries, k=args.queries)
+    timings = []
+    found = 0
+    for target in targets:
+        query = typo(target['name'], rng)
+        start = time.perf_counter()
+        results = index.search(query, limit=10)
+        timings.append((time.perf_counter() - start) * 1000)
+        # Names repeat, any entry with the intended name counts
+        found += any(result['name'] == target['name'] for result in results)
+    timings.sort()
+    median = statistics.median(timings)
+    print(f'{args.queries:,} single typo queries: median {median:.3f}ms, '
+          f'p95 {timings[int(len(timings) * 0.95)]:.3f}ms, max {timings[-1]:.3f}ms, '
+          f'recall@10 {found / args.queries:.1%}')
+    if args.fail_above is not None and median > args.fail_above:
+        print(f'Median above {args.fail_above}ms', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
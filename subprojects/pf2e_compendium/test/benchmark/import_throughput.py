@@ -0,0 +1,130 @@
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import pymongo
+import synthetic_pack
+
+from ttrpg_scribe.pf2e_compendium.foundry import mongo_client, pack_reader
+
+
+@dataclass
+class Stage:
+    name: str
+    documents: int
+    seconds: float
+    peak_memory: int
+
+    @property
+    def docs_per_second(self):
+        return self.documents / self.seconds if self.seconds else 0.0
+
+
+def measure[T](name: str, count: Callable[[T], int], f: Callable[[], T],
+               reset: Callable[[], None] = lambda: None) -> tuple[Stage, T]:
+    start = time.perf_counter()
+    result = f()
+    seconds = time.perf_counter() - start
+    # Tracing slows everything down, so memory is measured in a separate run
+    reset()
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Stage(name, count(result), seconds, peak), result
+
+
+def start_mongod(mongod: str, data: Path, port: int) -> subprocess.Popen:
+    server = subprocess.Popen([
+        mongod,
+        '--dbpath', data.as_posix(),
+        '--bind_ip', '127.0.0.1',
+        '--port', str(port),
+    ], stdout=subprocess.DEVNULL)
+    # Repoint writes at the scratch server, so the real compendium is never touched
+    mongo_client.client = pymongo.MongoClient('127.0.0.1', port, timeoutMS=10000)
+    mongo_client.client.admin.command('ping')
+    return server
+
+
+def run(args) -> list[Stage]:
+    with tempfile.TemporaryDirectory() as temp:
+        temp = Path(temp)
+        pack = temp/'pack'
+        synthetic_pack.write_pack(pack, args.actors, args.items, args.folder_depth,
+                                  args.adjusted)
+
+        def decode():
+            with pack_reader.open_db(pack) as level_db:
+                return sum(1 for _ in pack_reader.db_iter(level_db))
+
+        def import_pack():
+            return [pymongo.InsertOne(doc, namespace=f'pf2e.{collection}')
+                    for collection, doc in pack_reader.read_pack('bench', pack)]
+
+        stages = []
+        stage, _ = measure('db_iter', lambda n: n, decode)
+        stages.append(stage)
+        stage, ops = measure('read_pack', len, import_pack)
+        stages.append(stage)
+        if args.mongod is not None:
+            (data := temp/'mongod').mkdir()
+            server = start_mongod(args.mongod, data, args.port)
+            try:
+                stage, _ = measure('bulk_write', lambda _: len(ops),
+                    lambda: mongo_client.bulk_write(ops, args.batch_size, ordered=False),
+                    reset=lambda: mongo_client.client.drop_database('pf2e'))
+                stages.append(stage)
+            finally:
+                mongo_client.client.close()
+                server.terminate()
+                server.wait()
+        return stages
+
+
+def main():
+    parser = ArgumentParser('import_throughput')
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=25)
+    parser.add_argument('--folder-depth', type=int, default=3)
+    parser.add_argument('--adjusted', type=float, default=0.2)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--mongod', default=shutil.which('mongod'))
+    parser.add_argument('--no-mongod', action='store_const', const=None, dest='mongod')
+    parser.add_argument('--port', type=int, default=48166)
+    parser.add_argument('--output', type=Path)
+    # Minimum docs/s for every stage, for catching regressions
+    parser.add_argument('--fail-below', type=float)
+    args = parser.parse_args()
+
+    stages = run(args)
+    print(f'{args.actors} actors, {args.items} items each, folder depth {args.folder_depth}, '
+          f'{args.adjusted:.0%} adjusted')
+    for stage in stages:
+        print(f'{stage.name:>12}: {stage.documents:>8} docs in {stage.seconds:7.3f}s '
+              f'{stage.docs_per_second:>10,.0f} docs/s '
+              f'peak {stage.peak_memory / 2**20:8.1f} MiB')
+    if args.output is not None:
+        results: list[dict[str, Any]] = [asdict(stage) | {'docs_per_second': stage.docs_per_second}
+                                         for stage in stages]
+        args.output.write_text(json.dumps({'args': vars(args) | {'output': str(args.output)},
+                                           'stages': results}, indent=2))
+    if args.fail_below is not None:
+        slow = [stage.name for stage in stages if stage.docs_per_second < args.fail_below]
+        if slow:
+            print(f'Below {args.fail_below:,.0f} docs/s: {', '.join(slow)}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import get_args
+
+import synthetic_pack
+
+from ttrpg_scribe.pf2e_compendium.foundry import pack_reader
+from ttrpg_scribe.pf2e_compendium.foundry.pack_reader import NestedResolution
+
+
+def main():
+    parser = ArgumentParser('nested_items')
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=25)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        pack = Path(temp)/'pack'
+        synthetic_pack.write_pack(pack, args.actors, args.items)
+        print(f'{args.actors} actors with {args.items} items each')
+
+        baseline = None
+        for mode in get_args(NestedResolution.__value__):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                level_db = pack_reader.open_db(pack)
+                docs = [doc for _, doc in pack_reader.read_db(level_db, 'bench', {}, mode)]
+                timings.append(time.perf_counter() - start)
+            if baseline is None:
+                baseline = docs
+            assert docs == baseline, f'{mode} resolution produced different documents'
+            best = min(timings)
+            print(f'{mode:>8}: {best:.3f}s best of {args.repeat} '
+                  f'({len(docs) / best:,.0f} actors/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import random
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.creature_index import CreatureIndex
+from ttrpg_scribe.pf2e_compendium.foundry.sqlite_storage import SqliteStorage
+from ttrpg_scribe.pf2e_compendium.foundry.storage import CreatureFilter, Document
+from ttrpg_scribe.pf2e_compendium.oracle import solver
+
+_SIZES = ['tiny', 'sm', 'med', 'lg', 'huge', 'grg']
+_TRAITS = ['humanoid', 'undead', 'dragon', 'beast', 'fiend', 'construct', 'animal', 'elemental']
+
+
+def synthetic_creatures(count: int, rng: random.Random) -> list[Document]:
+    return [{
+        '_id': f'bench/{i}', 'name': f'Creature {i}',
+        'path': {'pack': 'bench', 'subpath': '', 'stem': str(i)},
+        'system': {'details': {'level': {'value': rng.randint(-1, 24)}},
+                   'traits': {'rarity': rng.choices(['common', 'uncommon', 'rare'], [8, 3, 1])[0],
+                              'size': {'value': rng.choice(_SIZES)},
+                              'value': rng.sample(_TRAITS, rng.randint(1, 3))}},
+    } for i in range(count)]
+
+
+def random_encounter(combatants: int, rng: random.Random) -> list[CreatureFilter]:
+    def combatant():
+        level = rng.randint(-1, 20)
+        return CreatureFilter(
+            (level, level + rng.randint(0, 3)),
+            rng.choice([None, ['common'], ['common', 'uncommon']]),
+            rng.choice([None, rng.sample(_SIZES, 3)]),
+            rng.choice([[], [rng.choice(_TRAITS)]]),
+        )
+    return [combatant() for _ in range(combatants)]
+
+
+def timed(name: str, encounters: list[list[CreatureFilter]],
+          resolve: Callable[[list[CreatureFilter]], object]) -> float:
+    timings = []
+    for encounter in encounters:
+        start = time.perf_counter()
+        resolve(encounter)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    median = statistics.median(timings)
+    print(f'{name}: median {median:.3f}ms, p95 {timings[int(len(timings) * 0.95)]:.3f}ms'
+          f' per encounter')
+    return median
+
+
+def main():
+    parser = ArgumentParser('oracle_sampling')
+    # Without --synthetic, the initialised compendium is sampled
+    parser.add_argument('--synthetic', type=int)
+    parser.add_argument('--encounters', type=int, default=500)
+    parser.add_argument('--combatants', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    if args.synthetic is not None:
+        directory = tempfile.TemporaryDirectory()
+        backend = SqliteStorage(Path(directory.name)/'compendium.sqlite3')
+        backend.upsert('npc', synthetic_creatures(args.synthetic, rng))
+    else:
+        foundry.initialise()
+        backend = storage.backend()
+    start = time.perf_counter()
+    index = CreatureIndex(backend.creature_entries())
+    print(f'{len(index.creatures):,} creatures indexed in {time.perf_counter() - start:.2f}s')
+
+    encounters = [random_encounter(args.combatants, rng) for _ in range(args.encounters)]
+    scan = timed(f'{type(backend).__name__}.sample_creatures', encounters,
+                 backend.sample_creatures)
+    indexed = timed('CreatureIndex.sample', encounters,
+                    lambda encounter: [index.sample(filter, rng) for filter in encounter])
+    print(f'{scan / indexed:.0f}x faster')
+
+    # The first solve imports the flask package for the XP tables
+    solver.solve(1, 4, 'extreme', CreatureFilter(), limit=1, rng=rng, index=index)
+    start = time.perf_counter()
+    for party_level in range(1, 21):
+        solver.solve(party_level, 4, 'extreme', CreatureFilter(), limit=20, rng=rng, index=index)
+    print(f'20 extreme encounters solved in {(time.perf_counter() - start) * 50:.3f}ms'
+          f' on average over party levels 1 to 20')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import json
+import random
+import string
+from pathlib import Path
+from typing import Any
+
+import plyvel
+
+type Json = dict[str, Any]
+
+
+def foundry_id(rng: random.Random) -> str:
+    return ''.join(rng.choices(string.ascii_letters + string.digits, k=16))
+
+
+def action(item_id: str, index: int) -> Json:
+    return {
+        '_id': item_id,
+        'name': f'Action {index}',
+        'type': 'action',
+        'system': {
+            'actionType': {'value': 'action'},
+            'actions': {'value': 1},
+            'description': {'value': f'<p>The target must attempt a DC {20 + index} save.</p>'},
+            'traits': {'value': []},
+        },
+    }
+
+
+def strike(item_id: str, index: int) -> Json:
+    return {
+        '_id': item_id,
+        'name': f'Strike {index}',
+        'type': 'melee',
+        'system': {
+            'bonus': {'value': 10 + index},
+            'damageRolls': {'a': {'damage': '2d6+4', 'damageType': 'slashing'}},
+            'description': {'value': ''},
+            'traits': {'value': []},
+        },
+    }
+
+
+def npc(actor_id: str, index: int, item_ids: list[str], folder: str | None,
+        adjustment: str | None) -> Json:
+    return {
+        '_id': actor_id,
+        'name': f'Creature {index}',
+        'type': 'npc',
+        'folder': folder,
+        'items': item_ids,
+        'system': {
+            'attributes': {
+                'ac': {'value': 20},
+                'hp': {'max': 50, 'value': 50},
+                'adjustment': adjustment,
+            },
+            'details': {'level': {'value': index % 25}},
+            'perception': {'mod': 10},
+            'saves': {save: {'value': 10} for save in ['fortitude', 'reflex', 'will']},
+            'skills': {'athletics': {'base': 12}},
+        },
+    }
+
+
+def folders(rng: random.Random, depth: int, branching: int = 2) -> tuple[list[Json], list[str]]:
+    docs: list[Json] = []
+    level: list[str | None] = [None]
+    for d in range(depth):
+        children = []
+        for parent in level:
+            for i in range(branching):
+                folder_id = foundry_id(rng)
+                docs.append({'_id': folder_id, 'name': f'Folder {d}.{i}', 'type': 'Actor',
+                             'folder': parent})
+                children.append(folder_id)
+        level = children
+    return docs, [folder for folder in level if folder is not None]
+
+
+def write_pack(path: Path, actors: int, items_per_actor: int, folder_depth: int = 0,
+               adjusted: float = 0.0, seed: int = 0):
+    rng = random.Random(seed)
+    folder_docs, leaves = folders(rng, folder_depth)
+    with plyvel.DB(path.as_posix(), create_if_missing=True) as db, db.write_batch() as batch:
+        for folder in folder_docs:
+            batch.put(f'!folders!{folder['_id']}'.encode(), json.dumps(folder).encode())
+        for i in range(actors):
+            actor_id = foundry_id(rng)
+            item_ids = [foundry_id(rng) for _ in range(items_per_actor)]
+            adjustment = rng.choice(['elite', 'weak']) if rng.random() < adjusted else None
+            folder = leaves[i % len(leaves)] if leaves else None
+            batch.put(f'!actors!{actor_id}'.encode(),
+                      json.dumps(npc(actor_id, i, item_ids, folder, adjustment)).encode())
+            for j, item_id in enumerate(item_ids):
+                item = strike(item_id, j) if j % 4 == 0 else action(item_id, j)
+                batch.put(f'!actors.items!{actor_id}.{item_id}'.encode(),
+                          json.dumps(item).encode())
@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from ttrpg_scribe.pf2e_compendium.foundry import creature_index, storage
+from ttrpg_scribe.pf2e_compendium.foundry.creature_index import CreatureIndex
+from ttrpg_scribe.pf2e_compendium.foundry.storage import CreatureFilter
+
+ENTRIES = [
+    {'_id': f'npc/{i}', 'name': f'Creature {i}', 'level': i % 5,
+     'rarity': 'rare' if i % 7 == 0 else 'common', 'size': ['sm', 'med', 'lg'][i % 3],
+     'traits': ['undead'] if i % 2 else ['humanoid', 'goblin']}
+    for i in range(200)
+] + [{'_id': 'npc/unlevelled', 'name': 'Unlevelled'}]
+
+
+def test_filters_match_a_linear_scan():
+    index = CreatureIndex(ENTRIES)
+    filters = [
+        CreatureFilter(),
+        CreatureFilter(level=3),
+        CreatureFilter(level=(1, 2), rarities=['rare']),
+        CreatureFilter(sizes=['sm', 'lg'], traits=['humanoid', 'goblin']),
+        CreatureFilter(level=(0, 4), traits=['undead', 'goblin']),
+        CreatureFilter(rarities=['unique']),
+    ]
+
+    def scan(filter: CreatureFilter) -> int:
+        def matches(entry) -> bool:
+            match filter.level:
+                case int() as level:
+                    if entry.get('level') != level:
+                        return False
+                case (min_level, max_level):
+                    if 'level' not in entry or not min_level <= entry['level'] <= max_level:
+                        return False
+            return ((filter.rarities is None or entry.get('rarity') in filter.rarities)
+                    and (filter.sizes is None or entry.get('size') in filter.sizes)
+                    and all(trait in entry.get('traits', []) for trait in filter.traits or []))
+        return sum(map(matches, ENTRIES))
+
+    assert [index.count(filter) for filter in filters] == [scan(filter) for filter in filters]
+    assert index.sample(filters[-1]) is None
+
+
+def test_samples_uniformly():
+    index = CreatureIndex(ENTRIES)
+    rng = random.Random(0)
+    filter = CreatureFilter(level=(1, 2), sizes=['med'])
+    counts = Counter(index.sample(filter, rng)['_id'] for _ in range(6000))  # type: ignore
+    assert len(counts) == index.count(filter)
+    assert all(entry_id.startswith('npc/') for entry_id in counts)
+    assert max(counts.values()) < 2 * min(counts.values())
+
+
+def test_serves_old_index_while_rebuilding(monkeypatch):
+    release = threading.Event()
+    entries = [ENTRIES[:1]]
+
+    class Backend:
+        def creature_entries(self):
+            if len(entries) > 1:
+                release.wait(5)
+            return entries[-1]
+
+    monkeypatch.setattr(storage, 'backend', lambda: Backend())
+    monkeypatch.setattr(creature_index, '_index', None)
+    old = creature_index.index()
+    entries.append(ENTRIES)
+    storage.bump_generation()
+    assert creature_index.index() is old
+    assert creature_index.index() is old
+    release.set()
+    for _ in range(100):
+        if creature_index.index() is not old:
+            break
+        time.sleep(0.05)
+    assert len(creature_index.index().creatures) == len(ENTRIES)
+    assert creature_index.index().generation == storage.generation()
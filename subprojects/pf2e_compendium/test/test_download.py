@@ -0,0 +1,107 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from zipfile import ZipFile
+
+import pytest
+from rich.progress import Progress
+
+from ttrpg_scribe.pf2e_compendium import foundry
+
+FILES = {f'packs/pack{i}/content.json': f'{{"id": {i}}}' * 1000 for i in range(20)} | {
+    'system.json': '{"version": "test"}'
+}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    payload: bytes = b''
+
+    def do_GET(self):
+        start = 0
+        if (requested := self.headers.get('Range')) is not None:
+            start = int(requested.removeprefix('bytes=').split('-')[0])
+            if start >= len(self.payload):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(self.payload)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(self.payload) - 1}/{len(self.payload)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(self.payload) - start))
+        self.end_headers()
+        self.wfile.write(self.payload[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def archive(tmp_path: Path) -> bytes:
+    path = tmp_path/'fixture.zip'
+    with ZipFile(path, 'w') as zip:
+        for name, content in FILES.items():
+            zip.writestr(name, content)
+    return path.read_bytes()
+
+
+@pytest.fixture
+def server_url(archive: bytes):
+    handler = type('FixtureHandler', (RangeHandler,), {'payload': archive})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/system.zip'
+    server.shutdown()
+
+
+def test_download_and_extract(tmp_path: Path, server_url: str, archive: bytes):
+    destination = tmp_path/'downloads/system.zip'
+    with Progress(disable=True) as progress:
+        foundry.download(server_url, destination, progress)
+        foundry.extract(destination, tmp_path/'pf2e', progress, workers=4)
+    assert destination.read_bytes() == archive
+    for name, content in FILES.items():
+        assert (tmp_path/'pf2e'/name).read_text() == content
+
+
+@pytest.mark.parametrize('downloaded', [0.5, 1.0])
+def test_download_resumes(tmp_path: Path, server_url: str, archive: bytes, downloaded: float):
+    destination = tmp_path/'system.zip'
+    destination.with_name('system.zip.part').write_bytes(archive[:int(len(archive) * downloaded)])
+    with Progress(disable=True) as progress:
+        foundry.download(server_url, destination, progress)
+    assert destination.read_bytes() == archive
+
+
+def test_download_checksum_mismatch(tmp_path: Path, server_url: str):
+    destination = tmp_path/'system.zip'
+    with Progress(disable=True) as progress, pytest.raises(OSError, match='Checksum mismatch'):
+        foundry.download(server_url, destination, progress, sha256='0' * 64)
+    assert not destination.exists()
+    assert not destination.with_name('system.zip.part').exists()
+
+
+def test_download_discards_oversized_partial(tmp_path: Path, server_url: str, archive: bytes):
+    destination = tmp_path/'system.zip'
+    partial = destination.with_name('system.zip.part')
+    partial.write_bytes(archive + b'garbage')
+    with Progress(disable=True) as progress:
+        with pytest.raises(OSError, match='expected'):
+            foundry.download(server_url, destination, progress)
+        assert not partial.exists()
+        foundry.download(server_url, destination, progress)
+    assert destination.read_bytes() == archive
+
+
+def test_extract_rejects_members_outside_destination(tmp_path: Path):
+    archive = tmp_path/'evil.zip'
+    with ZipFile(archive, 'w') as zip:
+        zip.writestr('packs/ok.json', '{}')
+        zip.writestr('../../escaped/evil.json', '{}')
+    with Progress(disable=True) as progress, pytest.raises(ValueError, match='outside'):
+        foundry.extract(archive, tmp_path/'out/pf2e', progress)
+    assert not (tmp_path/'escaped').exists()
+    assert not (tmp_path.parent/'escaped').exists()
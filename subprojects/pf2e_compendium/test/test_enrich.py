@@ -1,9 +1,16 @@
+import copy
 import itertools
+from typing import Any
 
 import pytest
 from bs4 import BeautifulSoup, Tag
 
-from ttrpg_scribe.pf2e_compendium.foundry.enrich import enrich
+from ttrpg_scribe.pf2e_compendium.actor import statistics
+from ttrpg_scribe.pf2e_compendium.foundry import enrich as enrich_module
+from ttrpg_scribe.pf2e_compendium.foundry import packs, roll_data, storage
+from ttrpg_scribe.pf2e_compendium.foundry.enrich import damage, embeds, enrich
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.damage import DamageStats
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.memo import EnrichmentCache
 
 TEST_CONTEXT = {
     'actor': {
@@ -50,3 +57,166 @@ def test_damage_enricher(text: str,
     batches = itertools.batched(damage_tag.children, n=2)
     for actual, expected_damage in zip(map(extract, batches), damage):
         assert actual == expected_damage
+
+
+@pytest.mark.parametrize(['text', 'expected'], [
+    ('@Check[fortitude|dc:20|basic]', 'DC 20 basic Fortitude'),
+    ('@Check[type:flat|dc:5]', 'DC 5 Flat Check'),
+    ('[[/r 1d20+5 #fire]] and [[/act escape dc=20]]', '1d20+5 fire and Escape (DC 20)'),
+    ('@UUID[Compendium.pf2e.conditionitems.Item.Frightened]{frightened 1}', 'frightened 1'),
+    ('<p>@UUID[Compendium.pf2e.spell-effects.Item.Spell Effect: Bless]</p>', '<p></p>'),
+    ('@Template[type:line|distance:60|width:10]', '60-foot (10-foot wide) line'),
+    ('Unclosed @Damage[' + 'x' * 40, 'Unclosed @Damage[' + 'x' * 40),
+    ('[[/r 1d4] @Bad{}', '[[/r 1d4] @Bad{}'),
+])
+def test_enrichers(text: str, expected: str):
+    enriched = BeautifulSoup(enrich(text, TEST_CONTEXT), features='html.parser')
+    # Markup is only compared where the expectation has some, statistic ids vary
+    assert (str(enriched) if '<' in expected else enriched.get_text()) == expected
+
+
+@pytest.mark.parametrize('text', [
+    '@Damage[(@actor.level)d6[fire]] and @Check[reflex|dc:20|basic]',
+    '<p>@Check[will|dc:18]</p><hr />\n@Damage[2d6[cold]]{2d6 cold} [[/act escape dc=20]]',
+    'No enrichers here',
+])
+def test_cached_enrichment_matches_uncached(monkeypatch: pytest.MonkeyPatch, text: str):
+    cache = EnrichmentCache(max_texts=16, max_variants=4)
+
+    def enrich_from(first_id: int, enricher, context: dict[str, Any]) -> str:
+        monkeypatch.setattr(statistics, '_STATISTIC_ID', itertools.count(first_id))
+        return enricher(text, context)
+
+    def cached(text: str, context: dict[str, Any]):
+        return cache.get_or_enrich(text, context, enrich_module._enrich)
+
+    for level in [3, 4, 3]:
+        context = {'actor': {'level': level, 'name': f'Goblin {level}'}}
+        assert enrich_from(10, cached, context) == enrich_from(10, enrich_module._enrich, context)
+    assert cache.stats()['misses'] == (2 if '@actor' in text else 1)
+
+
+def test_cache_keys_on_the_values_read():
+    cache = EnrichmentCache(max_texts=16, max_variants=4)
+    text = '@Damage[(@actor.level)d6[fire]]'
+
+    def dice(context: dict[str, Any]) -> str:
+        enriched = cache.get_or_enrich(text, context, enrich_module._enrich)
+        return BeautifulSoup(enriched, features='html.parser').get_text()
+
+    assert dice({'actor': {'level': 3, 'hp': 30}}) == '3d6 fire'
+    assert dice({'actor': {'level': 3, 'hp': 45}, 'item': {}}) == '3d6 fire'
+    assert dice({'actor': {'level': 5}}) == '5d6 fire'
+    assert cache.stats() | {'generation': 0} == {
+        'hits': 1, 'misses': 2, 'uncacheable': 0, 'hit_rate': 1 / 3, 'texts': 1, 'variants': 2,
+        'generation': 0}
+
+
+def test_cache_entry_evicted_during_lookup():
+    cache = EnrichmentCache(max_texts=16, max_variants=4)
+    text = '@Damage[(@actor.level)d6[fire]]'
+    cache.get_or_enrich(text, {'actor': {'level': 3}}, enrich_module._enrich)
+
+    class Evicting(dict):
+        # Reading the context happens outside the lock, another thread can clear it meanwhile
+        def __getitem__(self, key):
+            cache.clear()
+            return super().__getitem__(key)
+
+    enriched = cache.get_or_enrich(text, Evicting(actor={'level': 3}), enrich_module._enrich)
+    assert BeautifulSoup(enriched, features='html.parser').get_text() == '3d6 fire'
+    assert cache.stats()['misses'] == 2
+
+
+def test_pre_enriched_descriptions_match_live(monkeypatch: pytest.MonkeyPatch):
+    def item(type: str, description: str):
+        return {'_id': type, 'name': type.title(), 'type': type,
+                'system': {'description': {'value': description}}}
+
+    doc = {
+        'type': 'npc', 'name': 'Goblin',
+        'system': {'details': {'level': {'value': 4}}, 'traits': {'value': ['goblin']}},
+        'items': [item('action', '@Damage[(@actor.level)d6[fire]] @Check[reflex|dc:20|basic]'),
+                  item('melee', '[[/r 1d4 #bleed]]'),
+                  item('effect', 'Effect: @Damage[1d6]')],
+    }
+    live = copy.deepcopy(doc)
+    again = copy.deepcopy(doc)
+    packs.pre_enrich(doc)
+    packs.pre_enrich(again)
+    # Imports of unchanged content must store identical documents
+    assert again == doc
+    action, melee, effect = (item['system']['description'] for item in doc['items'])
+    assert action['enricherVersion'] == melee['enricherVersion'] == enrich_module.VERSION
+    assert 'enriched' not in effect
+    assert 'enriched' not in doc['system'].get('description', {})
+
+    def read(json, context):
+        monkeypatch.setattr(statistics, '_STATISTIC_ID', itertools.count(1))
+        return packs._description(json, context)
+
+    context = roll_data.actor(live) | roll_data.item(live['items'][0])
+    assert read(doc['items'][0], context) == read(live['items'][0], context)
+    assert read(doc['items'][1], {}) == read(live['items'][1], {})
+    action['enriched'] = 'stored'
+    assert read(doc['items'][0], context) == 'stored'
+    action['enricherVersion'] = enrich_module.VERSION - 1
+    assert read(doc['items'][0], context) == read(live['items'][0], context)
+
+
+@pytest.mark.parametrize(['formula', 'context', 'expected'], [
+    ('(2d6 + 4)[fire]', {}, DamageStats(6, 11, 16)),
+    ('(@actor.level)d6[fire]', TEST_CONTEXT, DamageStats(3, 10.5, 18)),
+    ('5d6[acid],5d6[cold]', {}, DamageStats(10, 35, 60)),
+    ('(2d6 + 4 + (2d6[precision]))[slashing]', {}, DamageStats(8, 18, 28)),
+    ('5[splash]', {}, DamageStats(5, 5, 5)),
+])
+def test_compiled_damage_formulas(formula: str, context: dict[str, Any], expected: DamageStats):
+    compiled = damage.compile_formula(formula)
+    assert isinstance(compiled, damage.CompiledFormula)
+    assert damage.compile_formula(formula) is compiled
+    assert compiled.constant == ('@' not in formula)
+    assert compiled.stats(context) == expected
+    # Evaluations don't share state, damage instances are mutated as they're built
+    assert str(compiled(context)) == str(compiled(context))
+
+
+def _embedded_docs(monkeypatch: pytest.MonkeyPatch, descriptions: dict[str, str]
+                   ) -> list[list[str]]:
+    queries: list[list[str]] = []
+
+    def get_documents(collection: str, doc_ids, id_type: storage.IdType = 'path',
+                      optional=False):
+        assert (collection, id_type, optional) == ('all', 'uuid', True)
+        queries.append(sorted(doc_ids))
+        return {id: {'foundry_id': id, 'system': {'description': {'value': descriptions[id]}}}
+                for id in doc_ids if id in descriptions}
+    monkeypatch.setattr(storage, 'get_documents', get_documents)
+    monkeypatch.setattr(enrich_module, 'enrichment_cache', EnrichmentCache(16, 4))
+    return queries
+
+
+def test_embeds_are_fetched_in_one_query_per_depth(monkeypatch: pytest.MonkeyPatch):
+    queries = _embedded_docs(monkeypatch, {
+        'a': 'A @Embed[Compendium.pf2e.x.Item.c inline]',
+        'b': 'B',
+        'c': 'C @Embed[Compendium.pf2e.x.Item.b inline]',
+    })
+    texts = ['@Embed[Compendium.pf2e.x.Item.a inline]', '@Embed[Compendium.pf2e.x.Item.b inline]']
+    with embeds.batch(texts):
+        enriched = [enrich(text) for text in texts]
+    assert enriched == ['<div class="details">A <div class="details">C '
+                        '<div class="details">B</div></div></div>',
+                        '<div class="details">B</div>']
+    assert queries == [['a', 'b'], ['c']]
+
+
+def test_embed_cycles_and_missing_targets(monkeypatch: pytest.MonkeyPatch):
+    _embedded_docs(monkeypatch, {
+        'a': '@Embed[Compendium.pf2e.x.Item.b inline]',
+        'b': '@Embed[Compendium.pf2e.x.Item.a inline]',
+    })
+    with pytest.raises(ValueError, match='a -> b -> a'):
+        enrich('@Embed[Compendium.pf2e.x.Item.a inline]')
+    with pytest.raises(KeyError, match='missing not found'):
+        enrich('@Embed[Compendium.pf2e.x.Item.missing inline]')
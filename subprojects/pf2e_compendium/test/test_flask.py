@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import flask.testing
+import pytest
+
+from ttrpg_scribe.pf2e_compendium import foundry, oracle
+from ttrpg_scribe.pf2e_compendium.flask import create_app
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.sqlite_storage import SqliteStorage
+
+
+@pytest.fixture
+def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> flask.testing.FlaskClient:
+    monkeypatch.setattr(storage, '_backend', SqliteStorage(tmp_path/'compendium.sqlite3'))
+    monkeypatch.setattr(foundry, 'wait_until_ready', lambda timeout=None: True)
+    app = create_app()
+    oracle.extend(app)
+    return app.test_client()
+
+
+def test_complex_search_needs_backend_support(client: flask.testing.FlaskClient):
+    response = client.post('/compendium/search?query_type=complex&doc_type=npc',
+                           json={'name': 'Goblin'})
+    assert response.status_code == 400
+    assert b'SqliteStorage' in response.data
+
+
+@pytest.mark.parametrize('match', ['prefix', 'fuzzy'])
+@pytest.mark.parametrize('limit', [0, -1, 1001])
+def test_search_rejects_limits_out_of_range(client: flask.testing.FlaskClient, match: str,
+                                            limit: int):
+    response = client.post(f'/compendium/search?query=gob&match={match}&limit={limit}')
+    assert response.status_code == 400
+    assert b'limit must be between 1 and 1000' in response.data
+
+
+@pytest.mark.parametrize(['body', 'config', 'message'], [
+    ({'party-level': 3, 'party-size': 4}, {}, 'threat is required'),
+    ({'threat': 'moderate', 'party-size': 4}, {}, 'party-level is required'),
+    ({'threat': 'moderate', 'party-level': 3}, {}, 'party-size is required'),
+    ({'threat': 'moderate'}, {'PARTY_LEVEL': 3, 'PARTY': {}}, 'Party size'),
+    ({'threat': 'moderate', 'count': '5'}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}},
+     'count must be of type int'),
+    ({'threat': 'moderate', 'count': 0}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}},
+     'count must be at least 1'),
+    ({'threat': 'moderate', 'max-creatures': True}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}},
+     'max-creatures must be of type int'),
+    ({'threat': 'moderate', 'seed': [1]}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}}, 'seed'),
+    ({'threat': 'moderate', 'size': ['colossal']}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}},
+     'Unknown sizes colossal'),
+    ({'threat': 'moderate', 'traits': 'undead'}, {'PARTY_LEVEL': 3, 'PARTY': {'a': {}}},
+     'traits must be a list'),
+])
+def test_solve_rejects_bad_input(client: flask.testing.FlaskClient, body: dict,
+                                 config: dict, message: str):
+    assert client.application
+    client.application.config.update(config)
+    response = client.post('/oracle/solve', json=body)
+    assert response.status_code == 400
+    assert message in response.get_data(as_text=True)
+
+
+def test_solve_rejects_non_object_body(client: flask.testing.FlaskClient):
+    response = client.post('/oracle/solve', json=[1])
+    assert response.status_code == 400
+
+
+def test_static_assets_skip_the_readiness_gate(client: flask.testing.FlaskClient,
+                                               monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(foundry, 'wait_until_ready', lambda timeout=None: False)
+    assert client.get('/compendium/static/pf2e.css').status_code == 200
+    assert client.get('/compendium/list').status_code == 503
@@ -0,0 +1,77 @@
+import random
+import threading
+import time
+
+from ttrpg_scribe.pf2e_compendium.foundry import fuzzy, storage
+from ttrpg_scribe.pf2e_compendium.foundry.fuzzy import TrigramIndex, trigrams
+
+ENTRIES = [
+    {'_id': 'npc/gargoyle', 'doc_type': 'npc', 'name': 'Gargoyle', 'level': 4},
+    {'_id': 'npc/goblin-warrior', 'doc_type': 'npc', 'name': 'Goblin Warrior', 'level': -1},
+    {'_id': 'spell/fireball', 'doc_type': 'spell', 'name': 'Fireball', 'level': 3},
+    {'_id': 'npc/elite-gargoyle', 'doc_type': 'npc', 'name': 'Elite Gargoyle',
+     'base_name': 'Gargoyle', 'level': 5},
+]
+
+
+def test_finds_names_despite_typos():
+    index = TrigramIndex(ENTRIES, budget=2**20)
+    results = index.search('gargole')
+    assert [result['_id'] for result in results][:2] == ['npc/elite-gargoyle', 'npc/gargoyle']
+    assert 'base_name' not in results[0]
+    assert index.search('fierball', doc_types={'npc'}) == []
+    assert index.search('fierball')[0]['_id'] == 'spell/fireball'
+    assert index.search('') == []
+
+
+def test_drops_common_grams_to_fit_the_budget():
+    full = TrigramIndex(ENTRIES, budget=2**20)
+    small = TrigramIndex(ENTRIES, budget=full.nbytes() - 1)
+    assert full.dropped == 0
+    assert small.dropped > 0
+    assert small.nbytes() < full.nbytes()
+
+
+def test_ranks_like_scoring_every_name():
+    rng = random.Random(7)
+    words = [''.join(rng.choice('aeiourstlnkgb') for _ in range(rng.randint(3, 8)))
+             for _ in range(400)]
+    entries = [{'_id': f'npc/{i}', 'doc_type': 'npc',
+                'name': ' '.join(rng.sample(words, rng.randint(1, 3)))} for i in range(600)]
+    index = TrigramIndex(entries, budget=2**30)
+    assert index._bitsets and index._postings
+    for query in rng.sample([entry['name'] for entry in entries], 20) + ['kagu', 'strolin']:
+        grams = trigrams(query)
+        expected = sorted(((len(grams & (key := trigrams(entry['name']))) / len(grams | key),
+                            entry['name'], i) for i, entry in enumerate(entries)),
+                          key=lambda t: (-t[0], t[1], t[2]))
+        expected = [(entries[i]['_id'], round(score, 3))
+                    for score, _, i in expected if score >= 0.3][:10]
+        assert [(result['_id'], result['score'])
+                for result in index.search(query, limit=10)] == expected
+
+
+def test_serves_old_index_while_rebuilding(monkeypatch):
+    release = threading.Event()
+    entries = [ENTRIES[:1]]
+
+    class Backend:
+        def search_entries(self):
+            if len(entries) > 1:
+                release.wait(5)
+            return entries[-1]
+
+    monkeypatch.setattr(storage, 'backend', lambda: Backend())
+    monkeypatch.setattr(fuzzy, '_index', None)
+    old = fuzzy.index()
+    entries.append(ENTRIES)
+    storage.bump_generation()
+    assert fuzzy.index() is old
+    assert fuzzy.index() is old
+    release.set()
+    for _ in range(100):
+        if fuzzy.index() is not old:
+            break
+        time.sleep(0.05)
+    assert len(fuzzy.index().entries) == len(ENTRIES)
+    assert fuzzy.index().generation == storage.generation()
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import packs, storage
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(foundry, 'ready', threading.Event())
+    monkeypatch.setattr(foundry, 'failure', None)
+    monkeypatch.setattr(foundry, '_initialiser', None)
+
+
+def test_waits_for_background_initialisation(monkeypatch: pytest.MonkeyPatch):
+    release = threading.Event()
+
+    def initialise(*args):
+        release.wait()
+        foundry.ready.set()
+
+    monkeypatch.setattr(foundry, 'initialise', initialise)
+    thread = foundry.initialise_in_background()
+    assert not foundry.wait_until_ready(timeout=0.01)
+    release.set()
+    assert foundry.wait_until_ready(timeout=5)
+    thread.join()
+
+
+def test_background_failure_is_reported(monkeypatch: pytest.MonkeyPatch):
+    def initialise(*args):
+        raise OSError('mongod is not installed')
+
+    monkeypatch.setattr(foundry, 'initialise', initialise)
+    foundry.initialise_in_background().join()
+    with pytest.raises(RuntimeError) as info:
+        foundry.wait_until_ready(timeout=0)
+    assert isinstance(info.value.__cause__, OSError)
+
+
+def test_compendium_reads_wait_for_background_initialisation(monkeypatch: pytest.MonkeyPatch):
+    release = threading.Event()
+    reads = []
+
+    def initialise(*args):
+        release.wait()
+        foundry.ready.set()
+
+    monkeypatch.setattr(foundry, 'initialise', initialise)
+    monkeypatch.setattr(storage, 'get_document', lambda collection, id: reads.append(id) or {
+        '_id': id, 'name': 'Fireball', 'type': 'spell',
+        'system': {'level': {'value': 3}, 'traits': {'value': [], 'rarity': 'common'},
+                   'time': {'value': '2'}, 'description': {'value': ''}}})
+    initialiser = foundry.initialise_in_background()
+    reader = threading.Thread(target=packs.spell, args=['spells/fireball'])
+    reader.start()
+    reader.join(0.1)
+    assert reads == []
+    release.set()
+    reader.join(5)
+    assert reads == ['spells/fireball']
+    initialiser.join()
@@ -0,0 +1,63 @@
+import json
+import subprocess
+import sys
+
+import pymongo
+import pytest
+
+from ttrpg_scribe.pf2e_compendium.foundry import mongo_client, pack_reader
+
+
+@pytest.mark.parametrize(['doc', 'expected'], [
+    ({'_id': 'a', 'name': 'Brace {', 'type': 'army'}, 'army'),
+    ({'img': {'type': 'script'}, 'type': 'npc'}, None),
+    ({'name': '"type":"army"', 'type': 'npc'}, 'npc'),
+    ({'system': {'type': 'npc'}}, None),
+])
+def test_peek_type(doc, expected):
+    assert pack_reader._peek_type(json.dumps(doc).encode()) == expected
+
+
+def test_wait_for_server_notices_exited_mongod():
+    server = subprocess.Popen([sys.executable, '-c', 'raise SystemExit(3)'])
+    server.wait()
+    with pytest.raises(RuntimeError, match='code 3'):
+        mongo_client.wait_for_server(server, timeout=1)
+
+
+def test_storage_follows_configured_client(monkeypatch):
+    for name in ['client', 'db', 'meta_db', '_warm_connections']:
+        monkeypatch.setattr(mongo_client, name, getattr(mongo_client, name))
+    # configure() closes the client it replaces, so give it one of its own to close
+    monkeypatch.setattr(mongo_client, 'client', pymongo.MongoClient(connect=False))
+    backend = mongo_client.MongoStorage()
+    mongo_client.configure(max_pool_size=5)
+    assert backend.db.client is mongo_client.client
+    assert backend.meta_db.name == 'pf2e_meta'
+    mongo_client.client.close()
+
+
+def test_removing_art_reapplies_same_stem_sibling(monkeypatch):
+    recorded = {'npc/goblin.png': 1, 'npc/goblin.webp': 1, 'npc/orc.png': 1}
+    current = {'npc/goblin.png': 1, 'npc/orc.png': 1}
+
+    class Art:
+        def find(self):
+            return [{'_id': path, 'mtime': mtime} for path, mtime in recorded.items()]
+
+        def delete_many(self, query):
+            for path in query['_id']['$in']:
+                del recorded[path]
+
+    class MetaDb:
+        art = Art()
+
+    calls = []
+    monkeypatch.setattr(mongo_client, 'meta_db', MetaDb())
+    monkeypatch.setattr(mongo_client, '_art_files', lambda suffixes: current)
+    monkeypatch.setattr(mongo_client, '_unset_art', lambda paths: [('unset', list(paths))])
+    monkeypatch.setattr(mongo_client, '_set_art', lambda paths: [('set', list(paths))])
+    monkeypatch.setattr(mongo_client, 'bulk_write', lambda ops: calls.extend(ops) or {'failed': 0})
+    mongo_client.sync_art()
+    assert calls == [('unset', ['npc/goblin.webp']), ('set', ['npc/goblin.png'])]
+    assert recorded == current
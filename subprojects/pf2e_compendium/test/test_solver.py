@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from ttrpg_scribe.pf2e_compendium.flask import Pf2ePlugin
+from ttrpg_scribe.pf2e_compendium.foundry.creature_index import CreatureIndex
+from ttrpg_scribe.pf2e_compendium.foundry.storage import CreatureFilter
+from ttrpg_scribe.pf2e_compendium.oracle import solver
+
+ENTRIES = [
+    {'_id': f'npc/{i}', 'name': f'Creature {i}', 'level': i % 12, 'rarity': 'common',
+     'size': 'med', 'traits': ['undead'] if i % 2 else ['humanoid']}
+    for i in range(240)
+]
+
+
+def test_combinations_hit_the_budget_exactly():
+    xp_by_level = {level: Pf2ePlugin.creature_xp(level, 5) for level in range(1, 10)}
+    combinations = list(solver.level_combinations(xp_by_level, 120, max_creatures=4))
+    assert [(5, 3)] in combinations
+    assert len({tuple(c) for c in combinations}) == len(combinations)
+    for combination in combinations:
+        assert sum(count for _, count in combination) <= 4
+        assert sum(count * xp_by_level[level] for level, count in combination) == 120
+
+
+@pytest.mark.parametrize('threat', ['trivial', 'Moderate', 'extreme'])
+def test_solved_encounters_match_the_threat(threat: str):
+    encounters = solver.solve(5, 5, threat, CreatureFilter(traits=['undead']), limit=20,
+                              rng=random.Random(0), index=CreatureIndex(ENTRIES))
+    assert len(encounters) == 20
+    assert len({str(encounter) for encounter in encounters}) == 20
+    for encounter in encounters:
+        combatants = encounter['combatants']
+        assert all(int(c['_id'].removeprefix('npc/')) % 2 for c in combatants)
+        description = Pf2ePlugin.compute_xp(
+            [(c['quantity'], c['level']) for c in combatants], [], 5, 5)
+        assert description.endswith(f'({threat.title()})')
+
+
+def test_unknown_threat():
+    with pytest.raises(ValueError):
+        solver.budget(4, 'deadly')
+
+
+@pytest.mark.parametrize(['party_size', 'max_creatures'], [(0, 4), (500, 4), (4, 0), (4, 200)])
+def test_out_of_range_requests(party_size: int, max_creatures: int):
+    with pytest.raises(ValueError, match='between 1 and'):
+        solver.solve(5, party_size, 'moderate', CreatureFilter(), max_creatures=max_creatures,
+                     index=CreatureIndex(ENTRIES))
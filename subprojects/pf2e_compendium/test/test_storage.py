@@ -0,0 +1,328 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import plyvel
+import pymongo
+import pytest
+from rich.progress import Progress
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import (mongo_client, pack_reader,
+                                                  packs, storage)
+from ttrpg_scribe.pf2e_compendium.foundry.creature_index import CreatureIndex
+from ttrpg_scribe.pf2e_compendium.foundry.mongo_client import MongoStorage
+from ttrpg_scribe.pf2e_compendium.foundry.sqlite_storage import SqliteStorage
+from ttrpg_scribe.pf2e_compendium.foundry.storage import (CreatureFilter,
+                                                          DocumentCache,
+                                                          MatchMode, Storage)
+
+
+def test_cache_returns_independent_copies():
+    cache = DocumentCache(max_entries=10, max_bytes=2**20)
+    cache.put(('npc', 'path', 'a'), {'_id': 'a', 'items': []}, storage.generation())
+    first = cache.get(('npc', 'path', 'a'))
+    assert first is not None
+    first['items'].append('mutated')
+    assert cache.get(('npc', 'path', 'a')) == {'_id': 'a', 'items': []}
+    assert cache.stats()['hits'] == 2
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DocumentCache(max_entries=2, max_bytes=2**20)
+    for doc_id in 'abc':
+        if doc_id == 'c':
+            cache.get(('npc', 'path', 'a'))
+        cache.put(('npc', 'path', doc_id), {'_id': doc_id}, storage.generation())
+    assert cache.get(('npc', 'path', 'b')) is None
+    assert cache.get(('npc', 'path', 'a')) is not None
+    assert cache.get(('npc', 'path', 'c')) is not None
+
+
+def test_cache_respects_byte_limit():
+    cache = DocumentCache(max_entries=10, max_bytes=100)
+    for doc_id in 'ab':
+        cache.put(('npc', 'path', doc_id), {'_id': doc_id, 'padding': 'x' * 40},
+                  storage.generation())
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] <= 100
+
+
+def test_cache_invalidated_by_generation():
+    cache = DocumentCache(max_entries=10, max_bytes=2**20)
+    read_generation = storage.generation()
+    cache.put(('npc', 'path', 'a'), {'_id': 'a'}, read_generation)
+    storage.bump_generation()
+    assert cache.get(('npc', 'path', 'a')) is None
+    # Documents read before the bump must not repopulate the cache
+    cache.put(('npc', 'path', 'a'), {'_id': 'a'}, read_generation)
+    assert cache.get(('npc', 'path', 'a')) is None
+
+
+def test_model_cache_hands_out_copies():
+    cache = packs.ModelCache(max_entries=10)
+    reads = []
+
+    def read():
+        reads.append(1)
+        return {'name': 'Goblin', 'traits': ['goblin']}
+
+    first = cache.get_or_read(('creature', 'npc', 'goblin'), read)
+    first['traits'].append('elite')
+    second = cache.get_or_read(('creature', 'npc', 'goblin'), read)
+    assert second == {'name': 'Goblin', 'traits': ['goblin']}
+    assert len(reads) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_batched_reads_report_every_missing_id(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(storage, 'get_documents',
+                        lambda collection, ids, optional: {'goblin': {'_id': 'goblin'}})
+    with pytest.raises(KeyError) as info:
+        packs.creatures('goblin', 'orc', 'kobold')
+    assert 'npc/orc, npc/kobold' in str(info.value)
+
+
+def _creature(id: str, name: str, level: int, rarity: str, size: str, traits: list[str],
+              subpath: str):
+    return {
+        '_id': f'bestiary/{id}', 'foundry_id': f'uuid-{id}', 'name': name,
+        'path': {'pack': 'bestiary', 'subpath': subpath, 'stem': id},
+        'system': {'details': {'level': {'value': level}},
+                   'traits': {'rarity': rarity, 'size': {'value': size}, 'value': traits}},
+    }
+
+
+_CONTENT = {
+    'npc': [
+        _creature('goblin-warrior', 'Goblin Warrior', -1, 'common', 'sm',
+                  ['goblin', 'humanoid'], ''),
+        _creature('orc-brute', 'Orc Brute', 0, 'uncommon', 'med', ['orc', 'humanoid'], 'orcs'),
+    ],
+    'hazard': [{
+        '_id': 'traps/spike-pit', 'foundry_id': 'uuid-spike-pit', 'name': 'Spike Pit',
+        'path': {'pack': 'traps', 'subpath': '', 'stem': 'spike-pit'}, 'volatile': True,
+        'system': {'details': {'level': {'value': 0}}, 'traits': {'rarity': 'common'}},
+    }],
+}
+
+
+def _start_mongod(data: Path, port: int):
+    mongod = shutil.which('mongod')
+    if mongod is None:
+        pytest.skip('mongod is not installed')
+    server = subprocess.Popen([mongod, '--dbpath', data.as_posix(), '--bind_ip', '127.0.0.1',
+                               '--port', str(port)], stdout=subprocess.DEVNULL)
+    client: pymongo.MongoClient = pymongo.MongoClient('127.0.0.1', port, timeoutMS=10000)
+    for _ in range(100):
+        try:
+            client.admin.command('ping')
+            break
+        except pymongo.errors.PyMongoError:
+            time.sleep(0.1)
+    return server, client
+
+
+@pytest.fixture(params=['mongo', 'sqlite'])
+def backend(request: pytest.FixtureRequest, tmp_path: Path):
+    match request.param:
+        case 'mongo':
+            server, client = _start_mongod(tmp_path, 48170)
+            backend: Storage = MongoStorage(client)
+        case 'sqlite':
+            backend = SqliteStorage(tmp_path/'compendium.sqlite3')
+    for collection, docs in _CONTENT.items():
+        backend.upsert(collection, docs)
+    if isinstance(backend, MongoStorage):
+        backend.db.command('create', 'all', viewOn='npc', pipeline=[{'$unionWith': 'hazard'}])
+    yield backend
+    if request.param == 'mongo':
+        client.close()
+        server.terminate()
+        server.wait()
+
+
+def test_find_documents(backend: Storage):
+    assert [doc['name'] for doc in backend.find_documents(
+        'npc', ['bestiary/orc-brute', 'bestiary/missing'], 'path')] == ['Orc Brute']
+    assert [doc['name'] for doc in backend.find_documents(
+        'all', ['uuid-spike-pit'], 'uuid')] == ['Spike Pit']
+    assert backend.find_documents('hazard', ['bestiary/orc-brute'], 'path') == []
+
+
+def test_listing(backend: Storage):
+    assert sorted(backend.collection_names()) == ['hazard', 'npc']
+    assert backend.pack_names('npc') == ['bestiary']
+    assert backend.pack_content('npc', 'bestiary', '') == [
+        {'_id': 'bestiary/goblin-warrior', 'name': 'Goblin Warrior'}]
+    assert backend.pack_subpaths('npc', 'bestiary') == ['orcs']
+
+
+def test_search(backend: Storage):
+    def names(query: str, mode: MatchMode):
+        return [doc['name'] for doc in backend.search(['npc', 'hazard'], query, mode).results]
+
+    assert backend.search(['npc', 'hazard'], 'spike').results == [
+        {'_id': 'traps/spike-pit', 'doc_type': 'hazard', 'name': 'Spike Pit', 'level': 0,
+         'rarity': 'common', 'worldContent': True},
+    ]
+    assert names('', 'prefix') == ['Goblin Warrior', 'Orc Brute', 'Spike Pit']
+    assert names('ORC', 'prefix') == ['Orc Brute']
+    assert names('brute', 'prefix') == []
+    assert names('brute', 'text') == ['Orc Brute']
+    assert names('r[iu]', 'regex') == ['Goblin Warrior', 'Orc Brute']
+    assert [doc['name'] for doc in backend.search(['hazard'], '').results] == ['Spike Pit']
+
+
+def test_search_pages(backend: Storage):
+    first = backend.search(['npc', 'hazard'], '', limit=2)
+    assert [doc['name'] for doc in first.results] == ['Goblin Warrior', 'Orc Brute']
+    assert first.next is not None
+    second = backend.search(['npc', 'hazard'], '', limit=2, cursor=first.next)
+    assert [doc['name'] for doc in second.results] == ['Spike Pit']
+    assert second.next is None
+
+
+def test_sample_creatures(backend: Storage):
+    assert backend.sample_creatures([
+        CreatureFilter(level=(0, 2)),
+        CreatureFilter(traits=['goblin', 'humanoid'], sizes=['sm']),
+        CreatureFilter(rarities=['rare']),
+    ]) == [
+        {'_id': 'bestiary/orc-brute', 'name': 'Orc Brute', 'level': 0, 'rarity': 'uncommon'},
+        {'_id': 'bestiary/goblin-warrior', 'name': 'Goblin Warrior', 'level': -1,
+         'rarity': 'common'},
+        None,
+    ]
+
+
+def test_creature_index_matches_sampling(backend: Storage):
+    index = CreatureIndex(backend.creature_entries())
+    filters = [
+        CreatureFilter(level=(0, 2)),
+        CreatureFilter(traits=['goblin', 'humanoid'], sizes=['sm']),
+        CreatureFilter(rarities=['rare']),
+    ]
+    assert [index.sample(filter) for filter in filters] == backend.sample_creatures(filters)
+
+
+def test_upsert_replaces(backend: Storage):
+    generation = storage.generation()
+    orc = {**_CONTENT['npc'][1], 'name': 'Orc Veteran'}
+    assert backend.upsert('npc', [orc]) == 1
+    assert storage.generation() > generation
+    [doc] = backend.find_documents('npc', ['bestiary/orc-brute'], 'path')
+    assert doc['name'] == 'Orc Veteran'
+
+
+def test_world_sync_twice_modifies_nothing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path/'mongo').mkdir()
+    server, client = _start_mongod(tmp_path/'mongo', 48171)
+    monkeypatch.setattr(mongo_client, 'client', client)
+    monkeypatch.setattr(mongo_client, 'db', client.pf2e)
+    monkeypatch.setattr(mongo_client, 'meta_db', client.pf2e_meta)
+    world = tmp_path/'worlds/test-world'
+    (world/'data').mkdir(parents=True)
+    actor = {'_id': 'goblin', 'name': 'Goblin', 'type': 'npc', 'items': ['jab'],
+             'system': {'details': {'level': {'value': 1}}, 'traits': {'value': []}}}
+    jab = {'_id': 'jab', 'name': 'Jab', 'type': 'action', 'system': {'description': {
+        'value': '@Check[reflex|dc:20|basic] @Damage[2d6[fire]]'}}}
+    for name, entries in [('folders', {}),
+                          ('actors', {'!actors!goblin': actor, '!actors.items!goblin.jab': jab}),
+                          ('items', {})]:
+        with plyvel.DB((world/'data'/name).as_posix(), create_if_missing=True) as level_db:
+            for key, value in entries.items():
+                level_db.put(key.encode(), json.dumps(value).encode())
+
+    writes = []
+
+    def bulk_write(*args, **kwargs):
+        writes.append(totals := original(*args, **kwargs))
+        return totals
+    original = mongo_client.bulk_write
+    monkeypatch.setattr(mongo_client, 'bulk_write', bulk_write)
+    try:
+        mongo_client.sync_world_content(world)
+        assert writes[0]['upserted'] == 1
+        writes.clear()
+        mongo_client.sync_world_content(world, force=True)
+        assert writes[0]['upserted'] == writes[0]['modified'] == writes[0]['deleted'] == 0
+        assert len(writes) == 1  # Art isn't re-applied to unchanged documents
+    finally:
+        client.close()
+        server.terminate()
+        server.wait()
+
+
+def test_sqlite_update_reimports_changed_packs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(foundry, 'pf2e_dir', tmp_path/'pf2e')
+
+    def write_pack(name: str, actors: list[str]):
+        with (plyvel.DB((tmp_path/'pf2e/packs'/name).as_posix(), create_if_missing=True) as db,
+              db.write_batch() as batch):
+            for actor in actors:
+                batch.put(f'!actors!{actor}'.encode(), json.dumps({
+                    '_id': actor, 'name': actor.title(), 'type': 'npc', 'items': [],
+                    'system': {'details': {'level': {'value': 1}}}}).encode())
+
+    def write_system(names: list[str]):
+        (tmp_path/'pf2e/system.json').write_text(json.dumps({'packs': [
+            {'name': name, 'path': f'packs/{name}'} for name in names]}))
+
+    read = []
+
+    def read_pack(name, path):
+        read.append(name)
+        return original(name, path)
+    original = pack_reader.read_pack
+    monkeypatch.setattr(pack_reader, 'read_pack', read_pack)
+    (tmp_path/'pf2e/packs').mkdir(parents=True)
+    write_pack('goblins', ['boss'])
+    write_pack('kobolds', ['scout'])
+    write_system(['goblins', 'kobolds'])
+    backend = SqliteStorage(tmp_path/'compendium.sqlite3')
+    backend.update(Progress(disable=True))
+    assert sorted(read) == ['goblins', 'kobolds']
+    read.clear()
+    backend.update(Progress(disable=True))
+    assert read == []
+    write_pack('goblins', ['boss', 'warrior'])
+    write_system(['goblins'])
+    backend.update(Progress(disable=True))
+    assert read == ['goblins']
+    assert sorted(doc['_id'] for doc in backend.find_documents(
+        'npc', ['goblins/boss', 'goblins/warrior', 'kobolds/scout'], 'path')) == [
+        'goblins/boss', 'goblins/warrior']
+
+
+def test_sqlite_backend_does_not_import_mongo_client():
+    # Importing mongo_client constructs a client, which a SQLite compendium has no server for
+    subprocess.run([sys.executable, '-c', 'import sys\n'
+                    'import ttrpg_scribe.pf2e_compendium.flask\n'
+                    'from ttrpg_scribe.pf2e_compendium.foundry import storage\n'
+                    'storage.configure(storage.MongoPool(warm_connections=8))\n'
+                    'storage.backend()\n'
+                    'assert "ttrpg_scribe.pf2e_compendium.foundry.mongo_client" '
+                    'not in sys.modules'],
+                   env=os.environ | {'PF2E_COMPENDIUM_STORAGE': 'sqlite'}, check=True)
+
+
+def test_model_cache_copies_have_their_own_statistic_ids(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(packs, 'model_cache', packs.ModelCache(max_entries=10))
+    monkeypatch.setattr(storage, 'get_document', lambda collection, id: {
+        '_id': id, 'name': 'Fireball', 'type': 'spell',
+        'system': {'level': {'value': 3}, 'traits': {'value': [], 'rarity': 'common'},
+                   'time': {'value': '2'},
+                   'description': {'value': '@Check[reflex|dc:20|basic]'}}})
+
+    def ids(spell) -> list[str]:
+        return re.findall(r'id="(statistic-[\w-]+)"', spell.description)
+    first, second = packs.spell('spells/fireball'), packs.spell('spells/fireball')
+    assert packs.model_cache.stats()['hits'] == 1
+    assert ids(first) and ids(second)
+    assert not set(ids(first)) & set(ids(second))
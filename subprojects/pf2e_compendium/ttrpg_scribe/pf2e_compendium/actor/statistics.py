@@ -285,10 +285,14 @@ EXTREME = StatisticBracket('Extreme')
 _STATISTIC_ID = itertools.count(1)
 
 
+def next_statistic_id() -> int:
+    return next(_STATISTIC_ID)
+
+
 def inline_html(text: str, table: str, **data_attrs: str):
     return Tag('span', text=text, attrs={
         'class': 'statistic',
         'data-table': table,
-        'id': f'statistic-{table}-{next(_STATISTIC_ID)}',
+        'id': f'statistic-{table}-{next_statistic_id()}',
         **{f'data-{k.replace('_', '-')}': v for k, v in data_attrs.items()}
     })
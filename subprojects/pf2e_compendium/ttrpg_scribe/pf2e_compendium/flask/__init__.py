@@ -1,11 +1,10 @@
 import math
-import re
 from typing import Any, Iterable
 
 import flask
 from flask import Blueprint, Flask, json, render_template, request
 from markupsafe import Markup
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import NotFound, ServiceUnavailable
 
 import ttrpg_scribe.core.flask
 import ttrpg_scribe.core.typescript
@@ -17,7 +16,7 @@ from ttrpg_scribe.encounter.flask import (EncounterSpec, InitiativeParticipant,
 from ttrpg_scribe.pf2e_compendium import foundry
 from ttrpg_scribe.pf2e_compendium.actor import PF2Actor, analyser, templates
 from ttrpg_scribe.pf2e_compendium.creature import PF2Creature
-from ttrpg_scribe.pf2e_compendium.foundry import mongo_client
+from ttrpg_scribe.pf2e_compendium.foundry import fuzzy, storage
 from ttrpg_scribe.pf2e_compendium.foundry import packs as foundry_packs
 from ttrpg_scribe.pf2e_compendium.hazard import PF2Hazard
 
@@ -28,24 +27,36 @@ blueprint = Blueprint('pf2e_compendium', __name__,
 ttrpg_scribe.core.typescript.extend(blueprint)
 
 
+@blueprint.before_request
+def require_compendium():
+    # Static assets don't need the compendium, so pages can load while it warms up
+    if flask.has_request_context() and (request.endpoint or '').endswith(
+            ('.static', '.static_javascript')):
+        return
+    timeout: float = flask.current_app.config.get('COMPENDIUM_READY_TIMEOUT', 10)
+    if not foundry.wait_until_ready(timeout):
+        raise ServiceUnavailable('The compendium is warming up, try again shortly',
+                                 retry_after=5)
+
+
 @blueprint.get('/')
 @blueprint.get('/list')
 def list_collections():
-    return render_template('collection_list.j2.html', types=mongo_client.get_collection_names())
+    return render_template('collection_list.j2.html', types=storage.backend().collection_names())
 
 
 @blueprint.get('/list/<doc_type>')
 def list_packs(doc_type: str):
     return render_template('pack_list.j2.html', type=doc_type,
-                           packs=mongo_client.get_pack_names(doc_type))
+                           packs=storage.backend().pack_names(doc_type))
 
 
 @blueprint.get('/list/<doc_type>/<pack>')
 @blueprint.get('/list/<doc_type>/<pack>/<path:subpath>')
 def list_content(doc_type: str, pack: str, subpath: str = ''):
-    pack_content = mongo_client.get_pack_content(doc_type, pack, subpath)
+    pack_content = storage.backend().pack_content(doc_type, pack, subpath)
     if subpath == '':
-        subpaths = mongo_client.get_pack_subpaths(doc_type, pack)
+        subpaths = storage.backend().pack_subpaths(doc_type, pack)
     else:
         subpaths = []
     return render_template('content_list.j2.html', type=doc_type, pack=pack, subpath=subpath,
@@ -87,7 +98,15 @@ def stat_block_art(art: str):
 
 @blueprint.get('/view/<doc_type>/<path:id>.json')
 def raw_content(doc_type: str, id: str):
-    return mongo_client.get_document(doc_type, id) or f'{id} does not exist in {doc_type}'
+    return (storage.get_document(doc_type, id, 'path', optional=True)
+            or f'{id} does not exist in {doc_type}')
+
+
+@blueprint.get('/cache')
+def cache_stats():
+    return {'documents': storage.document_cache.stats(),
+            'models': foundry_packs.model_cache.stats(),
+            'enrichment': ttrpg_scribe.pf2e_compendium.foundry.enrich.enrichment_cache.stats()}
 
 
 @blueprint.post('/analyse/<doc_type>/')
@@ -114,43 +133,37 @@ def search_ui(doc_type: str | None = None):
 
 @blueprint.post('/search')
 def search():
+    backend = storage.backend()
     doc_types = request.args.getlist('doc_type')
     if len(doc_types) == 0:
-        doc_types = mongo_client.get_collection_names()
+        doc_types = backend.collection_names()
     query_type = request.args.get('query_type', 'simple')
 
-    def create_match_args():
-        match query_type:
-            case 'simple':
-                query = request.args.get('query', '')
-                pattern = re.compile(query, re.IGNORECASE)
-                return {'name': pattern}
-            case 'complex':
-                return request.get_json()
-            case _:
-                raise ValueError(query_type)
-
-    return list(mongo_client.db.aggregate([
-        *mongo_client.unionOf(doc_types),
-        {'$match': create_match_args()},
-        {
-            '$project': {
-                'doc_type': True,
-                'name': True,
-                'level': {
-                    '$ifNull': ['$system.level.value', '$system.details.level.value']
-                },
-                'rarity': '$system.traits.rarity',
-                'worldContent': '$volatile'
-            }
-        },
-        {
-            '$sort': {
-                'level': 1,
-                'name': 1
-            }
-        }
-    ]))
+    limit = request.args.get('limit', 100, type=int)
+    if not 1 <= limit <= 1000:
+        return f'limit must be between 1 and 1000, not {limit}', 400
+    mode = request.args.get('match', 'prefix')
+    match query_type:
+        case 'simple' if mode == 'fuzzy':
+            return {'results': fuzzy.index().search(request.args.get('query', ''), limit,
+                                                    doc_types=doc_types),
+                    'next': None}
+        case 'simple':
+            match mode:
+                case 'prefix' | 'text' | 'regex':
+                    page = backend.search(doc_types, request.args.get('query', ''), mode,
+                                          limit, request.args.get('cursor'))
+                    return {'results': page.results, 'next': page.next}
+                case _:
+                    return f'Unknown match mode {mode}', 400
+        case 'complex':
+            try:
+                results = backend.search_query(doc_types, request.get_json(), limit)
+            except NotImplementedError as e:
+                return str(e), 400
+            return {'results': results, 'next': None}
+        case _:
+            raise ValueError(query_type)
 
 
 @blueprint.app_template_filter()
@@ -200,10 +213,16 @@ class Pf2ePlugin(SystemPlugin):
         ttrpg_scribe.pf2e_compendium.oracle.extend(main_app)
         main_app.config['TOOLS'].insert(-1, (blueprint.url_prefix, 'Compendium', {}))
         main_app.config['TOOLS'].append(('/oracle/encounter', 'Encounter Oracle', {}))
-        foundry.initialise()
+        storage.configure(storage.MongoPool(
+            max_pool_size=main_app.config.get('COMPENDIUM_MONGO_MAX_POOL_SIZE', 100),
+            min_pool_size=main_app.config.get('COMPENDIUM_MONGO_MIN_POOL_SIZE', 0),
+            warm_connections=main_app.config.get('COMPENDIUM_MONGO_WARM_CONNECTIONS', 4)))
+        fuzzy.configure(main_app.config.get('COMPENDIUM_FUZZY_INDEX_BYTES', 32 * 2**20))
+        foundry.initialise_in_background()
 
     @classmethod
     def participant_from_id(cls, mongo_id: str) -> PF2Creature | PF2Hazard:
+        require_compendium()
         _, data = foundry_packs.read_doc('all', mongo_id)
         assert isinstance(data, PF2Creature | PF2Hazard), \
             f'{mongo_id} does not resolve to PF2Creature | PF2Hazard'
@@ -263,26 +282,35 @@ class Pf2ePlugin(SystemPlugin):
             ((count, resolve_level(creature)) for count, creature in encounter.allies),
             party_level, len(party))
 
+    @classmethod
+    def creature_xp(cls, creature_level: int, party_level: int) -> int:
+        delta = creature_level - party_level
+        if delta < -4:
+            return 0
+        elif delta >= 4:
+            return 160
+        return Pf2ePlugin._CREATURE_XP_BY_DELTA[delta]
+
+    @classmethod
+    def threat_thresholds(cls, party_size: int) -> list[tuple[int, str]]:
+        extra_players = party_size - 4
+        return [
+            (40 + extra_players * 10, 'Trivial'),
+            (60 + extra_players * 15, 'Low'),
+            (80 + extra_players * 20, 'Moderate'),
+            (120 + extra_players * 30, 'Severe'),
+            (160 + extra_players * 40, 'Extreme'),
+        ]
+
     @classmethod
     def compute_xp(cls, enemies: Iterable[tuple[int, int]], allies: Iterable[tuple[int, int]],
                    party_level: int, party_size: int) -> str:
-        def xp(creature_level: int):
-            delta = creature_level - party_level
-            if delta < -4:
-                return 0
-            elif delta >= 4:
-                return 160
-            return Pf2ePlugin._CREATURE_XP_BY_DELTA[delta]
-        total = sum(max(0, count) * xp(level) for count, level in enemies)
+        total = sum(max(0, count) * cls.creature_xp(level, party_level)
+                    for count, level in enemies)
 
         reward = math.ceil(total * 4 // party_size / 10) * 10  # round up to nearest 10
-        extra_players = party_size - 4
         threat_levels: list[tuple[int, str, int]] = [
-            (40 + extra_players * 10, 'Trivial', reward),
-            (60 + extra_players * 15, 'Low', reward),
-            (80 + extra_players * 20, 'Moderate', reward),
-            (120 + extra_players * 30, 'Severe', reward),
-            (160 + extra_players * 40, 'Extreme', reward),
+            (threshold, threat, reward) for threshold, threat in cls.threat_thresholds(party_size)
         ]
 
         def describe_threat(threshold: int, threat: str, reward: int, threat_idx: int):
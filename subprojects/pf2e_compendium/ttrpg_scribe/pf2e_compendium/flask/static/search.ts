@@ -20,21 +20,36 @@ interface SearchResult {
     worldContent?: boolean
 }
 
+interface SearchPage {
+    results: Array<SearchResult>
+    next: string | null
+}
+
+// Repeats the last search from where its previous page ended
+let loadMore: (() => Promise<void>) | null = null
+
 function search() {
-    function doSearch(endpoint: string, searchParams: {[key: string]: string}, init: RequestInit): Promise<void> {
+    function doSearch(endpoint: string, searchParams: {[key: string]: string}, init: RequestInit,
+                      cursor: string | null = null): Promise<void> {
         const url = new URL(endpoint, document.baseURI)
         for (const [k, v] of Object.entries(searchParams)) {
             url.searchParams.set(k, v)
         }
-        const resultsJson: Promise<Array<SearchResult>> = fetch(url, init).then(r => {
+        if (cursor != null) {
+            url.searchParams.set('cursor', cursor)
+        }
+        const pageJson: Promise<SearchPage> = fetch(url, init).then(r => {
             if (r.ok) {
                 return r.json()
             }
             throw new Error(`${endpoint} returned ${r.status} ${r.statusText}`)
         })
-        return resultsJson.then(results => {
-            $('#results legend').text(`Results (${results.length})`)
-            $('#results tbody').empty().append(results.map(r => {
+        return pageJson.then(page => {
+            const $tbody = $('#results tbody')
+            if (cursor == null) {
+                $tbody.empty()
+            }
+            $tbody.append(page.results.map(r => {
                 const url = endpoints.compendiumContent.replace('DOC_TYPE', r.doc_type).replace('ID', r._id)
                 const name = $('<span>').append($('<a>', { href: url, target: 'preview' }).text(r.name))
                 if (r.worldContent)
@@ -45,6 +60,11 @@ function search() {
                     .append($(`<td>`, { 'class': 'level' }).text(r.level != undefined ? r.level : ''))
                     .append($(`<td>`, { 'class': 'rarity' }).text(r.rarity || ''))[0]
             }))
+            const count = $tbody.children().length
+            $('#results legend').text(`Results (${count}${page.next != null ? '+' : ''})`)
+            const next = page.next
+            loadMore = next != null ? () => doSearch(endpoint, searchParams, init, next) : null
+            $('.more-button').prop('hidden', loadMore == null)
         })
     }
 
@@ -55,7 +75,8 @@ function search() {
         case 'simple':
         {
             const query = $<HTMLInputElement>('#simple_query').val()!
-            doSearch(endpoints.search, {query, ...docTypeParam}, {method: 'POST'})
+            const match = $<HTMLSelectElement>('#simple_match').val()!
+            doSearch(endpoints.search, {query, match, ...docTypeParam}, {method: 'POST'})
             break
         }
         case 'complex':
@@ -85,6 +106,7 @@ $.ready.then(() =>
     updateQueryType()
     $('input[name="query_type"]').on('input', updateQueryType)
     $('.search-button').on('click', search)
+    $('.more-button').on('click', () => loadMore?.())
     $('#simple_query').on('keyup', e => {
         if (e.key == 'Enter')
             $('.search-button').trigger('click')
@@ -1,8 +1,14 @@
+import hashlib
 import json
 import logging
+import os
 import shutil
-from io import BytesIO
-from zipfile import ZipFile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from zipfile import BadZipFile, ZipFile
 
 import requests
 from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
@@ -12,9 +18,22 @@ from ttrpg_scribe import pf2e_compendium
 VERSION = '8.4.1'
 pf2e_dir = (pf2e_compendium.data_dir / 'foundryvtt/pf2e').absolute()
 initialised = False
+# Set once initialisation has finished, successfully or not
+ready = threading.Event()
+failure: BaseException | None = None
+_initialiser: threading.Thread | None = None
 _LOGGER = logging.getLogger(__name__)
 
 
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _LOGGER.info(f'{name} took {time.perf_counter() - start:.2f}s')
+
+
 def system_data(key: str):
     global _system
     system_json = pf2e_dir/'system.json'
@@ -26,11 +45,83 @@ def system_data(key: str):
     raise RuntimeError('system.json loading failed')
 
 
-def initialise(force_rebuild: bool = False):
+def download(url: str, destination: Path, progress: Progress, sha256: str | None = None):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_name(f'{destination.name}.part')
+    # Resume from whatever a previous interrupted download left behind
+    offset = partial.stat().st_size if partial.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    task = progress.add_task(f'Downloading {destination.name}', total=None, subdesc='')
+    with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+        if response.status_code == 416:  # Already fully downloaded
+            total = int(response.headers['Content-Range'].rsplit('/', maxsplit=1)[1])
+            progress.update(task, total=total, completed=offset)
+        else:
+            response.raise_for_status()
+            if response.status_code == 206:
+                total = int(response.headers['Content-Range'].rsplit('/', maxsplit=1)[1])
+                mode = 'ab'
+            else:  # Server ignored the range, start over
+                total = int(response.headers['Content-Length'])
+                offset = 0
+                mode = 'wb'
+            progress.update(task, total=total, completed=offset)
+            with partial.open(mode) as file:
+                chunk: bytes
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    file.write(chunk)
+                    progress.advance(task, len(chunk))
+
+    if (size := partial.stat().st_size) != total:
+        # Too long or cut short, resuming from it would never produce the right file
+        partial.unlink()
+        raise OSError(f'Downloaded {size} bytes of {url}, expected {total}')
+    if sha256 is not None:
+        with partial.open('rb') as file:
+            actual = hashlib.file_digest(file, 'sha256').hexdigest()
+        if actual != sha256:
+            partial.unlink()
+            raise OSError(f'Checksum mismatch for {url}, expected {sha256}, got {actual}')
+    partial.replace(destination)
+
+
+def extract(archive: Path, destination: Path, progress: Progress, workers: int | None = None):
+    workers = workers or min(8, os.cpu_count() or 1)
+    # Extract beside the destination, so an interrupted extraction never looks complete
+    staging = destination.with_name(f'{destination.name}.partial')
+    if staging.exists():
+        shutil.rmtree(staging)
+    with ZipFile(archive) as zip:
+        members = zip.namelist()
+    # Create directories upfront, workers racing to create the same directory can fail
+    root = staging.resolve()
+    for member in members:
+        if not (target := (staging/member).resolve()).is_relative_to(root):
+            raise ValueError(f'{archive.name} member {member} would extract outside {staging}')
+        target.parent.mkdir(parents=True, exist_ok=True)
+    task = progress.add_task(f'Extracting {archive.name}', total=len(members), subdesc='')
+
+    def extract_all(chunk: list[str]):
+        # ZipFile isn't safe to share between threads, so each worker opens its own
+        with ZipFile(archive) as zip:
+            for member in chunk:
+                zip.extract(member, staging)
+                progress.advance(task)
+
+    with ThreadPoolExecutor(workers) as executor:
+        for result in executor.map(extract_all, [members[i::workers] for i in range(workers)]):
+            pass  # Propagate exceptions
+    if destination.exists():
+        shutil.rmtree(destination)
+    staging.replace(destination)
+
+
+def initialise(force_rebuild: bool = False, jobs: int = 1, full: bool = False):
     global initialised
     if initialised:
         return
-    from ttrpg_scribe.pf2e_compendium.foundry import mongo_client, mongo_server
+    from ttrpg_scribe.pf2e_compendium.foundry import creature_index, fuzzy, storage
+    backend = storage.backend()
 
     def check_for_updates():
         if pf2e_dir.exists():
@@ -38,8 +129,8 @@ def initialise(force_rebuild: bool = False):
                 _LOGGER.info(f'PF2e system already compatible ({VERSION})')
                 create = False
             else:
+                # The old system is only removed once the new one is fully extracted
                 _LOGGER.info(f'Replacing {system_data('version')} with {VERSION}')
-                shutil.rmtree(pf2e_dir)
                 create = True
         else:
             create = True
@@ -54,23 +145,68 @@ def initialise(force_rebuild: bool = False):
 
         if create:
             url = f'https://github.com/foundryvtt/pf2e/releases/download/pf2e-{VERSION}/system.zip'
-            with BytesIO() as buffer, progress() as bar:
-                task = bar.add_task(f'Downloading foundryvtt/pf2e-{VERSION}',
-                                    total=None, subdesc='')
-                response = requests.get(url, stream=True)
-                response.raise_for_status()
-                bar.update(task, total=int(response.headers['Content-Length']))
-                chunk: bytes
-                for chunk in response.iter_content(chunk_size=4 * 1024):
-                    buffer.write(chunk)
-                    bar.advance(task, len(chunk))
-                with ZipFile(buffer) as zip:
-                    zip.extractall(pf2e_dir)
-                mongo_client.update(bar)
-        elif force_rebuild:
-            mongo_client.update(progress())
-
-    mongo_server.start()
-    mongo_client.initialise()
-    check_for_updates()
+            archive = pf2e_compendium.data_dir/f'downloads/pf2e-{VERSION}.zip'
+            with progress() as bar:
+                if not archive.exists():
+                    with phase('Downloading system'):
+                        download(url, archive, bar)
+                with phase('Extracting system'):
+                    try:
+                        extract(archive, pf2e_dir, bar)
+                    except BadZipFile:
+                        archive.unlink()  # Downloaded again on the next start
+                        raise
+                archive.unlink()
+                with phase('Importing packs'):
+                    backend.update(bar, jobs, full)
+        # A backend with no content, such as a new SQLite store, can't serve anything until the
+        # packs of the system already on disk are imported into it
+        elif force_rebuild or not backend.collection_names():
+            if not force_rebuild:
+                _LOGGER.info(f'{type(backend).__name__} has no content, importing packs')
+            with phase('Importing packs'):
+                backend.update(progress(), jobs, full)
+
+    with phase('Compendium initialisation'):
+        with phase(f'Starting {type(backend).__name__}'):
+            backend.start()
+        check_for_updates()
+        with phase('Building fuzzy name index'):
+            fuzzy.index()
+        with phase('Building encounter oracle index'):
+            creature_index.index()
     initialised = True
+    ready.set()
+
+
+def initialise_in_background(force_rebuild: bool = False, jobs: int = 1, full: bool = False
+                             ) -> threading.Thread:
+    global _initialiser
+
+    def run():
+        global failure
+        try:
+            initialise(force_rebuild, jobs, full)
+        except BaseException as e:
+            failure = e
+            _LOGGER.exception('Compendium initialisation failed')
+            ready.set()
+
+    _initialiser = threading.Thread(target=run, name='compendium-initialise', daemon=True)
+    _initialiser.start()
+    return _initialiser
+
+
+def wait_for_initialisation():
+    # Without background initialisation there is nothing to wait for, and initialisation can't
+    # wait for itself
+    if _initialiser is not None and threading.current_thread() is not _initialiser:
+        wait_until_ready()
+
+
+def wait_until_ready(timeout: float | None = None) -> bool:
+    if not ready.wait(timeout):
+        return False
+    if failure is not None:
+        raise RuntimeError('Compendium initialisation failed') from failure
+    return True
@@ -0,0 +1,122 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from typing import Iterable
+
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.storage import CreatureFilter, Document
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _nth_set_bit(bits: int, n: int) -> int:
+    low, high = 0, bits.bit_length()
+    while low < high:
+        middle = (low + high) // 2
+        if (bits & ((2 << middle) - 1)).bit_count() > n:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class CreatureIndex:
+    def __init__(self, entries: Iterable[Document], generation: int = 0):
+        self.generation = generation
+        # Sorted by level, so every level range is a contiguous run of bits
+        entries = sorted(entries, key=lambda entry: entry.get('level', storage.NO_LEVEL))
+        self.creatures = [{key: entry[key] for key in ['_id', 'name', 'level', 'rarity']
+                           if key in entry}
+                          for entry in entries]
+        self._levels = [entry.get('level', storage.NO_LEVEL) for entry in entries]
+        self._all = (1 << len(entries)) - 1
+        self._rarities: dict[str, int] = {}
+        self._sizes: dict[str, int] = {}
+        self._traits: dict[str, int] = {}
+        for i, entry in enumerate(entries):
+            bit = 1 << i
+            if (rarity := entry.get('rarity')) is not None:
+                self._rarities[rarity] = self._rarities.get(rarity, 0) | bit
+            if (size := entry.get('size')) is not None:
+                self._sizes[size] = self._sizes.get(size, 0) | bit
+            for trait in entry.get('traits', []):
+                self._traits[trait] = self._traits.get(trait, 0) | bit
+
+    def _level_range(self, min_level: int, max_level: int) -> int:
+        start = bisect.bisect_left(self._levels, min_level)
+        end = bisect.bisect_right(self._levels, max_level)
+        return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+    def matching(self, filter: CreatureFilter) -> int:
+        match filter.level:
+            case int() as level:
+                bits = self._level_range(level, level)
+            case int() as min_level, int() as max_level:
+                bits = self._level_range(min_level, max_level)
+            case None:
+                bits = self._all
+        if filter.rarities is not None:
+            any_rarity = 0
+            for rarity in filter.rarities:
+                any_rarity |= self._rarities.get(rarity, 0)
+            bits &= any_rarity
+        if filter.sizes is not None:
+            any_size = 0
+            for size in filter.sizes:
+                any_size |= self._sizes.get(size, 0)
+            bits &= any_size
+        for trait in filter.traits or []:
+            bits &= self._traits.get(trait, 0)
+        return bits
+
+    def count(self, filter: CreatureFilter) -> int:
+        return self.matching(filter).bit_count()
+
+    def sample(self, filter: CreatureFilter, rng: random.Random | None = None
+               ) -> Document | None:
+        bits = self.matching(filter)
+        if (count := bits.bit_count()) == 0:
+            return None
+        i = _nth_set_bit(bits, (rng or random).randrange(count))
+        return dict(self.creatures[i])
+
+
+_index: CreatureIndex | None = None
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def _build() -> CreatureIndex:
+    generation = storage.generation()
+    start = time.perf_counter()
+    built = CreatureIndex(storage.backend().creature_entries(), generation)
+    _LOGGER.info(f'Indexed {len(built.creatures):,} creatures for the encounter oracle'
+                 f' in {time.perf_counter() - start:.2f}s')
+    return built
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        built = _build()
+        with _lock:
+            _index = built
+    except Exception:
+        _LOGGER.exception('Rebuilding the creature index failed')
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def index() -> CreatureIndex:
+    global _index, _rebuilding
+    with _lock:
+        if _index is None:
+            _index = _build()
+        elif _index.generation != storage.generation() and not _rebuilding:
+            # Solves keep sampling from the old index until the new one is ready
+            _rebuilding = True
+            threading.Thread(target=_rebuild, name='creature-index', daemon=True).start()
+        return _index
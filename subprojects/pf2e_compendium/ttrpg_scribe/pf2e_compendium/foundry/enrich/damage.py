@@ -1,11 +1,13 @@
 
 import ast
+import functools
 import itertools
 import math
 import operator
 import re
 from ast import Name
 from collections import defaultdict
+from collections.abc import Mapping
 from dataclasses import dataclass
 from typing import Any
 
@@ -16,136 +18,107 @@ from ttrpg_scribe.pf2e_compendium.actor import statistics
 from ttrpg_scribe.pf2e_compendium.foundry.enrich.args import Args
 
 
-def damage_roll(args: Args, context: dict[str, Any]):
-    @dataclass
-    class DamageInstance:
-        dice: list[tuple[list[SimpleDice | int], list[str]]]
-        shortLabel: bool
-
-        def __init__(self, dice: SimpleDice | int):
-            self.dice = [([dice], [])]
-            self.shortLabel = False
-
-        def add_category(self, category: str):
-            for _, existing in self.dice:
-                existing.append(category)
-
-        def __bin_op(self, op: Callable[[Any, Any], Any], other):
-            match other:
-                case DamageInstance():
-                    by_type: dict[tuple[str, ...], list[SimpleDice | int]] = defaultdict(list)
-                    for dice, damage_types in itertools.chain(self.dice, other.dice):
-                        by_type[tuple(damage_types)] += dice
-                    self.dice = [(dice, list(damage_types))
-                                 for damage_types, dice in by_type.items()]
-                    return self
-                case int() as result if len(self.dice) == 1 and len(self.dice[0][0]) == 1:
-                    dice, categories = self.dice[0]
-                    dice[0] = op(dice[0], result)
-                    self.dice[0] = (dice, categories)
-                    return self
-                case _:
-                    return NotImplemented
-
-        def __add__(self, other):
-            return self.__bin_op(operator.add, other)
-
-        def __radd__(self, other):
-            return self + other
-
-        def __sub__(self, other):
-            return self.__bin_op(operator.sub, other)
-
-        def __mul__(self, other):
-            return self.__bin_op(operator.mul, other)
-
-        def __rmul__(self, other):
-            return self * other
-
-        def __truediv__(self, other):
-            return self.__bin_op(operator.truediv, other)
-
-        def __str__(self) -> str:
-            def helper(dice: list[SimpleDice | int], damage_types: list[str]):
-                amount = f'<span class="damage-dice">{' + '.join(map(str, dice))}</span>'
-                return f'{amount}' if self.shortLabel else f'{amount} {' '.join(damage_types)}'
-            return ' + '.join(helper(dice, damage_types) for dice, damage_types in self.dice)
-
-    args.ignore('immutable', 'name', 'options', 'traits')
-    damage = args.consume_index(0)
-    # Transform dice notation to a form parseable as Python code
-    damage = re.sub(r'@(actor|item)', lambda m: f'"@{m[1]}"', damage)
-    damage = re.sub(r'(\w+\(.+\)|\(.+\)|\d+)?d(\(.+\)|\d+)',
-                    lambda m: f'd({m[1] or 1}, {m[2]})', damage)
-    try:
-        expr = ast.parse(damage, mode='eval')
-    except SyntaxError:
-        return statistics.inline_html(damage, 'damage')
-
-    def to_damage(expr: ast.AST) -> DamageInstance:
-        def resolve(node: ast.AST) -> Any:
-            match node:
-                case ast.Expression(body):
-                    return resolve(body)
-                case ast.BinOp(left, ast.Add(), right):
-                    return resolve(left) + resolve(right)
-                case ast.BinOp(left, ast.Sub(), right):
-                    return resolve(left) - resolve(right)
-                case ast.BinOp(left, ast.Mult(), right):
-                    return resolve(left) * resolve(right)
-                case ast.BinOp(left, ast.Div(), right):
-                    return resolve(left) / resolve(right)
-                case ast.Subscript(value, ast.Tuple(damage_types)):
-                    instance = to_damage(value)
-                    for t in damage_types:
-                        instance.add_category(resolve(t))
-                    return instance
-                case ast.Subscript(value, damage_type):
-                    instance = to_damage(value)
-                    instance.add_category(resolve(damage_type))
-                    return instance
-                case ast.Call(Name(func), args):
-                    resolved_args: list[Any] = [resolve(arg) for arg in args]
-                    # Account for edgecase where resolved args end up in a tuple
-                    # in a singleton list for some reaosn
-                    match resolved_args:
-                        case [tuple() as a]:
-                            resolved_args = list(a)
-                    match func:
-                        case 'd':
-                            count, size = resolved_args
-                            return DamageInstance(count * d(size))
-                        case 'min':
-                            return min(*resolved_args)
-                        case 'max':
-                            return max(*resolved_args)
-                        case 'floor':
-                            return math.floor(*resolved_args)
-                        case 'ceil':
-                            return math.ceil(*resolved_args)
-                        case 'ternary':
-                            cond, if_true, if_false = resolved_args
-                            return if_true if cond else if_false
-                        case 'gte':
-                            return operator.ge(*resolved_args)
-                        case 'lte':
-                            return operator.le(*resolved_args)
-                        case unknown:
-                            raise SyntaxError(f'Unknown function {unknown}')
-                case Name(id):
-                    return id
-                case ast.Constant(int() as value):
-                    return value
-                case ast.Constant(str() as value) if value.startswith('@'):
-                    return context[value[1:]]
-                case ast.Attribute(value, attr):
-                    return resolve(value)[attr]
-                case ast.Tuple(elements):
-                    return tuple(to_damage(e) for e in elements)
-                case n:
-                    raise SyntaxError(f'Unexpected node {ast.dump(n, indent=2)}')
-
-        match resolve(expr):
+@dataclass
+class DamageInstance:
+    dice: list[tuple[list[SimpleDice | int], list[str]]]
+    shortLabel: bool
+
+    def __init__(self, dice: SimpleDice | int):
+        self.dice = [([dice], [])]
+        self.shortLabel = False
+
+    def add_category(self, category: str):
+        for _, existing in self.dice:
+            existing.append(category)
+
+    def __bin_op(self, op: Callable[[Any, Any], Any], other):
+        match other:
+            case DamageInstance():
+                by_type: dict[tuple[str, ...], list[SimpleDice | int]] = defaultdict(list)
+                for dice, damage_types in itertools.chain(self.dice, other.dice):
+                    by_type[tuple(damage_types)] += dice
+                self.dice = [(dice, list(damage_types))
+                             for damage_types, dice in by_type.items()]
+                return self
+            case int() as result if len(self.dice) == 1 and len(self.dice[0][0]) == 1:
+                dice, categories = self.dice[0]
+                dice[0] = op(dice[0], result)
+                self.dice[0] = (dice, categories)
+                return self
+            case _:
+                return NotImplemented
+
+    def __add__(self, other):
+        return self.__bin_op(operator.add, other)
+
+    def __radd__(self, other):
+        return self + other
+
+    def __sub__(self, other):
+        return self.__bin_op(operator.sub, other)
+
+    def __mul__(self, other):
+        return self.__bin_op(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __truediv__(self, other):
+        return self.__bin_op(operator.truediv, other)
+
+    def __str__(self) -> str:
+        def helper(dice: list[SimpleDice | int], damage_types: list[str]):
+            amount = f'<span class="damage-dice">{' + '.join(map(str, dice))}</span>'
+            return f'{amount}' if self.shortLabel else f'{amount} {' '.join(damage_types)}'
+        return ' + '.join(helper(dice, damage_types) for dice, damage_types in self.dice)
+
+
+def _bounds(dice: SimpleDice | int) -> tuple[float, float, float]:
+    match dice:
+        case SimpleDice(count, size, mod):
+            return count + mod, dice.average(), count * size + mod
+        case constant:
+            return constant, constant, constant
+
+
+@dataclass(frozen=True)
+class DamageStats:
+    minimum: float
+    average: float
+    maximum: float
+
+    @staticmethod
+    def of(instance: DamageInstance) -> 'DamageStats':
+        bounds = [_bounds(dice) for all_dice, _ in instance.dice for dice in all_dice]
+        return DamageStats(*(sum(column) for column in zip((0, 0, 0), *bounds)))
+
+
+type _Evaluator = Callable[[Mapping[str, Any]], Any]
+
+_FUNCTIONS: dict[str, Callable[..., Any]] = {
+    'd': lambda count, size: DamageInstance(count * d(size)),
+    'min': min,
+    'max': max,
+    'floor': math.floor,
+    'ceil': math.ceil,
+    'ternary': lambda cond, if_true, if_false: if_true if cond else if_false,
+    'gte': operator.ge,
+    'lte': operator.le,
+}
+
+_OPERATORS: dict[type[ast.operator], Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def _compile_damage(expr: ast.AST) -> Callable[[Mapping[str, Any]], DamageInstance]:
+    evaluate = _compile(expr)
+
+    def to_damage(context: Mapping[str, Any]) -> DamageInstance:
+        match evaluate(context):
             case DamageInstance() as result:
                 return result
             case tuple() as results:
@@ -157,7 +130,107 @@ def damage_roll(args: Args, context: dict[str, Any]):
                 return DamageInstance(result)
             case x:
                 raise ValueError(f"Can't convert {x} to DamageInstance")
+    return to_damage
+
+
+def _compile(node: ast.AST) -> _Evaluator:
+    match node:
+        case ast.Expression(body):
+            return _compile(body)
+        case ast.BinOp(left, op, right) if type(op) in _OPERATORS:
+            apply, left, right = _OPERATORS[type(op)], _compile(left), _compile(right)
+            return lambda context: apply(left(context), right(context))
+        case ast.Subscript(value, damage_types):
+            instance = _compile_damage(value)
+            categories = [_compile(t) for t in
+                          (damage_types.elts if isinstance(damage_types, ast.Tuple)
+                           else [damage_types])]
+
+            def categorised(context: Mapping[str, Any]) -> DamageInstance:
+                result = instance(context)
+                for category in categories:
+                    result.add_category(category(context))
+                return result
+            return categorised
+        case ast.Call(Name(func), args):
+            if (function := _FUNCTIONS.get(func)) is None:
+                raise SyntaxError(f'Unknown function {func}')
+            compiled_args = [_compile(arg) for arg in args]
+
+            def call(context: Mapping[str, Any]) -> Any:
+                resolved_args: list[Any] = [arg(context) for arg in compiled_args]
+                # Account for edgecase where resolved args end up in a tuple
+                # in a singleton list for some reaosn
+                match resolved_args:
+                    case [tuple() as a]:
+                        resolved_args = list(a)
+                return function(*resolved_args)
+            return call
+        case Name(id):
+            return lambda context: id
+        case ast.Constant(int() as value):
+            return lambda context: value
+        case ast.Constant(str() as value) if value.startswith('@'):
+            key = value[1:]
+            return lambda context: context[key]
+        case ast.Attribute(value, attr):
+            compiled_value = _compile(value)
+            return lambda context: compiled_value(context)[attr]
+        case ast.Tuple(elements):
+            compiled_elements = [_compile_damage(e) for e in elements]
+            return lambda context: tuple(e(context) for e in compiled_elements)
+        case n:
+            raise SyntaxError(f'Unexpected node {ast.dump(n, indent=2)}')
+
+
+class CompiledFormula:
+    def __init__(self, source: str, expr: ast.Expression):
+        self.source = source
+        self._evaluate = _compile_damage(expr)
+        # Without roll data references, every evaluation gives the same damage
+        self.constant = not any(isinstance(node, ast.Constant) and isinstance(node.value, str)
+                                for node in ast.walk(expr))
+        self._stats: DamageStats | None = None
+        self._rendered: dict[bool, str] = {}
+
+    def __call__(self, context: Mapping[str, Any] = {}) -> DamageInstance:
+        return self._evaluate(context)
+
+    def stats(self, context: Mapping[str, Any] = {}) -> DamageStats:
+        if not self.constant:
+            return DamageStats.of(self(context))
+        if self._stats is None:
+            self._stats = DamageStats.of(self())
+        return self._stats
+
+    def render(self, context: Mapping[str, Any], short_label: bool) -> str:
+        if self.constant and (rendered := self._rendered.get(short_label)) is not None:
+            return rendered
+        instance = self(context)
+        instance.shortLabel = short_label
+        rendered = str(instance)
+        if self.constant:
+            self._rendered[short_label] = rendered
+        return rendered
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_formula(formula: str) -> CompiledFormula | str:
+    # Transform dice notation to a form parseable as Python code
+    damage = re.sub(r'@(actor|item)', lambda m: f'"@{m[1]}"', formula)
+    damage = re.sub(r'(\w+\(.+\)|\(.+\)|\d+)?d(\(.+\)|\d+)',
+                    lambda m: f'd({m[1] or 1}, {m[2]})', damage)
+    try:
+        expr = ast.parse(damage, mode='eval')
+    except SyntaxError:
+        return damage  # Shown as written
+    return CompiledFormula(formula, expr)
 
-    instance = to_damage(expr)
-    instance.shortLabel = args.consume_bool('shortLabel')
-    return statistics.inline_html(str(instance), 'damage')
+
+def damage_roll(args: Args, context: Mapping[str, Any]):
+    args.ignore('immutable', 'name', 'options', 'traits')
+    formula = compile_formula(args.consume_index(0))
+    if isinstance(formula, str):
+        return statistics.inline_html(formula, 'damage')
+    short_label = args.consume_bool('shortLabel')
+    return statistics.inline_html(formula.render(context, short_label), 'damage')
@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator
+
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.args import Args
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.syntax import Enricher, parse
+from ttrpg_scribe.pf2e_compendium.foundry.storage import Document
+
+
+def embed_uuid(args: Args) -> str:
+    uuid = args.consume_index(0)
+    return uuid[uuid.rindex('.') + 1:]
+
+
+def embedded_uuids(text: str) -> Iterator[str]:
+    for segment in parse(text):
+        if isinstance(segment, Enricher) and segment.kind == '@' and segment.name == 'Embed':
+            try:
+                yield embed_uuid(Args(segment.args, arg_sep=' ', key_value_sep='=',
+                                      error_context='@Embed'))
+            except (KeyError, ValueError):
+                pass  # Malformed, enriching it reports the error
+
+
+def texts_with_embeds(json: Any) -> Iterator[str]:
+    match json:
+        case str() if '@Embed[' in json:
+            yield json
+        case dict():
+            for value in json.values():
+                yield from texts_with_embeds(value)
+        case list():
+            for value in json:
+                yield from texts_with_embeds(value)
+
+
+def description(doc: Document) -> str:
+    return doc['system']['description']['value']
+
+
+@dataclass
+class _Resolver:
+    texts: list[str]
+    docs: dict[str, Document | None] = field(default_factory=dict)
+    stack: list[str] = field(default_factory=list)
+    prefetched: bool = False
+
+    def prefetch(self):
+        # One bulk lookup per level of nesting, embeds of embeds are found in the next round
+        self.prefetched = True
+        pending = self.texts
+        while wanted := list(dict.fromkeys(uuid for text in pending
+                                           for uuid in embedded_uuids(text)
+                                           if uuid not in self.docs)):
+            found = storage.get_documents('all', wanted, id_type='uuid', optional=True)
+            self.docs.update((uuid, found.get(uuid)) for uuid in wanted)
+            pending = [text for doc in found.values() for text in texts_with_embeds(doc)]
+
+    def document(self, uuid: str) -> Document:
+        if not self.prefetched:
+            self.prefetch()
+        if uuid not in self.docs:  # From text that wasn't known up front, like a @Localize
+            self.docs[uuid] = storage.get_document('all', uuid, id_type='uuid', optional=True)
+        if (doc := self.docs[uuid]) is None:
+            raise KeyError(f'{uuid} not found in all')
+        return doc
+
+    @contextmanager
+    def embedding(self, uuid: str) -> Iterator[Document]:
+        if uuid in self.stack:
+            raise ValueError(f'@Embed cycle {' -> '.join([*self.stack, uuid])}')
+        doc = self.document(uuid)
+        self.stack.append(uuid)
+        try:
+            yield doc
+        finally:
+            self.stack.pop()
+
+
+_resolver: ContextVar[_Resolver | None] = ContextVar('embed_resolver', default=None)
+
+
+@contextmanager
+def batch(texts: Iterable[str]) -> Iterator[None]:
+    if (resolver := _resolver.get()) is not None:
+        if not resolver.prefetched:
+            resolver.texts += texts
+        yield
+        return
+    token = _resolver.set(_Resolver(list(texts)))
+    try:
+        yield
+    finally:
+        _resolver.reset(token)
+
+
+def resolver() -> _Resolver:
+    return _resolver.get() or _Resolver([])
@@ -0,0 +1,168 @@
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Iterator
+
+from ttrpg_scribe.pf2e_compendium.actor import statistics
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+
+_STATISTIC_ID = re.compile(r'(id="statistic-[\w-]+?-)(\d+)(")')
+
+type Path = tuple[str, ...]
+
+
+@dataclass
+class _Reads:
+    values: dict[Path, Any] = field(default_factory=dict)
+    everything: bool = False
+
+
+class _Recorder(Mapping[str, Any]):
+    def __init__(self, data: Mapping[str, Any], path: Path, reads: _Reads):
+        self._data = data
+        self._path = path
+        self._reads = reads
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._data[key]
+        path = (*self._path, key)
+        if isinstance(value, Mapping):
+            return _Recorder(value, path, self._reads)
+        self._reads.values[path] = value
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        self._reads.everything = True
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        self._reads.everything = True
+        return len(self._data)
+
+
+def _values(context: Mapping[str, Any], paths: tuple[Path, ...]) -> tuple[Hashable, ...] | None:
+    values = []
+    for path in paths:
+        value: Any = context
+        try:
+            for key in path:
+                value = value[key]
+            hash(value)
+        except (KeyError, TypeError):
+            return None  # Enriching will fail or read something else, let it run uncached
+        values.append(value)
+    return tuple(values)
+
+
+@dataclass
+class _Template:
+    # Statistic ids must stay unique on a page, so each hit numbers its statistics afresh
+    parts: list[str]
+    ranks: list[int]
+
+    @staticmethod
+    def of(output: str) -> '_Template':
+        pieces = _STATISTIC_ID.split(output)
+        parts = [pieces[0]]
+        numbers: list[int] = []
+        for prefix, number, suffix, rest in zip(*[iter(pieces[1:])] * 4):
+            parts[-1] += prefix
+            parts.append(suffix + rest)
+            numbers.append(int(number))
+        rank = {number: i for i, number in enumerate(sorted(set(numbers)))}
+        return _Template(parts, [rank[number] for number in numbers])
+
+    def render(self, ids: list[int] | None = None) -> str:
+        if not self.ranks:
+            return self.parts[0]
+        if ids is None:
+            ids = [statistics.next_statistic_id() for _ in range(max(self.ranks) + 1)]
+        output = [self.parts[0]]
+        for rank, part in zip(self.ranks, self.parts[1:]):
+            output += [str(ids[rank]), part]
+        return ''.join(output)
+
+
+def renumber_statistics(html: str) -> str:
+    return _Template.of(html).render()
+
+
+def normalise_statistics(html: str) -> str:
+    # Numbered from 0 in order of appearance, so the same text always gives the same HTML
+    template = _Template.of(html)
+    return template.render(list(range(len(template.ranks))))
+
+
+@dataclass
+class _Entry:
+    paths: tuple[Path, ...]
+    outputs: OrderedDict[tuple[Hashable, ...], _Template]
+
+
+class EnrichmentCache:
+    def __init__(self, max_texts: int, max_variants: int):
+        self.max_texts = max_texts
+        self.max_variants = max_variants
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        # Keyed on the text, then on the values of the context paths enriching it read
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._generation = storage.generation()
+        self._lock = threading.Lock()
+
+    def get_or_enrich(self, text: str, context: Mapping[str, Any],
+                      enrich: Callable[[str, Mapping[str, Any]], str]) -> str:
+        # @Embed reads other documents, so writes to the compendium invalidate everything
+        read_generation = storage.generation()
+        with self._lock:
+            if self._generation != read_generation:
+                self._entries.clear()
+                self._generation = read_generation
+            entry = self._entries.get(text)
+        template = None
+        if entry is not None and (values := _values(context, entry.paths)) is not None:
+            with self._lock:
+                # Another thread may have evicted the text since it was looked up
+                if self._entries.get(text) is entry \
+                        and (template := entry.outputs.get(values)) is not None:
+                    self._entries.move_to_end(text)
+                    entry.outputs.move_to_end(values)
+                    self.hits += 1
+        if template is not None:
+            return template.render()
+
+        reads = _Reads()
+        output = enrich(text, _Recorder(context, (), reads))
+        paths = tuple(reads.values)
+        values = _values(context, paths)
+        with self._lock:
+            self.misses += 1
+            if reads.everything or values is None:
+                self.uncacheable += 1
+            elif self._generation == read_generation == storage.generation():
+                entry = self._entries.get(text)
+                if entry is None or entry.paths != paths:
+                    entry = self._entries[text] = _Entry(paths, OrderedDict())
+                entry.outputs[values] = _Template.of(output)
+                while len(entry.outputs) > self.max_variants:
+                    entry.outputs.popitem(last=False)
+                self._entries.move_to_end(text)
+                while len(self._entries) > self.max_texts:
+                    self._entries.popitem(last=False)
+        return output
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'uncacheable': self.uncacheable,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'texts': len(self._entries),
+                    'variants': sum(len(entry.outputs) for entry in self._entries.values()),
+                    'generation': self._generation}
@@ -0,0 +1,77 @@
+import functools
+import re
+from dataclasses import dataclass
+from typing import Literal
+
+# Where an enricher might start, @Name[args]{display} or [[/name args]]{display}
+_START = re.compile(r'@(\w+)\[|\[\[/(\w+) ')
+
+
+@dataclass(frozen=True, slots=True)
+class Enricher:
+    kind: Literal['@', '[[/']
+    name: str
+    args: str
+    display: str | None
+
+
+type Segment = str | Enricher
+
+
+def _closing_bracket(text: str, start: int, nested: bool) -> int:
+    if not nested:
+        return text.find(']', start)
+    # @Damage formulas contain bracketed damage types, e.g. @Damage[1d6[fire]], but only one deep
+    inside = False
+    for i in range(start, len(text)):
+        match text[i], inside:
+            case '[', False:
+                inside = True
+            case '[', True:
+                return -1
+            case ']', True:
+                inside = False
+            case ']', False:
+                return i
+    return -1
+
+
+def _display(text: str, start: int) -> tuple[str | None, int]:
+    if text.startswith('{', start) and (end := text.find('}', start + 1)) > start + 1:
+        return text[start + 1:end], end + 1
+    return None, start
+
+
+@functools.lru_cache(maxsize=4096)
+def parse(text: str) -> tuple[Segment, ...]:
+    if '<hr />\n' in text:
+        text = text.replace('<hr />\n', '<div class="details">')
+        text += '</div>'
+    segments: list[Segment] = []
+    literal_start = search_start = 0
+    while (start := _START.search(text, search_start)) is not None:
+        search_start = start.start() + 1
+        if (name := start[1]) is not None:
+            kind = '@'
+            end = _closing_bracket(text, start.end(), nested=name == 'Damage')
+            if end == -1 and name == 'Damage':
+                end = _closing_bracket(text, start.end(), nested=False)
+            # Only @Damage may have empty arguments
+            if end == -1 or end == start.end() and name != 'Damage':
+                continue
+            args = text[start.end():end]
+            display, end = _display(text, end + 1)
+        else:
+            kind, name = '[[/', start[2]
+            end = _closing_bracket(text, start.end(), nested=False)
+            if end <= start.end() or not text.startswith(']]', end):
+                continue
+            args = text[start.end():end]
+            display, end = _display(text, end + 2)
+        if literal_start < start.start():
+            segments.append(text[literal_start:start.start()])
+        segments.append(Enricher(kind, name, args, display))
+        literal_start = search_start = end
+    if literal_start < len(text):
+        segments.append(text[literal_start:])
+    return tuple(segments)
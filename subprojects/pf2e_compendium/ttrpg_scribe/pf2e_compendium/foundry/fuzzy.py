@@ -0,0 +1,252 @@
+import bisect
+import itertools
+import logging
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Container, Iterable, Iterator
+
+from ttrpg_scribe.pf2e_compendium.foundry import storage
+from ttrpg_scribe.pf2e_compendium.foundry.storage import Document
+
+_LOGGER = logging.getLogger(__name__)
+_NOT_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+memory_budget = 32 * 2**20
+
+
+def configure(budget: int):
+    global memory_budget, _index
+    memory_budget = budget
+    _index = None
+
+
+def trigrams(text: str) -> set[str]:
+    grams: set[str] = set()
+    for word in _NOT_ALPHANUMERIC.sub(' ', text.lower()).split():
+        # Padding lets short words and word boundaries contribute grams of their own
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _bitset(positions: Iterable[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def _set_bits(bits: int) -> Iterator[int]:
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for i in itertools.compress(range(len(data)), data):
+        for bit in _BYTE_BITS[data[i]]:
+            yield i * 8 + bit
+
+
+def _add(counts: list[int], bits: int):
+    # Counts are bit-sliced, counts[i] holds bit i of every key's count
+    for i, plane in enumerate(counts):
+        if not bits:
+            return
+        counts[i], bits = plane ^ bits, plane & bits
+    if bits:
+        counts.append(bits)
+
+
+def _at_least(counts: list[int], count: int) -> int:
+    if count >= 1 << len(counts):
+        return 0
+    greater, equal = 0, -1
+    for i in reversed(range(len(counts))):
+        if count >> i & 1:
+            equal &= counts[i]
+        else:
+            greater |= equal & counts[i]
+            equal &= ~counts[i]
+    return greater | equal
+
+
+class TrigramIndex:
+    # Grams in at least this fraction of keys are kept as bitsets, which are added up for every
+    # key at once rather than counted key by key
+    DENSE_FRACTION = 1 / 256
+
+    def __init__(self, entries: Iterable[Document], budget: int, generation: int = 0):
+        self.generation = generation
+        self.entries: list[Document] = []
+        # Each entry is indexed under its name and, if it differs, its base name
+        self._key_entries = array('I')
+        self._key_sizes = array('H')
+        postings: dict[str, list[int]] = {}
+        # Entries are kept in name order so that ties between equal scores go to the first
+        for entry in sorted(entries, key=lambda entry: entry['name']):
+            entry_index = len(self.entries)
+            self.entries.append({key: value for key, value in entry.items()
+                                 if key != 'base_name'})
+            for key in dict.fromkeys([entry['name'], entry.get('base_name') or entry['name']]):
+                key_index = len(self._key_entries)
+                grams = trigrams(key)
+                self._key_entries.append(entry_index)
+                self._key_sizes.append(len(grams))
+                for gram in grams:
+                    postings.setdefault(gram, []).append(key_index)
+        key_count = len(self._key_entries)
+        self._postings = {gram: array('I', keys) for gram, keys in postings.items()
+                          if len(keys) < key_count * self.DENSE_FRACTION}
+        self._bitsets = {gram: _bitset(keys, key_count) for gram, keys in postings.items()
+                         if len(keys) >= key_count * self.DENSE_FRACTION}
+        # Keys with each number of grams
+        by_size: dict[int, list[int]] = {}
+        for key, size in enumerate(self._key_sizes):
+            by_size.setdefault(size, []).append(key)
+        self._size_masks = [_bitset(by_size.get(size, []), key_count)
+                            for size in range(max(by_size, default=-1) + 1)]
+        self.dropped = 0
+        self._fit(budget)
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self._postings) + sys.getsizeof(self._bitsets)
+                + sum(sys.getsizeof(gram) + sys.getsizeof(keys)
+                      for postings in [self._postings, self._bitsets]
+                      for gram, keys in postings.items())
+                + sum(sys.getsizeof(mask) for mask in self._size_masks)
+                + sys.getsizeof(self._key_entries) + sys.getsizeof(self._key_sizes)
+                + sum(sys.getsizeof(entry) for entry in self.entries))
+
+    def _fit(self, budget: int):
+        size = self.nbytes()
+        frequencies = [(len(keys), gram, self._postings) for gram, keys in self._postings.items()]
+        frequencies += [(bits.bit_count(), gram, self._bitsets)
+                        for gram, bits in self._bitsets.items()]
+        # The most common grams say the least about a name, so they go first
+        for _, gram, postings in sorted(frequencies, key=lambda t: t[0], reverse=True):
+            if size <= budget:
+                break
+            keys = postings.pop(gram)
+            size -= sys.getsizeof(gram) + sys.getsizeof(keys)
+            self.dropped += 1
+        if size > budget:
+            _LOGGER.warning(f'Fuzzy index needs {size:,} bytes even without postings, '
+                            f'over its {budget:,} byte budget')
+
+    def search(self, query: str, limit: int = 20, threshold: float = 0.3,
+               doc_types: Container[str] | None = None) -> list[Document]:
+        grams = trigrams(query)
+        if not (n := len(grams)) or limit <= 0:
+            return []
+        counts: list[int] = []
+        common = 0
+        rare: Counter[int] = Counter()
+        for gram in grams:
+            if (bits := self._bitsets.get(gram)) is not None:
+                _add(counts, bits)
+                common += 1
+            elif (keys := self._postings.get(gram)) is not None:
+                rare.update(keys)
+        count_bytes = [plane.to_bytes((plane.bit_length() + 7) // 8, 'little')
+                       for plane in counts]
+        # Keys with rare grams get their exact count once the search reaches the most they
+        # could share
+        pending: dict[int, list[tuple[int, int]]] = {}
+        for key, shared in rare.items():
+            most = shared + min(common, self._key_sizes[key] - shared)
+            pending.setdefault(most, []).append((key, shared))
+        by_count: dict[int, list[int]] = {}
+        # The best distinct entries so far, as (-score, entry) in ranking order
+        best: list[tuple[float, int]] = []
+        ranks: dict[int, tuple[float, int]] = {}
+        cutoff = threshold
+
+        def offer(key: int, score: float) -> bool:
+            nonlocal cutoff
+            entry = self._key_entries[key]
+            rank = (-score, entry)
+            if len(best) == limit and rank >= best[-1]:
+                return False
+            if entry in ranks and rank >= ranks[entry]:
+                return True
+            if doc_types is not None and self.entries[entry]['doc_type'] not in doc_types:
+                return True
+            if entry in ranks:
+                best.remove(ranks[entry])
+            ranks[entry] = rank
+            bisect.insort(best, rank)
+            if len(best) > limit:
+                del ranks[best.pop()[1]]
+            if len(best) == limit:
+                cutoff = -best[-1][0]
+            return True
+
+        more = 0
+        # Sharing k grams scores at most k / n, so counting down finds the best keys first
+        for shared in range(n, 0, -1):
+            if shared / n < cutoff:
+                break
+            for key, partial in pending.get(shared, []):
+                byte, bit = key >> 3, key & 7
+                exact = partial + sum((plane[byte] >> bit & 1) << i
+                                      for i, plane in enumerate(count_bytes)
+                                      if byte < len(plane))
+                by_count.setdefault(exact, []).append(key)
+            for key in by_count.get(shared, []):
+                # Jaccard similarity of the query and key grams, an entry scores its best key
+                if (score := shared / (n + self._key_sizes[key] - shared)) >= cutoff:
+                    offer(key, score)
+            if shared > common:
+                continue
+            at_least = _at_least(counts, shared)
+            exactly, more = at_least & ~more, at_least
+            for size in range(shared, len(self._size_masks)):
+                if (score := shared / (n + size - shared)) < cutoff:
+                    break
+                # Keys of the same size tie, and come in name order
+                for key in _set_bits(exactly & self._size_masks[size]):
+                    if key not in rare and not offer(key, score):
+                        break
+        return [self.entries[entry] | {'score': round(-score, 3)} for score, entry in best]
+
+
+_index: TrigramIndex | None = None
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def _build() -> TrigramIndex:
+    generation = storage.generation()
+    start = time.perf_counter()
+    built = TrigramIndex(storage.backend().search_entries(), memory_budget, generation)
+    _LOGGER.info(f'Indexed {len(built.entries):,} names for fuzzy search in '
+                 f'{time.perf_counter() - start:.2f}s, {built.nbytes():,} bytes')
+    return built
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        built = _build()
+        with _lock:
+            _index = built
+    except Exception:
+        _LOGGER.exception('Rebuilding the fuzzy index failed')
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def index() -> TrigramIndex:
+    global _index, _rebuilding
+    with _lock:
+        if _index is None:
+            _index = _build()
+        elif _index.generation != storage.generation() and not _rebuilding:
+            # Searches keep using the old index until the new one is ready
+            _rebuilding = True
+            threading.Thread(target=_rebuild, name='fuzzy-index', daemon=True).start()
+        return _index
@@ -1,74 +1,115 @@
+import hashlib
+import itertools
 import json
 import logging
 import os
 import re
-from pathlib import Path
-from typing import Any, Generator, Iterable, Literal, cast, overload
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Generator, Iterable
 
 import plyvel
 import pymongo
 import pymongo.errors
-from pymongo import IndexModel, InsertOne, MongoClient
+from pymongo import IndexModel, MongoClient
 from pymongo.synchronous.collection import _WriteOp
+from pymongo.synchronous.database import Database
 from rich.progress import Progress
-from slugify import slugify
 
 from ttrpg_scribe import pf2e_compendium
-from ttrpg_scribe.encounter.flask import itertools
 from ttrpg_scribe.pf2e_compendium import foundry
-from ttrpg_scribe.pf2e_compendium.foundry import mongo_server
+from ttrpg_scribe.pf2e_compendium.foundry import (mongo_server, pack_reader,
+                                                  storage)
+from ttrpg_scribe.pf2e_compendium.foundry.storage import (CreatureFilter,
+                                                          Document, IdType,
+                                                          MatchMode,
+                                                          SearchPage, Storage)
 
-Document = dict[str, Any]
 client: MongoClient[Document] = MongoClient(*mongo_server.CONNECTION_ARGS, timeoutMS=5000)
 db = client.pf2e
+# Bookkeeping that must not show up as compendium content
+meta_db = client.pf2e_meta
+# Connections opened as soon as the server is up, so the first requests don't pay for them
+_warm_connections = 4
 _LOGGER = logging.getLogger(__name__)
 
 
-@overload
-def get_document(collection: str, doc_id: str, id_type: Literal['path', 'uuid'], optional: bool
-                 ) -> Document | None:
-    ...
-
-
-@overload
-def get_document(collection: str, doc_id: str) -> Document:
-    ...
-
-
-@overload
-def get_document(collection: str, doc_id: str, id_type: Literal['path', 'uuid']) -> Document:
-    ...
-
-
-def get_document(collection: str, doc_id: str, id_type: Literal['path', 'uuid'] = 'path',
-                 optional=False) -> Document | None:
-    id_key: str = '_id' if id_type == 'path' else 'foundry_id'
-    doc = db[collection].find_one({id_key: doc_id})
-    if not optional and doc is None:
-        raise KeyError(f'{doc_id} not found in {collection}')
-    return doc
+def configure(max_pool_size: int = 100, min_pool_size: int = 0, warm_connections: int = 4):
+    global client, db, meta_db, _warm_connections
+    client.close()
+    client = MongoClient(*mongo_server.CONNECTION_ARGS, timeoutMS=5000,
+                         maxPoolSize=max_pool_size, minPoolSize=min_pool_size)
+    db = client.pf2e
+    meta_db = client.pf2e_meta
+    _warm_connections = warm_connections
+
+
+def wait_for_server(server: subprocess.Popen | None = None, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        if server is not None and (code := server.poll()) is not None:
+            raise RuntimeError(f'mongod exited with code {code} before accepting connections')
+        try:
+            with pymongo.timeout(max(delay, 0.5)):
+                client.admin.command('ping')
+            return
+        except pymongo.errors.PyMongoError:
+            if time.monotonic() + delay > deadline:
+                raise
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+def warm_up(connections: int):
+    if connections <= 0:
+        return
+    # Pings running at the same time each need their own socket, which then stays pooled
+    barrier = threading.Barrier(connections, timeout=10)
 
+    def ping(_):
+        barrier.wait()
+        client.admin.command('ping')
 
-def get_collection_names() -> list[str]:
-    return db.list_collection_names(filter={
-        # Filter out system collections and views
-        'name': {'$regex': r'^(?!system\.)'}, 'type': 'collection'})
+    with ThreadPoolExecutor(connections) as executor:
+        for result in executor.map(ping, range(connections)):
+            pass  # Propagate exceptions
 
 
-def get_pack_names(doc_type: str) -> list[str]:
-    return db[doc_type].distinct('path.pack')
+def _rebuild_locations():
+    meta_db.locations_next.drop()  # Left over from an interrupted rebuild
+    if not (collections := get_collection_names()):
+        meta_db.locations.drop()
+        return
+    for collection in collections:
+        db[collection].aggregate([
+            {'$project': {'foundry_id': True, 'collection': {'$literal': collection}}},
+            # Like the 'all' view, the first collection wins if an id is in several
+            {'$merge': {'into': {'db': meta_db.name, 'coll': 'locations_next'},
+                        'whenMatched': 'keepExisting'}}
+        ])
+    meta_db.locations_next.create_index('foundry_id')
+    # Swap in atomically, so readers never see a partial lookup
+    meta_db.locations_next.rename('locations', dropTarget=True)
 
 
-def get_pack_content(doc_type: str, pack: str, subpath: str):
-    return db[doc_type].find({'path.pack': pack, 'path.subpath': subpath}, {'name': True})
+def _rebuild_lookups():
+    _rebuild_locations()
+    MongoStorage().rebuild_search()
+    # Caches built since the content changed may have read the old lookups
+    storage.bump_generation()
 
 
-def get_pack_subpaths(doc_type: str, pack: str):
-    return db[doc_type].distinct('path.subpath', {'path.pack': pack, 'path.subpath': {'$ne': ''}})
+# Filter out system collections and views
+_CONTENT_COLLECTIONS = {'name': {'$regex': r'^(?!system\.)'}, 'type': 'collection'}
 
 
-def get_collection_content(name: str):
-    return db[name].find()
+def get_collection_names() -> list[str]:
+    return db.list_collection_names(filter=_CONTENT_COLLECTIONS)
 
 
 def unionOf(collections: list[str]):
@@ -82,17 +123,261 @@ def unionOf(collections: list[str]):
         }
 
 
-def bulk_write(ops: Iterable[_WriteOp]):
-    ops = list(ops)  # Resolve before submitting
-    if len(ops) == 0:
-        return
-    _LOGGER.info('Submitting bulk write')
-    try:
-        result = client.bulk_write(ops)
-        _LOGGER.info(f'Inserted: {result.inserted_count} Upserted: {result.upserted_count} '
-              f'Modified: {result.modified_count} Deleted: {result.deleted_count}')
-    except pymongo.errors.ClientBulkWriteException as ex:
-        _LOGGER.error(f'{type(ex).__name__} {json.dumps(ex.details, indent=2)}')
+class MongoStorage(Storage):
+    def __init__(self, client: MongoClient[Document] | None = None):
+        # Without a client of its own, use the module's, which configure() may replace
+        self._client = client
+
+    @property
+    def db(self) -> Database[Document]:
+        return (self._client or client).pf2e
+
+    @property
+    def meta_db(self) -> Database[Document]:
+        return (self._client or client).pf2e_meta
+
+    def start(self):
+        server = mongo_server.start()
+        with foundry.phase('Waiting for mongod'):
+            wait_for_server(server)
+        with foundry.phase(f'Opening {_warm_connections} connections'):
+            warm_up(_warm_connections)
+        initialise()
+
+    def update(self, progress: Progress, jobs: int = 1, full: bool = False):
+        update(progress, jobs, full)
+
+    def find_documents(self, collection: str, doc_ids: list[str], id_type: IdType
+                       ) -> list[Document]:
+        key = storage.id_key(id_type)
+        if collection != 'all':
+            return list(self.db[collection].find({key: {'$in': doc_ids}}))
+        # Avoid scanning every collection through the view when the owners are known
+        owners: defaultdict[str, list[str]] = defaultdict(list)
+        for location in self.meta_db.locations.find({key: {'$in': doc_ids}}):
+            owners[location['collection']].append(location[key])
+        located = {doc_id for ids in owners.values() for doc_id in ids}
+        if unlocated := [doc_id for doc_id in doc_ids if doc_id not in located]:
+            owners['all'] += unlocated
+        return [doc for owner, ids in owners.items()
+                for doc in self.db[owner].find({key: {'$in': ids}})]
+
+    def collection_names(self) -> list[str]:
+        return self.db.list_collection_names(filter=_CONTENT_COLLECTIONS)
+
+    def pack_names(self, collection: str) -> list[str]:
+        return self.db[collection].distinct('path.pack')
+
+    def pack_content(self, collection: str, pack: str, subpath: str) -> list[Document]:
+        return list(self.db[collection].find({'path.pack': pack, 'path.subpath': subpath},
+                                             {'name': True}))
+
+    def pack_subpaths(self, collection: str, pack: str) -> list[str]:
+        return self.db[collection].distinct('path.subpath',
+                                            {'path.pack': pack, 'path.subpath': {'$ne': ''}})
+
+    def search_query(self, collections: list[str], query: Document, limit: int = 100
+                     ) -> list[Document]:
+        return list(self.db.aggregate([
+            *unionOf(collections),
+            {'$match': query},
+            {
+                '$project': {
+                    'doc_type': True,
+                    'name': True,
+                    'level': {
+                        '$ifNull': ['$system.level.value', '$system.details.level.value']
+                    },
+                    'rarity': '$system.traits.rarity',
+                    'worldContent': '$volatile'
+                }
+            },
+            {
+                '$sort': {
+                    'level': 1,
+                    'name': 1
+                }
+            },
+            {'$limit': limit}
+        ]))
+
+    def search(self, collections: list[str], query: str, mode: MatchMode = 'prefix',
+               limit: int = 100, cursor: str | None = None) -> SearchPage:
+        filter: Document = {'doc_type': {'$in': collections}}
+        match mode, query:
+            case 'prefix' | 'text' | 'regex', '':
+                pass
+            case 'prefix', _:
+                filter['name_lower'] = {'$regex': f'^{re.escape(query.lower())}'}
+            case 'text', _:
+                filter['$text'] = {'$search': query}
+            case 'regex', _:
+                filter['name'] = re.compile(query, re.IGNORECASE)
+            case _:
+                raise ValueError(mode)
+        if cursor is not None:
+            level, name, id = storage.decode_cursor(cursor)
+            filter['$or'] = [
+                {'sort_level': {'$gt': level}},
+                {'sort_level': level, 'name': {'$gt': name}},
+                {'sort_level': level, 'name': name, '_id': {'$gt': id}},
+            ]
+        # One extra document tells us whether there is another page
+        docs = list(self.meta_db.search.find(filter, {'name_lower': False, 'base_name': False})
+                    .sort([('sort_level', 1), ('name', 1), ('_id', 1)])
+                    .limit(limit + 1))
+        page = SearchPage([{key: value for key, value in doc.items()
+                            if key != 'sort_level' and value is not None}
+                           for doc in docs[:limit]])
+        if len(docs) > limit:
+            last = docs[limit - 1]
+            page.next = storage.encode_cursor(last['sort_level'], last['name'], last['_id'])
+        return page
+
+    def search_entries(self) -> Iterable[Document]:
+        for doc in self.meta_db.search.find({}, {'name_lower': False, 'sort_level': False}):
+            yield {key: value for key, value in doc.items() if value is not None}
+
+    def creature_entries(self) -> Iterable[Document]:
+        return self.db.npc.aggregate([{
+            '$project': {
+                'name': 1,
+                'level': '$system.details.level.value',
+                'rarity': '$system.traits.rarity',
+                'size': '$system.traits.size.value',
+                'traits': '$system.traits.value'
+            }
+        }])
+
+    def sample_creatures(self, filters: list[CreatureFilter]) -> list[Document | None]:
+        def to_query(filter: CreatureFilter) -> Document:
+            query: Document = {}
+            match filter.level:
+                case int() as level:
+                    query['system.details.level.value'] = level
+                case int() as min_level, int() as max_level:
+                    query['system.details.level.value'] = {'$gte': min_level, '$lte': max_level}
+                case None:
+                    pass
+            if filter.rarities is not None:
+                query['system.traits.rarity'] = {'$in': filter.rarities}
+            if filter.sizes is not None:
+                query['system.traits.size.value'] = {'$in': filter.sizes}
+            if filter.traits is not None and len(filter.traits) > 0:
+                query['system.traits.value'] = {'$all': filter.traits}
+            return query
+
+        def to_pipeline(filter: CreatureFilter):
+            return [
+                {'$match': to_query(filter)},
+                {'$sample': {'size': 1}},
+                {
+                    '$project': {
+                        'name': 1,
+                        'level': '$system.details.level.value',
+                        'rarity': '$system.traits.rarity'
+                    }
+                }
+            ]
+
+        pipeline = [{
+                '$facet': {
+                    f'combatant{i}': to_pipeline(filter)
+                    for i, filter in enumerate(filters)
+                }
+            },
+            {
+                '$project': {
+                    f'combatant{i}': {'$first': f'$combatant{i}'}
+                    for i in range(len(filters))
+                }
+            }
+        ]
+        [results] = list(self.db.npc.aggregate(pipeline))
+        return [results.get(f'combatant{i}') for i in range(len(filters))]
+
+    def rebuild_search(self):
+        self.meta_db.search_next.drop()  # Left over from an interrupted rebuild
+        if not (collections := self.collection_names()):
+            self.meta_db.search.drop()
+            return
+        for collection in collections:
+            self.db[collection].aggregate([
+                {
+                    '$project': {
+                        'doc_type': {'$literal': collection},
+                        'name': True,
+                        'base_name': True,
+                        # Prefix matches on a lowercased copy can be answered from the index
+                        'name_lower': {'$toLower': '$name'},
+                        'level': {
+                            '$ifNull': ['$system.level.value', '$system.details.level.value']
+                        },
+                        'rarity': '$system.traits.rarity',
+                        'worldContent': '$volatile'
+                    }
+                },
+                {'$set': {'sort_level': {'$ifNull': ['$level', storage.NO_LEVEL]}}},
+                {'$merge': {'into': {'db': self.meta_db.name, 'coll': 'search_next'},
+                            'whenMatched': 'keepExisting'}}
+            ])
+        self.meta_db.search_next.create_indexes([
+            IndexModel([('doc_type', 1), ('name_lower', 1)]),
+            IndexModel([('sort_level', 1), ('name', 1), ('_id', 1)]),
+            IndexModel([('name', 'text')]),
+        ])
+        self.meta_db.search_next.rename('search', dropTarget=True)
+
+    def upsert(self, collection: str, docs: Iterable[Document]) -> int:
+        written = 0
+        for batch in itertools.batched(docs, 1000):
+            result = self.db[collection].bulk_write([
+                pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in batch])
+            written += result.upserted_count + result.modified_count
+        if written:
+            self.rebuild_search()
+            storage.bump_generation()
+        return written
+
+
+def bulk_write(ops: Iterable[_WriteOp], batch_size: int = 1000, ordered: bool = True,
+               progress: Progress | None = None):
+    task = None
+    if progress is not None:
+        task = progress.add_task('Writing documents', total=None, subdesc='')
+    totals: Counter[str] = Counter()
+    written = 0
+
+    def record(result):
+        totals['inserted'] += result.inserted_count
+        totals['upserted'] += result.upserted_count
+        totals['modified'] += result.modified_count
+        totals['deleted'] += result.deleted_count
+
+    # Submit fixed size batches as they fill, so only one batch is held in memory at a time
+    for batch in itertools.batched(ops, batch_size):
+        start = time.perf_counter()
+        try:
+            record(client.bulk_write(list(batch), ordered=ordered))
+        except pymongo.errors.ClientBulkWriteException as ex:
+            _LOGGER.error(f'{type(ex).__name__} {json.dumps(ex.details, indent=2, default=str)}')
+            totals['failed'] += 1
+            if ex.partial_result is not None:
+                record(ex.partial_result)
+            if ordered:
+                break  # Later batches may depend on the failed one
+        written += len(batch)
+        if progress is not None and task is not None:
+            elapsed = time.perf_counter() - start
+            progress.update(task, advance=len(batch),
+                            subdesc=f'{len(batch) / elapsed:,.0f} docs/s' if elapsed else '')
+    if progress is not None and task is not None:
+        progress.update(task, total=written, subdesc='')
+    if totals.total() > 0:
+        storage.bump_generation()
+        _LOGGER.info(f'Inserted: {totals['inserted']} Upserted: {totals['upserted']} '
+                     f'Modified: {totals['modified']} Deleted: {totals['deleted']}')
+    return totals
 
 
 def _purge_world_content():
@@ -100,237 +385,217 @@ def _purge_world_content():
         yield pymongo.DeleteMany({'volatile': True}, namespace=f'pf2e.{collection}')
 
 
-def _open_db(path: Path) -> plyvel.DB:
-    return plyvel.DB(path.as_posix())
+def _revision(doc: Document) -> str:
+    return hashlib.blake2b(json.dumps(doc, sort_keys=True, default=str).encode(),
+                           digest_size=16).hexdigest()
 
 
-def _db_iter(level_db: plyvel.DB) -> Generator[tuple[str, Any], None, None]:
-    for key, doc in cast(Iterable[tuple[bytes, bytes]], level_db):
-        yield key.decode(), json.loads(doc)
+def _world_sources(world: Path) -> list[Path]:
+    return [world/'data'/name for name in ['folders', 'actors', 'items']
+            if (world/'data'/name).exists()]
 
 
-def _resolve_folder_paths(folder_docs: Iterable[Document]) -> dict[str, str]:
-    folders_by_id: dict[str, Document] = {doc['_id']: doc for doc in folder_docs}
+def _world_docs(world: Path) -> Generator[tuple[str, Document], None, None]:
+    with pack_reader.open_db(world/'data/folders') as folders_db:
+        folder_paths = pack_reader.resolve_folder_paths(
+            doc for _, doc in pack_reader.db_iter(folders_db))
+    for content_type in _world_sources(world):
+        if content_type.stem not in ['actors', 'items']:
+            continue
+        yield from pack_reader.read_db(pack_reader.open_db(content_type), world.stem,
+                                       folder_paths)
 
-    def resolve_folder_path(doc: Document) -> str:
-        segments = [doc['name']]
-        while doc['folder'] is not None:
-            doc = folders_by_id[doc['folder']]
-            segments.insert(0, doc['name'])
-        return '/'.join(segments)
-    return {key: resolve_folder_path(doc) for key, doc in folders_by_id.items()}
 
+def sync_world_content(world: Path, force: bool = False):
+    def stats():
+        return {source.name: [list(s) for s in pack_reader.pack_stats(source)]
+                for source in _world_sources(world)}
 
-def _import_db_from_path(db_path: Path, id_root: str, folder_paths: dict[str, str]
-                         ) -> Generator[InsertOne[Document], None, None]:
-    return _import_db(_open_db(db_path), id_root, folder_paths)
+    entry = meta_db.worlds.find_one({'_id': world.as_posix()})
+    if not force and entry is not None and entry['stats'] == stats():
+        _LOGGER.info(f'World {world.stem} unchanged')
+        return
 
+    # Volatile content from any other world is stale too, so consider all of it
+    existing: dict[tuple[str, str], str | None] = {
+        (collection, doc['_id']): doc.get('revision')
+        for collection in get_collection_names()
+        for doc in db[collection].find({'volatile': True}, {'revision': True})
+    }
 
-def _import_db(db: plyvel.DB, id_root: str, folder_paths: dict[str, str]
-               ) -> Generator[InsertOne[Document], None, None]:
-    from ttrpg_scribe.pf2e_compendium.actor.adjustments import (
-        Adjuster, CreatureAdjuster, HazardAdjuster)
-    IGNORED = {None, 'army', 'campaignFeature', 'character', 'familiar', 'script'}
+    def build_ops_batch():
+        for collection, doc in _world_docs(world):
+            doc['volatile'] = True
+            doc['revision'] = revision = _revision(doc)
+            if existing.pop((collection, doc['_id']), None) != revision:
+                yield pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True,
+                                         namespace=f'pf2e.{collection}')
+        # Anything not seen was removed from the world
+        for collection, doc_id in existing:
+            yield pymongo.DeleteOne({'_id': doc_id}, namespace=f'pf2e.{collection}')
+
+    totals = bulk_write(build_ops_batch())
+    if totals['upserted'] or totals['modified']:
+        apply_art({'volatile': True})  # Replaced documents lost their art
+    if totals['upserted'] or totals['modified'] or totals['deleted']:
+        _rebuild_lookups()
+    if totals['failed'] == 0:
+        # Reading the world touches its files, so record stats afterwards
+        meta_db.worlds.replace_one({'_id': world.as_posix()}, {'stats': stats()}, upsert=True)
+
+
+def watch_world(world: Path, interval: float) -> threading.Thread:
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                sync_world_content(world)
+            except plyvel.Error as e:
+                # Foundry holds the world's lock while the world is open
+                _LOGGER.warning(f'Skipping sync of world {world.stem}: {e}')
+            except Exception:
+                _LOGGER.exception(f'Sync of world {world.stem} failed')
 
-    def resolve_id(db: plyvel.DB, prefix: str, content_id: str):
-        return json.loads(db.get(f'!{prefix}!{content_id}'.encode()))
+    thread = threading.Thread(target=watch, name=f'watch-{world.stem}', daemon=True)
+    thread.start()
+    return thread
 
-    def resolve_id_list(db: plyvel.DB, prefix: str,
-                        parent_id: str, content_ids: list[str]):
-        return [resolve_id(db, prefix, f'{parent_id}.{content_id}')
-                for content_id in content_ids]
 
-    def resolve_nested_documents(db: plyvel.DB, doc: Document):
-        match doc['type']:
-            case 'npc' | 'hazard' | 'vehicle':
-                doc['items'] = resolve_id_list(db, 'actors.items',
-                                               doc['_id'], doc['items'])
+def _art_files(suffixes: set[str]) -> dict[str, int]:
+    art_dir = pf2e_compendium.data_dir/'art'
+    return {art.relative_to(art_dir).as_posix(): art.stat().st_mtime_ns
+            for art in sorted(art_dir.glob('**/*.*', recurse_symlinks=True))
+            if art.suffix in suffixes}
 
-    class PF2ActorDocAdjuster(Adjuster[Document]):
-        @property
-        def name(self) -> str:
-            return self.obj['name']
 
-        @name.setter
-        def name(self, name: str):
-            self.obj['name'] = name
+def _art_key(path: str) -> tuple[str, str]:
+    # Art is matched to documents in the collection named by its top level folder
+    art = PurePosixPath(path)
+    return art.parts[0], art.stem
 
-        @property
-        def level(self) -> int:
-            return self.obj['system']['details']['level']['value']
 
-        @level.setter
-        def level(self, level: int):
-            self.obj['system']['details']['level']['value'] = level
+def _by_collection(art_paths: Iterable[str]) -> dict[str, dict[str, str]]:
+    grouped: dict[str, dict[str, str]] = defaultdict(dict)
+    for path in art_paths:
+        collection, name = _art_key(path)
+        grouped[collection][name] = path
+    return grouped
 
-        def ac(self, delta: int):
-            self.obj['system']['attributes']['ac']['value'] += delta
 
-        def dcs(self, delta: int):
-            for item in self.obj['items']:
-                if 'description' not in item['system']:
-                    continue
-                item['system']['description']['value'] = re.sub(
-                    r'([AD]C) (\d+)',
-                    lambda match: f'{match[1]} {int(match[2]) + delta}',
-                    item['system']['description']['value']
-                )
+def _set_art(art_paths: Iterable[str], query: Document = {}):
+    for collection, art_by_name in _by_collection(art_paths).items():
+        names = list(art_by_name)
+        yield pymongo.UpdateMany(
+            query | {'base_name': {'$in': names}},
+            [{'$set': {'art': {'$arrayElemAt': [
+                {'$literal': list(art_by_name.values())},
+                {'$indexOfArray': [names, '$base_name']}
+            ]}}}],
+            namespace=f'pf2e.{collection}')
 
-        def saves(self, delta: int):
-            self.obj['system']['saves'] = {
-                save: data | {'value': data['value'] + delta}
-                for save, data in self.obj['system']['saves'].items()
-                if data['value'] is not None
-            }
 
-        def max_hp(self, delta: int):
-            self.obj['system']['attributes']['hp']['max'] += delta
-            self.obj['system']['attributes']['hp']['value'] += delta
-
-        def damaging_actions(self, attack_delta: int, damage_delta: int):
-            def with_delta(formula: str, delta: int):
-                if formula.isnumeric():
-                    return str(int(formula) + delta)
-                else:
-                    return f'{formula}{damage_delta:+d}'
-
-            for item in self.obj['items']:
-                if item['type'] not in ['melee', 'spell']:
-                    continue
-                if 'bonus' in item['system']:
-                    item['system']['bonus']['value'] += attack_delta
-                for damage_roll in item['system'].get('damageRolls', {}).values():
-                    damage_roll['damage'] = with_delta(damage_roll['damage'], damage_delta)
-                for damage in item['system'].get('damage', {}).values():
-                    damage['formula'] = with_delta(damage['formula'], damage_delta)
-
-    class PF2CreatureDocAdjuster(PF2ActorDocAdjuster, CreatureAdjuster[Document]):
-        def perception(self, delta: int):
-            self.obj['system']['perception']['mod'] += delta
-
-        def skills(self, delta: int):
-            for skill in self.obj['system']['skills'].values():
-                skill['base'] += delta
-                for special in skill.get('special', []):
-                    special['base'] += delta
-
-        def spellcasting(self, attack_delta: int, dc_delta: int):
-            for item in self.obj['items']:
-                if item['type'] != 'spellcastingEntry':
-                    continue
-                item['system']['spelldc']['value'] += attack_delta
-                item['system']['spelldc']['dc'] += dc_delta
-
-    class PF2HazardDocAdjuster(PF2ActorDocAdjuster, HazardAdjuster[Document]):
-        def stealth(self, delta: int):
-            self.obj['system']['attributes']['stealth']['value'] += delta
-
-    def adjust_doc(doc: Document, doc_type: str):
-        adjustment = doc.get('system', {}).get('attributes', {}).pop('adjustment', None)
-        if adjustment in [None, '']:
-            return doc
-        match doc_type:
-            case 'npc':
-                adjuster = PF2CreatureDocAdjuster(doc)
-            case 'hazard':
-                adjuster = PF2HazardDocAdjuster(doc)
-            case _:
-                raise ValueError(f'No adjuster for {doc_type}')
-        match adjustment:
-            case 'elite':
-                return adjuster.elite(rename=False)
-            case 'weak':
-                return adjuster.weak(rename=False)
-            case _:
-                raise ValueError(f'Unknown adjustment {adjustment}')
-
-    def import_doc(doc_id: str, doc: Document):
-        TYPE_TO_COLL: dict[str, str] = {t: 'equipment' for t in
-                        ['armor', 'backpack', 'consumable', 'kit', 'shield', 'treasure', 'weapon']}
-        doc_type: str = doc['type']
-        assert isinstance(doc_type, str)
-        doc = adjust_doc(doc, doc_type)
-        collection = TYPE_TO_COLL.get(doc_type, doc_type)
-        doc['_id'], doc['foundry_id'] = doc_id, doc['_id']
-        doc['base_name'] = doc['name'] if ' (' not in doc['name'] else doc['name'][:doc['name'].find(' (')]
-        doc['path'] = {}
-        [doc['path']['pack'], *subfolders, doc['path']['stem']] = doc_id.split('/')
-        doc['path']['subpath'] = '/'.join(subfolders)
-        return pymongo.InsertOne(doc, namespace=f'pf2e.{collection}')
-
-    with db:
-        for key, doc in _db_iter(db):
-            if not isinstance(doc, dict) or doc.get('type') in IGNORED:
-                continue
-            doc = cast(dict[str, Any], doc)
-            try:
-                _, kind, _ = key.split('!')
-                if kind == 'folders' or '.' in kind:
-                    continue  # Ignore nested documents and folders
-                resolve_nested_documents(db, doc)
-                id_parts: list[str] = [id_root, doc['name']]
-                if (folder := folder_paths.get(doc.get('folder', ''))) is not None:
-                    id_parts = [id_root, *folder.split('/'), doc['name']]
-                yield import_doc(doc_id='/'.join(map(slugify, id_parts)), doc=doc)
-            except Exception as e:
-                e.add_note(f'{doc['name']=}')
-                raise e
-
-
-def load_world_content(world: Path):
-    with _open_db(world/'data/folders') as folders_db:
-        folder_paths = _resolve_folder_paths(doc for _, doc in _db_iter(folders_db))
+def _unset_art(art_paths: Iterable[str]):
+    for collection, art_by_name in _by_collection(art_paths).items():
+        yield pymongo.UpdateMany({'art': {'$in': list(art_by_name.values())}},
+                                 {'$unset': {'art': ''}},
+                                 namespace=f'pf2e.{collection}')
 
-    def build_ops_batch():
-        # Purge existing data
-        yield from _purge_world_content()
-        # Load data
-        for content_type in (world/'data').iterdir():
-            if content_type.stem not in ['actors', 'items']:
-                continue
-            yield from _import_db_from_path(content_type, world.stem, folder_paths)
 
-    bulk_write(build_ops_batch())
+def apply_art(query: Document = {}):
+    bulk_write(_set_art(sorted(entry['_id'] for entry in meta_db.art.find()), query))
 
 
-def initialise():
+def sync_art(force: bool = False):
+    current = _art_files({'.png', '.webp'})
+    recorded: dict[str, int] = {} if force else {
+        entry['_id']: entry['mtime'] for entry in meta_db.art.find()}
+    changed = [path for path, mtime in current.items() if recorded.get(path) != mtime]
+    removed = [path for path in recorded if path not in current]
+    if not changed and not removed:
+        return
+    _LOGGER.info(f'{len(changed)} art files changed, {len(removed)} removed')
+
+    # Files sharing a collection and stem compete for the same documents, so all of them are
+    # set again in sorted order, the order apply_art uses, and removing one leaves the other
+    touched = {_art_key(path) for path in itertools.chain(changed, removed)}
+    applied = [path for path in current if _art_key(path) in touched]
+    totals = bulk_write(itertools.chain(_unset_art(removed), _set_art(applied)))
+    if totals['failed'] == 0:
+        if removed:
+            meta_db.art.delete_many({'_id': {'$in': removed}})
+        if changed:
+            meta_db.art.bulk_write([pymongo.ReplaceOne({'_id': path}, {'mtime': current[path]},
+                                                       upsert=True)
+                                    for path in changed])
+
+
+def _configured_world() -> Path | None:
     if (world := os.environ.get('PF2E_COMPENDIUM_FOUNDRY_WORLD')) is not None:
-        load_world_content(Path(world))
-    else:
-        bulk_write(_purge_world_content())
+        return Path(world)
+    return None
 
-    def art_paths(suffixes: set[str]):
-        art_dir = pf2e_compendium.data_dir/'art'
-        for art in art_dir.glob(f'**/*.*', recurse_symlinks=True):
-            if art.suffix not in suffixes:
-                continue
-            art = art.relative_to(art_dir)
-            yield pymongo.UpdateMany(
-                {'base_name': art.stem},
-                {'$set': {'art': art.as_posix()}},
-                namespace=f'pf2e.{art.parts[0]}')
 
-    bulk_write(art_paths({'.png', '.webp'}))
-
-def update(progress: Progress):
-    client.drop_database('pf2e')
+def initialise():
+    if (world := _configured_world()) is not None:
+        with foundry.phase('Syncing world content'):
+            sync_world_content(world)
+        if (interval := os.environ.get('PF2E_COMPENDIUM_WATCH_WORLD')) is not None:
+            watch_world(world, float(interval))
+    else:
+        with foundry.phase('Purging world content'):
+            if bulk_write(_purge_world_content())['deleted']:
+                _rebuild_lookups()
+            meta_db.worlds.delete_many({})
+    with foundry.phase('Syncing art'):
+        sync_art()
+    if not {'locations', 'search'} <= set(meta_db.list_collection_names()):
+        with foundry.phase('Building lookups'):
+            _rebuild_lookups()
+
+
+def update(progress: Progress, jobs: int = 1, full: bool = False):
+    packs: list = foundry.system_data('packs')
+    if full:
+        # World content goes with the database, so it's no longer in sync either
+        client.drop_database('pf2e')
+        meta_db.packs.drop()
+        meta_db.worlds.drop()
+        storage.bump_generation()
+    changed, removed, restats = pack_reader.diff_manifest(
+        packs, {entry['_id']: entry for entry in meta_db.packs.find()})
+    for name, stats in restats.items():
+        meta_db.packs.update_one({'_id': name}, {'$set': {'stats': stats}})
+    _LOGGER.info(f'{len(changed)} packs changed, {len(removed)} packs removed, '
+                 f'{len(packs) - len(changed)} packs unchanged')
+
+    def delete_stale_content():
+        for collection in get_collection_names():
+            for name in [*removed, *(pack['name'] for pack in changed)]:
+                yield pymongo.DeleteMany({'path.pack': name, 'volatile': {'$ne': True}},
+                                         namespace=f'pf2e.{collection}')
 
     def build_ops_batch():
-        packs: list = foundry.system_data('packs')
-        with progress:
-            task = progress.add_task('Loading packs', total=len(packs), subdesc='')
-            for pack in packs:
-                progress.update(task, subdesc=pack['name'])
-                with _open_db(foundry.pf2e_dir/pack['path']) as content_db:
-                    folder_paths = _resolve_folder_paths(doc for key, doc in _db_iter(content_db)
-                                                         if '!folders!' in key)
-                    yield from _import_db(content_db, pack['name'], folder_paths)
-                progress.advance(task)
-            progress.update(task, subdesc='')
-
-    bulk_write(build_ops_batch())
-
-    for name in db.list_collection_names():
+        task = progress.add_task('Loading packs', total=len(changed), subdesc='')
+        for name, docs in pack_reader.read_packs(changed, jobs):
+            progress.update(task, subdesc=name)
+            for collection, doc in docs:
+                yield pymongo.InsertOne(doc, namespace=f'pf2e.{collection}')
+            progress.advance(task)
+        progress.update(task, subdesc='')
+
+    bulk_write(delete_stale_content())
+    with progress:
+        # Stale content is already gone, so the inserts don't depend on each other
+        totals = bulk_write(build_ops_batch(), ordered=False, progress=progress)
+    if totals['failed'] == 0:
+        for pack in changed:
+            meta_db.packs.replace_one({'_id': pack['name']}, pack_reader.manifest_entry(pack),
+                                      upsert=True)
+    meta_db.packs.delete_many({'_id': {'$in': removed}})
+    apply_art({'path.pack': {'$in': [pack['name'] for pack in changed]}})
+
+    collections = get_collection_names()
+    for name in collections:
         db[name].create_indexes([
             IndexModel('foundry_id'),
             IndexModel('path.pack'),
@@ -339,5 +604,9 @@ def update(progress: Progress):
             IndexModel('base_name'),
         ])
 
-    [base, *rest] = db.list_collection_names()
+    [base, *rest] = collections
+    db.drop_collection('all')
     db.command('create', 'all', viewOn=base, pipeline=[{'$unionWith': c} for c in rest])
+    _rebuild_lookups()
+    if full and (world := _configured_world()) is not None:
+        sync_world_content(world)
@@ -10,7 +10,7 @@ _LOGGER = logging.getLogger(__name__)
 CONNECTION_ARGS = '127.0.0.1', 48165
 
 
-def start():
+def start() -> subprocess.Popen:
     IP, PORT = CONNECTION_ARGS
 
     (mongo_dir := pf2e_compendium.data_dir/'mongod').mkdir(parents=True, exist_ok=True)
@@ -41,3 +41,4 @@ def start():
         _LOGGER.info('Stopping mongo server')
         server.terminate()
     atexit.register(stop)
+    return server
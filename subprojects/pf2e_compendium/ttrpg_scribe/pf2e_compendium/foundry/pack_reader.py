@@ -0,0 +1,328 @@
+import hashlib
+import json
+import multiprocessing
+import re
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from pathlib import Path
+from typing import (Any, Callable, Container, Generator, Iterable, Literal,
+                    cast)
+
+import plyvel
+from slugify import slugify
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import enrich, packs
+from ttrpg_scribe.pf2e_compendium.foundry.storage import Document
+
+# Bump when import logic changes, so every pack is reimported on the next update
+IMPORT_VERSION = 1
+
+try:
+    import orjson
+    _json_loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def open_db(path: Path) -> plyvel.DB:
+    return plyvel.DB(path.as_posix())
+
+
+_TYPE_FIELD = re.compile(rb'"type"\s*:\s*"([^"\\]*)"')
+_JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+
+def _peek_type(value: bytes) -> str | None:
+    if (match := _TYPE_FIELD.search(value)) is None:
+        return None
+    # Only trust the match if it's a top level field. Strings are dropped first so braces in
+    # them aren't counted.
+    preceding = _JSON_STRING.sub(b'', value[:match.start()])
+    if preceding.count(b'{') - preceding.count(b'}') != 1:
+        return None
+    return match[1].decode()
+
+
+def db_iter(level_db: plyvel.DB, prefix: str = '', kinds: Callable[[str], bool] | None = None,
+            skip_types: Container[str | None] = frozenset(),
+            loads: Callable[[bytes], Any] = _json_loads
+            ) -> Generator[tuple[str, Any], None, None]:
+    entries = cast(Iterable[tuple[bytes, bytes]],
+                   level_db.iterator(prefix=prefix.encode() or None))
+    for raw_key, value in entries:
+        key = raw_key.decode()
+        if kinds is not None and not kinds(key.split('!')[1]):
+            continue
+        # Skip unwanted documents without paying for a full decode
+        if skip_types and (doc_type := _peek_type(value)) is not None \
+                and doc_type in skip_types:
+            continue
+        yield key, loads(value)
+
+
+def resolve_folder_paths(folder_docs: Iterable[Document]) -> dict[str, str]:
+    folders_by_id: dict[str, Document] = {doc['_id']: doc for doc in folder_docs}
+
+    def resolve_folder_path(doc: Document) -> str:
+        segments = [doc['name']]
+        while doc['folder'] is not None:
+            doc = folders_by_id[doc['folder']]
+            segments.insert(0, doc['name'])
+        return '/'.join(segments)
+    return {key: resolve_folder_path(doc) for key, doc in folders_by_id.items()}
+
+
+type NestedResolution = Literal['point', 'prefix']
+
+
+def read_db(db: plyvel.DB, id_root: str, folder_paths: dict[str, str],
+            nested: NestedResolution = 'prefix'
+            ) -> Generator[tuple[str, Document], None, None]:
+    from ttrpg_scribe.pf2e_compendium.actor.adjustments import (
+        Adjuster, CreatureAdjuster, HazardAdjuster)
+    IGNORED = {None, 'army', 'campaignFeature', 'character', 'familiar', 'script'}
+
+    def resolve_id(db: plyvel.DB, prefix: str, content_id: str):
+        return _json_loads(db.get(f'!{prefix}!{content_id}'.encode()))
+
+    def resolve_id_list(db: plyvel.DB, prefix: str,
+                        parent_id: str, content_ids: list[str]):
+        match nested:
+            case 'point':
+                return [resolve_id(db, prefix, f'{parent_id}.{content_id}')
+                        for content_id in content_ids]
+            case 'prefix':
+                # One ordered scan over the parent's children instead of a random read per child
+                key_prefix = f'!{prefix}!{parent_id}.'.encode()
+                children = {key[len(key_prefix):].decode(): value for key, value
+                            in cast(Iterable[tuple[bytes, bytes]],
+                                    db.iterator(prefix=key_prefix))}
+                return [_json_loads(children[content_id]) for content_id in content_ids]
+
+    def resolve_nested_documents(db: plyvel.DB, doc: Document):
+        match doc['type']:
+            case 'npc' | 'hazard' | 'vehicle':
+                doc['items'] = resolve_id_list(db, 'actors.items',
+                                               doc['_id'], doc['items'])
+
+    class PF2ActorDocAdjuster(Adjuster[Document]):
+        @property
+        def name(self) -> str:
+            return self.obj['name']
+
+        @name.setter
+        def name(self, name: str):
+            self.obj['name'] = name
+
+        @property
+        def level(self) -> int:
+            return self.obj['system']['details']['level']['value']
+
+        @level.setter
+        def level(self, level: int):
+            self.obj['system']['details']['level']['value'] = level
+
+        def ac(self, delta: int):
+            self.obj['system']['attributes']['ac']['value'] += delta
+
+        def dcs(self, delta: int):
+            for item in self.obj['items']:
+                if 'description' not in item['system']:
+                    continue
+                item['system']['description']['value'] = re.sub(
+                    r'([AD]C) (\d+)',
+                    lambda match: f'{match[1]} {int(match[2]) + delta}',
+                    item['system']['description']['value']
+                )
+
+        def saves(self, delta: int):
+            self.obj['system']['saves'] = {
+                save: data | {'value': data['value'] + delta}
+                for save, data in self.obj['system']['saves'].items()
+                if data['value'] is not None
+            }
+
+        def max_hp(self, delta: int):
+            self.obj['system']['attributes']['hp']['max'] += delta
+            self.obj['system']['attributes']['hp']['value'] += delta
+
+        def damaging_actions(self, attack_delta: int, damage_delta: int):
+            def with_delta(formula: str, delta: int):
+                if formula.isnumeric():
+                    return str(int(formula) + delta)
+                else:
+                    return f'{formula}{damage_delta:+d}'
+
+            for item in self.obj['items']:
+                if item['type'] not in ['melee', 'spell']:
+                    continue
+                if 'bonus' in item['system']:
+                    item['system']['bonus']['value'] += attack_delta
+                for damage_roll in item['system'].get('damageRolls', {}).values():
+                    damage_roll['damage'] = with_delta(damage_roll['damage'], damage_delta)
+                for damage in item['system'].get('damage', {}).values():
+                    damage['formula'] = with_delta(damage['formula'], damage_delta)
+
+    class PF2CreatureDocAdjuster(PF2ActorDocAdjuster, CreatureAdjuster[Document]):
+        def perception(self, delta: int):
+            self.obj['system']['perception']['mod'] += delta
+
+        def skills(self, delta: int):
+            for skill in self.obj['system']['skills'].values():
+                skill['base'] += delta
+                for special in skill.get('special', []):
+                    special['base'] += delta
+
+        def spellcasting(self, attack_delta: int, dc_delta: int):
+            for item in self.obj['items']:
+                if item['type'] != 'spellcastingEntry':
+                    continue
+                item['system']['spelldc']['value'] += attack_delta
+                item['system']['spelldc']['dc'] += dc_delta
+
+    class PF2HazardDocAdjuster(PF2ActorDocAdjuster, HazardAdjuster[Document]):
+        def stealth(self, delta: int):
+            self.obj['system']['attributes']['stealth']['value'] += delta
+
+    def adjust_doc(doc: Document, doc_type: str):
+        adjustment = doc.get('system', {}).get('attributes', {}).pop('adjustment', None)
+        if adjustment in [None, '']:
+            return doc
+        match doc_type:
+            case 'npc':
+                adjuster = PF2CreatureDocAdjuster(doc)
+            case 'hazard':
+                adjuster = PF2HazardDocAdjuster(doc)
+            case _:
+                raise ValueError(f'No adjuster for {doc_type}')
+        match adjustment:
+            case 'elite':
+                return adjuster.elite(rename=False)
+            case 'weak':
+                return adjuster.weak(rename=False)
+            case _:
+                raise ValueError(f'Unknown adjustment {adjustment}')
+
+    def import_doc(doc_id: str, doc: Document):
+        TYPE_TO_COLL: dict[str, str] = {t: 'equipment' for t in
+                        ['armor', 'backpack', 'consumable', 'kit', 'shield', 'treasure', 'weapon']}
+        doc_type: str = doc['type']
+        assert isinstance(doc_type, str)
+        doc = adjust_doc(doc, doc_type)
+        collection = TYPE_TO_COLL.get(doc_type, doc_type)
+        doc['_id'], doc['foundry_id'] = doc_id, doc['_id']
+        doc['base_name'] = doc['name'] if ' (' not in doc['name'] else doc['name'][:doc['name'].find(' (')]
+        doc['path'] = {}
+        [doc['path']['pack'], *subfolders, doc['path']['stem']] = doc_id.split('/')
+        doc['path']['subpath'] = '/'.join(subfolders)
+        packs.pre_enrich(doc)
+        return collection, doc
+
+    def is_top_level(kind: str):
+        return kind != 'folders' and '.' not in kind  # Ignore nested documents and folders
+
+    with db:
+        for _, doc in db_iter(db, kinds=is_top_level, skip_types=IGNORED):
+            if not isinstance(doc, dict) or doc.get('type') in IGNORED:
+                continue
+            doc = cast(dict[str, Any], doc)
+            try:
+                resolve_nested_documents(db, doc)
+                id_parts: list[str] = [id_root, doc['name']]
+                if (folder := folder_paths.get(doc.get('folder', ''))) is not None:
+                    id_parts = [id_root, *folder.split('/'), doc['name']]
+                yield import_doc(doc_id='/'.join(map(slugify, id_parts)), doc=doc)
+            except Exception as e:
+                e.add_note(f'{doc['name']=}')
+                raise e
+
+
+def read_pack(name: str, path: Path) -> Generator[tuple[str, Document], None, None]:
+    with open_db(path) as content_db:
+        folder_paths = resolve_folder_paths(doc for _, doc
+                                            in db_iter(content_db, prefix='!folders!'))
+        yield from read_db(content_db, name, folder_paths)
+
+
+def _read_pack_batch(name: str, path: Path) -> list[tuple[str, Document]]:
+    return list(read_pack(name, path))
+
+
+def read_packs(packs: list[Document], jobs: int
+               ) -> Generator[tuple[str, Iterable[tuple[str, Document]]], None, None]:
+    pack_paths = [(pack['name'], foundry.pf2e_dir/pack['path']) for pack in packs]
+    if jobs <= 1:
+        for name, path in pack_paths:
+            yield name, read_pack(name, path)
+        return
+    # Spawn so workers don't inherit the parent's database clients or open LevelDB handles
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        queued = deque(pack_paths)
+        in_flight: dict[Future[list[tuple[str, Document]]], str] = {}
+        while queued or in_flight:
+            # Bound the number of finished but unwritten packs held in memory
+            while queued and len(in_flight) < 2 * jobs:
+                name, path = queued.popleft()
+                in_flight[executor.submit(_read_pack_batch, name, path)] = name
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future.result()
+
+
+def import_version() -> list[int]:
+    # Descriptions are enriched on import, so they go stale with the enricher too
+    return [IMPORT_VERSION, enrich.VERSION]
+
+
+def pack_stats(path: Path) -> list[tuple[str, int, int]]:
+    # LevelDB rewrites these on every open, regardless of whether any content changed
+    VOLATILE = {'LOCK', 'LOG', 'LOG.old'}
+    return [(file.name, (stat := file.stat()).st_size, stat.st_mtime_ns)
+            for file in sorted(path.iterdir())
+            if file.is_file() and file.name not in VOLATILE]
+
+
+def pack_hash(path: Path) -> str:
+    digest = hashlib.blake2b()
+    with open_db(path) as level_db:
+        for key, value in cast(Iterable[tuple[bytes, bytes]], level_db):
+            for part in (key, value):
+                digest.update(len(part).to_bytes(8, 'little'))
+                digest.update(part)
+    return digest.hexdigest()
+
+
+def diff_manifest(packs: list[Document], manifest: dict[str, Document]
+                  ) -> tuple[list[Document], list[str], dict[str, list[tuple[str, int, int]]]]:
+    changed = []
+    # Packs whose files were touched without their content changing, with their new stats
+    restats = {}
+    manifest = dict(manifest)
+    for pack in packs:
+        path = foundry.pf2e_dir/pack['path']
+        entry = manifest.pop(pack['name'], None)
+        if entry is None or entry['import_version'] != import_version():
+            changed.append(pack)
+        elif [tuple(s) for s in entry['stats']] == pack_stats(path):
+            continue
+        # Opening a pack touches its files, so fall back to comparing content
+        elif entry['hash'] == pack_hash(path):
+            restats[pack['name']] = pack_stats(path)
+        else:
+            changed.append(pack)
+    # Anything left in the manifest is no longer part of the system
+    return changed, list(manifest), restats
+
+
+def manifest_entry(pack: Document) -> Document:
+    path = foundry.pf2e_dir/pack['path']
+    # Hashing opens the pack, which touches its files, so take the stats afterwards
+    hash = pack_hash(path)
+    return {
+        'path': pack['path'],
+        'stats': pack_stats(path),
+        'hash': hash,
+        'import_version': import_version(),
+    }
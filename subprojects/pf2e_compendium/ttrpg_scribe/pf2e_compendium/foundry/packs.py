@@ -1,6 +1,9 @@
+import copy
 import logging
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Any, Callable
+from typing import Any, Callable, Mapping
 
 from slugify import slugify
 
@@ -8,10 +11,14 @@ from ttrpg_scribe.core.dice import SimpleDice
 from ttrpg_scribe.core.json_path import JsonPath
 from ttrpg_scribe.pf2e_compendium.actions import Action, Strike
 from ttrpg_scribe.pf2e_compendium.actor import ActionsContainer, DetailedValue
+from ttrpg_scribe.pf2e_compendium import foundry
 from ttrpg_scribe.pf2e_compendium.creature import (PF2Creature, Sense, Skill,
                                                    Spellcasting)
-from ttrpg_scribe.pf2e_compendium.foundry import mongo_client, roll_data
-from ttrpg_scribe.pf2e_compendium.foundry.enrich import enrich
+from ttrpg_scribe.pf2e_compendium.foundry import enrich as enricher
+from ttrpg_scribe.pf2e_compendium.foundry import roll_data, storage
+from ttrpg_scribe.pf2e_compendium.foundry.enrich import embeds, enrich
+from ttrpg_scribe.pf2e_compendium.foundry.enrich.memo import (
+    normalise_statistics, renumber_statistics)
 from ttrpg_scribe.pf2e_compendium.hazard import PF2Hazard
 from ttrpg_scribe.pf2e_compendium.spell import PF2Spell
 
@@ -20,6 +27,73 @@ type Json = dict[str, Any]
 _VALIDATION = logging.getLogger('validation')
 
 
+def _renumbered(value: Any, seen: set[int]) -> Any:
+    match value:
+        case str() if 'id="statistic-' in value:
+            return type(value)(renumber_statistics(value))
+        case str():
+            return value
+    if id(value) in seen:
+        return value
+    seen.add(id(value))
+    match value:
+        case list():
+            value[:] = [_renumbered(item, seen) for item in value]
+        case dict():
+            for key, item in value.items():
+                value[key] = _renumbered(item, seen)
+        case tuple() if type(value) is tuple:
+            return tuple(_renumbered(item, seen) for item in value)
+        case _ if hasattr(value, '__dict__'):
+            attributes = vars(value)
+            for name, item in attributes.items():
+                attributes[name] = _renumbered(item, seen)
+    return value
+
+
+def _fresh_copy[T](model: T) -> T:
+    # Every copy may end up on the same page, so each gets statistic ids of its own
+    return _renumbered(copy.deepcopy(model), set())
+
+
+class ModelCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, ...], Any] = OrderedDict()
+        self._generation = storage.generation()
+        self._lock = threading.Lock()
+
+    def get_or_read[T](self, key: tuple[str, ...], read: Callable[[], T]) -> T:
+        # Templates mutate models in place, so cached models are never handed out directly
+        read_generation = storage.generation()
+        with self._lock:
+            if self._generation != read_generation:
+                self._entries.clear()
+                self._generation = read_generation
+            if (model := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _fresh_copy(model)
+            self.misses += 1
+        model = read()
+        with self._lock:
+            if self._generation == read_generation == storage.generation():
+                self._entries[key] = model
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return _fresh_copy(model)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'generation': self._generation}
+
+
+model_cache = ModelCache(max_entries=1024)
+
+
 def creature(id: str) -> PF2Creature:
     return _try_read(_read_creature, id, 'npc', 'creature')
 
@@ -142,10 +216,7 @@ def _read_creature(json: Json) -> PF2Creature:
                         location = system.location.value(item, _or=None)
                     spellcasting_lists[location].add_spell(item)
                 case 'condition':
-                    actions.add(Action(
-                        item['name'],
-                        enrich(system.description.value(item), item_roll_data),
-                        cost=0))
+                    actions.add(Action(item['name'], _description(item, item_roll_data), cost=0))
                 case 'effect':
                     # Items that don't need to be in the stat block
                     pass
@@ -281,7 +352,7 @@ def _read_spell(json: Json):
         return duration.get('value')
 
     duration: str | None = system.duration.map(json, read_duration)
-    description: str = enrich(system.description.value(json), spell_roll_data)
+    description: str = _description(json, spell_roll_data)
 
     return PF2Spell(
         name=name,
@@ -301,11 +372,56 @@ def _read_spell(json: Json):
     )
 
 
+def _description(json: Json, context: Mapping[str, Any] = {}, optional: bool = False) -> str:
+    description = JsonPath('system').description
+    if description.enricherVersion(json, _or=None) == enricher.VERSION:
+        return renumber_statistics(description.enriched(json))
+    return enrich(description.value(json, _or='') if optional else description.value(json),
+                  context)
+
+
+def pre_enrich(doc: Json):
+    def stamp(json: Json, context: Mapping[str, Any]):
+        description = json.get('system', {}).get('description')
+        if not isinstance(description, dict) or not (text := description.get('value')):
+            return
+        if '@Embed' in text:
+            return  # Embedded documents may not have been imported yet
+        try:
+            # Stored ids are renumbered on read, and must not change the document between imports
+            description['enriched'] = normalise_statistics(enrich(text, context))
+        except Exception:
+            return  # Left to live enrichment, which reports errors with the document
+        description['enricherVersion'] = enricher.VERSION
+
+    # The same contexts the readers enrich with, from copies as roll data modifies documents
+    match doc.get('type'):
+        case 'npc' | 'hazard':
+            actor_roll_data = roll_data.actor(dict(doc))
+            for item in doc.get('items', []):
+                match item.get('type'):
+                    case 'action' | 'condition':
+                        stamp(item, actor_roll_data | roll_data.item(dict(item)))
+                    case 'melee':
+                        stamp(item, {})
+        case 'spell':
+            stamp(doc, roll_data.spell(dict(doc)))
+
+
+def _with_embeds[T](f: Callable[[Json], T], json: Json) -> T:
+    # Everything the document embeds is fetched together, before any of it is enriched
+    with embeds.batch(embeds.texts_with_embeds(json)):
+        return f(json)
+
+
 def _try_read[T](f: Callable[[Json], T], id: str, collection: str, data_type: str | None = None):
     if data_type is None:
         data_type = collection
+    foundry.wait_for_initialisation()
     try:
-        return f(mongo_client.get_document(collection, id))
+        return model_cache.get_or_read(
+            (data_type, collection, id),
+            lambda: _with_embeds(f, storage.get_document(collection, id)))
     except Exception as e:
         e.add_note(f'Reading {data_type} {id}')
         raise
@@ -325,7 +441,7 @@ def _read_simple_action(item, item_roll_data):
             cost = 0
         case unknown:
             raise ValueError(f'Unknown action type {unknown}')
-    return Action(item['name'], enrich(system.description.value(item), item_roll_data),
+    return Action(item['name'], _description(item, item_roll_data),
                         cost, system.traits.value(item),
                         category=system.category(item, _or=None) or 'interaction')
 
@@ -355,7 +471,7 @@ def _read_strike(item):
         strike_type,
         system.bonus.value(item),
         [damage(data) for data in system.damageRolls(item).values()],
-        desc=enrich(system.description.value(item, _or='')),
+        desc=_description(item, optional=True),
         traits=system.traits.value(item),
         effects=system.attackEffects.value(item)
             if 'attackEffects' in system(item) else []
@@ -363,21 +479,24 @@ def _read_strike(item):
 
 
 def read_doc(doc_type: str, id: str):
-    return read(mongo_client.get_document(doc_type, id))
+    foundry.wait_for_initialisation()
+    return model_cache.get_or_read(('doc', doc_type, id),
+                                   lambda: read(storage.get_document(doc_type, id)))
 
 
 def read(data: dict[str, Any]):
     if 'type' not in data:
         return ('raw', data)
+    foundry.wait_for_initialisation()
     type: str = data['type']
     try:
         match type:
             case 'npc':
-                return ('creature', _read_creature(data))
+                return ('creature', _with_embeds(_read_creature, data))
             case 'hazard':
-                return (type, _read_hazard(data))
+                return (type, _with_embeds(_read_hazard, data))
             case 'spell':
-                return (type, _read_spell(data))
+                return (type, _with_embeds(_read_spell, data))
             case _:
                 return (f'raw-{type}', data)
     except Exception as e:
@@ -385,12 +504,37 @@ def read(data: dict[str, Any]):
         raise
 
 
+_BATCHED_READERS: dict[Callable[[str], Any], str] = {
+    creature: 'npc',
+    hazard: 'hazard',
+    spell: 'spell',
+}
+
+
+def _read_batched(requests: list[tuple[Callable[[str], Any], str]]) -> list[Any]:
+    # Notes pages read the compendium through here, outside the compendium routes' gate
+    foundry.wait_for_initialisation()
+    by_collection: dict[str, list[str]] = {}
+    for factory, id in requests:
+        if (collection := _BATCHED_READERS.get(factory)) is not None:
+            by_collection.setdefault(collection, []).append(id)
+    # One round trip per collection, which also warms the document cache for the reads below
+    not_found: list[str] = []
+    for collection, ids in by_collection.items():
+        docs = storage.get_documents(collection, ids, optional=True)
+        not_found += (f'{collection}/{id}' for id in dict.fromkeys(ids) if id not in docs)
+    if not_found:
+        raise KeyError(f'Not found: {', '.join(not_found)}')
+    return [factory(id) for factory, id in requests]
+
+
 def keyed(*values: tuple[Callable[[str], Any], str | list[str]]) -> dict[str, Any]:
     def key(id: str):
         return id.rsplit('/', maxsplit=1)[-1].upper().replace('-', '_')
-    return {key(id): factory(id)
-            for factory, ids in values
-            for id in ([ids] if isinstance(ids, str) else ids)}
+    requests = [(factory, id)
+                for factory, ids in values
+                for id in ([ids] if isinstance(ids, str) else ids)]
+    return {key(id): model for (_, id), model in zip(requests, _read_batched(requests))}
 
 
 def map_ids[T](factory: Callable[[str], T], *ids: str) -> dict[str, T]:
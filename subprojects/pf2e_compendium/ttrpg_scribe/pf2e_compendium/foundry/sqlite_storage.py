@@ -0,0 +1,268 @@
+import functools
+import itertools
+import json
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+from rich.progress import Progress
+
+from ttrpg_scribe.pf2e_compendium import foundry
+from ttrpg_scribe.pf2e_compendium.foundry import pack_reader, storage
+from ttrpg_scribe.pf2e_compendium.foundry.storage import (CreatureFilter,
+                                                          Document, IdType,
+                                                          MatchMode,
+                                                          SearchPage, Storage)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Documents are kept whole as JSON, the fields we query on are generated columns so they
+# can be indexed like their Mongo counterparts
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    foundry_id TEXT GENERATED ALWAYS AS (json_extract(doc, '$.foundry_id')) VIRTUAL,
+    pack TEXT GENERATED ALWAYS AS (json_extract(doc, '$.path.pack')) VIRTUAL,
+    subpath TEXT GENERATED ALWAYS AS (json_extract(doc, '$.path.subpath')) VIRTUAL,
+    name TEXT GENERATED ALWAYS AS (json_extract(doc, '$.name')) VIRTUAL,
+    level INTEGER GENERATED ALWAYS AS (coalesce(json_extract(doc, '$.system.level.value'),
+                                                json_extract(doc, '$.system.details.level.value'))
+                                      ) VIRTUAL,
+    PRIMARY KEY (collection, id)
+);
+CREATE INDEX IF NOT EXISTS documents_foundry_id ON documents (foundry_id);
+CREATE INDEX IF NOT EXISTS documents_pack ON documents (collection, pack, subpath);
+CREATE INDEX IF NOT EXISTS documents_name ON documents (collection, name);
+CREATE INDEX IF NOT EXISTS documents_level ON documents (collection, level);
+CREATE INDEX IF NOT EXISTS documents_name_nocase ON documents (collection, name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS documents_search_order
+    ON documents (collection, coalesce(level, {storage.NO_LEVEL}), name, id);
+-- Packs as last imported, so an update only reimports the ones that changed
+CREATE TABLE IF NOT EXISTS packs (
+    name TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+'''
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(pattern: str) -> re.Pattern[str]:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _regexp(pattern: str, value: str | None) -> bool:
+    return value is not None and _compile(pattern).search(value) is not None
+
+
+def _placeholders(values: list[Any]) -> str:
+    return ', '.join('?' * len(values))
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: Path):
+        self.path = path
+        # Connections can't be shared between threads, and flask serves requests on several
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, 'connection', None)) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.create_function('regexp', 2, _regexp, deterministic=True)
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def start(self):
+        _LOGGER.info(f'Using SQLite compendium at {self.path}')
+        self.connection
+
+    def update(self, progress: Progress, jobs: int = 1, full: bool = False):
+        packs: list = foundry.system_data('packs')
+        with self.connection as connection:
+            if full:
+                connection.execute('DELETE FROM documents')
+                connection.execute('DELETE FROM packs')
+            manifest = {name: json.loads(entry) for name, entry
+                        in connection.execute('SELECT name, entry FROM packs')}
+        changed, removed, restats = pack_reader.diff_manifest(packs, manifest)
+        _LOGGER.info(f'{len(changed)} packs changed, {len(removed)} packs removed, '
+                     f'{len(packs) - len(changed)} packs unchanged')
+        stale = [*removed, *(pack['name'] for pack in changed)]
+        with progress:
+            task = progress.add_task('Loading packs', total=len(changed), subdesc='')
+            with self.connection as connection:
+                connection.execute(f'DELETE FROM documents WHERE pack IN ({_placeholders(stale)})',
+                                   stale)
+                for name, docs in pack_reader.read_packs(changed, jobs):
+                    progress.update(task, subdesc=name)
+                    for collection, batch in itertools.groupby(docs, lambda t: t[0]):
+                        self._upsert(connection, collection, (doc for _, doc in batch))
+                    progress.advance(task)
+                connection.execute(f'DELETE FROM packs WHERE name IN ({_placeholders(removed)})',
+                                   removed)
+                entries = {pack['name']: pack_reader.manifest_entry(pack) for pack in changed}
+                entries |= {name: manifest[name] | {'stats': stats}
+                            for name, stats in restats.items()}
+                connection.executemany(
+                    'INSERT OR REPLACE INTO packs (name, entry) VALUES (?, ?)',
+                    ((name, json.dumps(entry)) for name, entry in entries.items()))
+            progress.update(task, subdesc='')
+        storage.bump_generation()
+
+    def find_documents(self, collection: str, doc_ids: list[str], id_type: IdType
+                       ) -> list[Document]:
+        column = 'id' if id_type == 'path' else 'foundry_id'
+        query = f'SELECT doc FROM documents WHERE {column} IN ({_placeholders(doc_ids)})'
+        params: list[str] = doc_ids
+        if collection != 'all':
+            query += ' AND collection = ?'
+            params = [*doc_ids, collection]
+        # Later rows win in get_documents, so the first collection wins if an id is in several
+        query += ' ORDER BY collection DESC'
+        return [json.loads(doc) for doc, in self.connection.execute(query, params)]
+
+    def collection_names(self) -> list[str]:
+        return [collection for collection, in self.connection.execute(
+            'SELECT DISTINCT collection FROM documents ORDER BY collection')]
+
+    def pack_names(self, collection: str) -> list[str]:
+        return [pack for pack, in self.connection.execute(
+            'SELECT DISTINCT pack FROM documents WHERE collection = ? ORDER BY pack',
+            [collection])]
+
+    def pack_content(self, collection: str, pack: str, subpath: str) -> list[Document]:
+        return [{'_id': id, 'name': name} for id, name in self.connection.execute(
+            'SELECT id, name FROM documents WHERE collection = ? AND pack = ? AND subpath = ?'
+            ' ORDER BY rowid',
+            [collection, pack, subpath])]
+
+    def pack_subpaths(self, collection: str, pack: str) -> list[str]:
+        return [subpath for subpath, in self.connection.execute(
+            'SELECT DISTINCT subpath FROM documents'
+            " WHERE collection = ? AND pack = ? AND subpath != '' ORDER BY subpath",
+            [collection, pack])]
+
+    def search(self, collections: list[str], query: str, mode: MatchMode = 'prefix',
+               limit: int = 100, cursor: str | None = None) -> SearchPage:
+        conditions = [f'collection IN ({_placeholders(collections)})']
+        params: list[Any] = [*collections]
+        match mode, query:
+            case 'prefix' | 'text' | 'regex', '':
+                pass
+            case 'prefix', _:
+                # LIKE is case insensitive for ASCII, like the lowercased name Mongo matches on
+                conditions.append("name LIKE ? ESCAPE '\\'")
+                params.append(re.sub(r'([%_\\])', r'\\\1', query) + '%')
+            case 'text', _:
+                # Any of the words, without Mongo's stemming
+                conditions.append('name REGEXP ?')
+                params.append(rf'\b(?:{'|'.join(re.escape(word) for word in query.split())})\b')
+            case 'regex', _:
+                conditions.append('name REGEXP ?')
+                params.append(query)
+            case _:
+                raise ValueError(mode)
+        if cursor is not None:
+            conditions.append('(sort_level, name, id) > (?, ?, ?)')
+            params += storage.decode_cursor(cursor)
+        rows = self.connection.execute(
+            "SELECT id, collection, name, level, json_extract(doc, '$.system.traits.rarity'),"
+            f" json_extract(doc, '$.volatile'), coalesce(level, {storage.NO_LEVEL}) AS sort_level"
+            f' FROM documents WHERE {' AND '.join(conditions)}'
+            ' ORDER BY sort_level, name, id LIMIT ?',
+            [*params, limit + 1]).fetchall()
+        page = SearchPage([{key: value for key, value in zip(
+                               ['_id', 'doc_type', 'name', 'level', 'rarity', 'worldContent'],
+                               # JSON booleans come back from SQLite as integers
+                               [*row[:5], None if row[5] is None else bool(row[5])])
+                            if value is not None}
+                           for row in rows[:limit]])
+        if len(rows) > limit:
+            id, _, name, *_, sort_level = rows[limit - 1]
+            page.next = storage.encode_cursor(sort_level, name, id)
+        return page
+
+    def search_entries(self) -> Iterable[Document]:
+        rows = self.connection.execute(
+            "SELECT id, collection, name, json_extract(doc, '$.base_name'), level,"
+            " json_extract(doc, '$.system.traits.rarity'), json_extract(doc, '$.volatile')"
+            ' FROM documents')
+        for row in rows:
+            yield {key: value for key, value in zip(
+                       ['_id', 'doc_type', 'name', 'base_name', 'level', 'rarity', 'worldContent'],
+                       [*row[:6], None if row[6] is None else bool(row[6])])
+                   if value is not None}
+
+    def creature_entries(self) -> Iterable[Document]:
+        rows = self.connection.execute(
+            "SELECT id, name, json_extract(doc, '$.system.details.level.value'),"
+            " json_extract(doc, '$.system.traits.rarity'),"
+            " json_extract(doc, '$.system.traits.size.value'),"
+            " json_extract(doc, '$.system.traits.value')"
+            " FROM documents WHERE collection = 'npc'")
+        for *row, traits in rows:
+            yield {key: value for key, value in zip(
+                       ['_id', 'name', 'level', 'rarity', 'size', 'traits'],
+                       [*row, None if traits is None else json.loads(traits)])
+                   if value is not None}
+
+    def sample_creatures(self, filters: list[CreatureFilter]) -> list[Document | None]:
+        def sample(filter: CreatureFilter) -> Document | None:
+            conditions = ["collection = 'npc'"]
+            params: list[Any] = []
+            match filter.level:
+                case int() as level:
+                    conditions.append("json_extract(doc, '$.system.details.level.value') = ?")
+                    params.append(level)
+                case int() as min_level, int() as max_level:
+                    conditions.append(
+                        "json_extract(doc, '$.system.details.level.value') BETWEEN ? AND ?")
+                    params += [min_level, max_level]
+                case None:
+                    pass
+            if filter.rarities is not None:
+                conditions.append("json_extract(doc, '$.system.traits.rarity')"
+                                  f' IN ({_placeholders(filter.rarities)})')
+                params += filter.rarities
+            if filter.sizes is not None:
+                conditions.append("json_extract(doc, '$.system.traits.size.value')"
+                                  f' IN ({_placeholders(filter.sizes)})')
+                params += filter.sizes
+            for trait in filter.traits or []:
+                conditions.append("EXISTS (SELECT 1 FROM json_each(doc, '$.system.traits.value')"
+                                  ' WHERE value = ?)')
+                params.append(trait)
+            row = self.connection.execute(
+                "SELECT id, name, json_extract(doc, '$.system.details.level.value'),"
+                " json_extract(doc, '$.system.traits.rarity')"
+                f' FROM documents WHERE {' AND '.join(conditions)} ORDER BY random() LIMIT 1',
+                params).fetchone()
+            if row is None:
+                return None
+            return {key: value for key, value in zip(['_id', 'name', 'level', 'rarity'], row)
+                    if value is not None}
+
+        return [sample(filter) for filter in filters]
+
+    def _upsert(self, connection: sqlite3.Connection, collection: str,
+                docs: Iterable[Document]) -> int:
+        cursor = connection.executemany(
+            'INSERT INTO documents (collection, id, doc) VALUES (?, ?, ?)'
+            ' ON CONFLICT (collection, id) DO UPDATE SET doc = excluded.doc',
+            ((collection, doc['_id'], json.dumps(doc)) for doc in docs))
+        return cursor.rowcount
+
+    def upsert(self, collection: str, docs: Iterable[Document]) -> int:
+        with self.connection as connection:
+            written = self._upsert(connection, collection, docs)
+        if written:
+            storage.bump_generation()
+        return written
@@ -0,0 +1,249 @@
+import base64
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Iterable, Literal, overload
+
+import bson
+from rich.progress import Progress
+
+Document = dict[str, Any]
+type IdType = Literal['path', 'uuid']
+type MatchMode = Literal['prefix', 'text', 'regex']
+
+# Sorts documents without a level first, like Mongo sorts missing fields
+NO_LEVEL = -1000
+
+# Bumped by every write, so caches of compendium content know when they're stale
+_generation = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+def bump_generation():
+    global _generation
+    _generation += 1
+
+
+@dataclass
+class CreatureFilter:
+    level: int | tuple[int, int] | None = None
+    rarities: list[str] | None = None
+    sizes: list[str] | None = None
+    traits: list[str] | None = None
+
+
+@dataclass
+class SearchPage:
+    results: list[Document]
+    next: str | None = None
+
+
+def encode_cursor(sort_level: int, name: str, id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_level, name, id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, str, str]:
+    sort_level, name, id = json.loads(base64.urlsafe_b64decode(cursor))
+    return sort_level, name, id
+
+
+class Storage(ABC):
+    @abstractmethod
+    def start(self):
+        ...
+
+    @abstractmethod
+    def update(self, progress: Progress, jobs: int = 1, full: bool = False):
+        ...
+
+    @abstractmethod
+    def find_documents(self, collection: str, doc_ids: list[str], id_type: IdType
+                       ) -> list[Document]:
+        ...
+
+    @abstractmethod
+    def collection_names(self) -> list[str]:
+        ...
+
+    @abstractmethod
+    def pack_names(self, collection: str) -> list[str]:
+        ...
+
+    @abstractmethod
+    def pack_content(self, collection: str, pack: str, subpath: str) -> list[Document]:
+        ...
+
+    @abstractmethod
+    def pack_subpaths(self, collection: str, pack: str) -> list[str]:
+        ...
+
+    @abstractmethod
+    def search(self, collections: list[str], query: str, mode: MatchMode = 'prefix',
+               limit: int = 100, cursor: str | None = None) -> SearchPage:
+        ...
+
+    def search_query(self, collections: list[str], query: Document, limit: int = 100
+                     ) -> list[Document]:
+        raise NotImplementedError(
+            f'Complex queries are not supported by {type(self).__name__}')
+
+    @abstractmethod
+    def search_entries(self) -> Iterable[Document]:
+        ...
+
+    @abstractmethod
+    def creature_entries(self) -> Iterable[Document]:
+        ...
+
+    @abstractmethod
+    def sample_creatures(self, filters: list[CreatureFilter]) -> list[Document | None]:
+        ...
+
+    @abstractmethod
+    def upsert(self, collection: str, docs: Iterable[Document]) -> int:
+        ...
+
+
+class DocumentCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Documents are stored encoded, every hit decodes a fresh copy the caller can mutate
+        self._entries: OrderedDict[tuple[str, str, str], bytes] = OrderedDict()
+        self._size = 0
+        self._generation = _generation
+        self._lock = threading.Lock()
+
+    def _evict_stale(self):
+        if self._generation != _generation:
+            self._entries.clear()
+            self._size = 0
+            self._generation = _generation
+
+    def get(self, key: tuple[str, str, str]) -> Document | None:
+        with self._lock:
+            self._evict_stale()
+            if (raw := self._entries.get(key)) is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return bson.decode(raw)
+
+    def put(self, key: tuple[str, str, str], doc: Document, read_generation: int):
+        raw = bson.encode(doc)
+        if len(raw) > self.max_bytes:
+            return
+        with self._lock:
+            self._evict_stale()
+            if read_generation != self._generation:
+                return  # Read before a write finished, may be stale
+            if (old := self._entries.pop(key, None)) is not None:
+                self._size -= len(old)
+            self._entries[key] = raw
+            self._size += len(raw)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'bytes': self._size, 'generation': self._generation}
+
+
+document_cache = DocumentCache(max_entries=4096, max_bytes=128 * 2**20)
+_backend: Storage | None = None
+
+
+@dataclass
+class MongoPool:
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    warm_connections: int = 4
+
+
+# Only applied if the Mongo backend is the one constructed
+mongo_pool = MongoPool()
+
+
+def configure(pool: MongoPool):
+    global mongo_pool
+    mongo_pool = pool
+
+
+def backend() -> Storage:
+    global _backend
+    if _backend is None:
+        match os.environ.get('PF2E_COMPENDIUM_STORAGE', 'mongo'):
+            case 'mongo':
+                from ttrpg_scribe.pf2e_compendium.foundry import mongo_client
+                mongo_client.configure(mongo_pool.max_pool_size, mongo_pool.min_pool_size,
+                                       mongo_pool.warm_connections)
+                _backend = mongo_client.MongoStorage()
+            case 'sqlite':
+                from ttrpg_scribe import pf2e_compendium
+                from ttrpg_scribe.pf2e_compendium.foundry.sqlite_storage import \
+                    SqliteStorage
+                _backend = SqliteStorage(pf2e_compendium.data_dir/'compendium.sqlite3')
+            case unknown:
+                raise ValueError(f'Unknown storage backend {unknown}')
+    return _backend
+
+
+def id_key(id_type: IdType) -> str:
+    return '_id' if id_type == 'path' else 'foundry_id'
+
+
+@overload
+def get_document(collection: str, doc_id: str, id_type: IdType, optional: bool
+                 ) -> Document | None:
+    ...
+
+
+@overload
+def get_document(collection: str, doc_id: str) -> Document:
+    ...
+
+
+@overload
+def get_document(collection: str, doc_id: str, id_type: IdType) -> Document:
+    ...
+
+
+def get_document(collection: str, doc_id: str, id_type: IdType = 'path',
+                 optional=False) -> Document | None:
+    return get_documents(collection, [doc_id], id_type, optional).get(doc_id)
+
+
+def get_documents(collection: str, doc_ids: Iterable[str], id_type: IdType = 'path',
+                  optional=False) -> dict[str, Document]:
+    read_generation = _generation
+    docs: dict[str, Document] = {}
+    missing: list[str] = []
+    for doc_id in dict.fromkeys(doc_ids):
+        if (doc := document_cache.get((collection, id_type, doc_id))) is not None:
+            docs[doc_id] = doc
+        else:
+            missing.append(doc_id)
+    if missing:
+        key = id_key(id_type)
+        for doc in backend().find_documents(collection, missing, id_type):
+            document_cache.put((collection, id_type, doc[key]), doc, read_generation)
+            docs[doc[key]] = doc
+    if not optional and (not_found := [doc_id for doc_id in missing if doc_id not in docs]):
+        raise KeyError(f'{', '.join(not_found)} not found in {collection}')
+    return docs
@@ -1,15 +1,23 @@
+import random
 from dataclasses import dataclass
 from typing import Any
 
 import flask
 import ttrpg_scribe.core.typescript
-from ttrpg_scribe.pf2e_compendium.foundry import mongo_client
+from ttrpg_scribe.pf2e_compendium.foundry import creature_index, storage
+from ttrpg_scribe.pf2e_compendium.oracle import solver
 
 _blueprint = flask.Blueprint('oracle', __name__, static_folder='static',
                       template_folder='templates', url_prefix='/oracle')
 ttrpg_scribe.core.typescript.extend(_blueprint)
 
 
+@_blueprint.before_request
+def _require_compendium():
+    from ttrpg_scribe.pf2e_compendium.flask import require_compendium
+    require_compendium()
+
+
 @_blueprint.get('/encounter')
 def encounter_ui():
     return flask.render_template('oracle/encounter.j2.html')
@@ -20,6 +28,57 @@ def encounter():
     return EncounterSpecification.from_json(flask.request.get_json()).resolve()
 
 
+@_blueprint.post('/encounters')
+def encounters():
+    specification = EncounterSpecification.from_json(flask.request.get_json())
+    count = min(flask.request.args.get('count', 10, type=int), 1000)
+    rng = random.Random(flask.request.args.get('seed', type=int))
+    index = creature_index.index()
+    return [specification.resolve(index, rng) for _ in range(count)]
+
+
+@_blueprint.post('/solve')
+def solve():
+    json = flask.request.get_json()
+    config = flask.current_app.config
+
+    def field(name: str, kind: type, default: Any = None) -> Any:
+        if (value := json.get(name, default)) is None:
+            raise ValueError(f'{name} is required')
+        # JSON true and false arrive as bools, which Python also counts as ints
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise ValueError(f'{name} must be of type {kind.__name__}, not {value!r}')
+        return value
+
+    def names(name: str) -> list[str] | None:
+        if (value := json.get(name)) is not None and not (
+                isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            raise ValueError(f'{name} must be a list of strings, not {value!r}')
+        return value
+
+    try:
+        if not isinstance(json, dict):
+            raise ValueError('Expected a JSON object')
+        party = config.get('PARTY')
+        count = field('count', int, 10)
+        if count < 1:
+            raise ValueError(f'count must be at least 1, not {count}')
+        if not isinstance(seed := json.get('seed'), int | str | None):
+            raise ValueError(f'seed must be a number or string, not {seed!r}')
+        if (sizes := names('size')) is not None and (unknown := set(sizes) - set(_SIZES)):
+            raise ValueError(f'Unknown sizes {', '.join(sorted(unknown))}')
+        filter = EncounterSpecification.CombatantSpecification(
+            1, None, names('rarity'), sizes, names('traits')).to_filter()
+        return solver.solve(field('party-level', int, config.get('PARTY_LEVEL')),
+                            field('party-size', int, len(party) if party is not None else None),
+                            field('threat', str), filter,
+                            min(count, 100),
+                            field('max-creatures', int, 8),
+                            random.Random(seed))
+    except ValueError as e:
+        return str(e), 400
+
+
 def extend(app: flask.Flask):
     app.register_blueprint(_blueprint)
 
@@ -59,22 +118,13 @@ class EncounterSpecification:
                 json['traits']
             )
 
-        def to_mongo_query(self) -> dict:
-            query = {}
-            match self.level:
-                case int() as level:
-                    query['system.details.level.value'] = level
-                case int() as min_level, int() as max_level:
-                    query['system.details.level.value'] = {'$gte': min_level, '$lte': max_level}
-                case None:
-                    pass
-            if self.rarities is not None:
-                query['system.traits.rarity'] = {'$in': self.rarities}
-            if self.sizes is not None:
-                query['system.traits.size.value'] = {'$in': [_SIZES[s] for s in self.sizes]}
-            if self.traits is not None and len(self.traits) > 0:
-                query['system.traits.value'] = {'$all': self.traits}
-            return query
+        def to_filter(self) -> storage.CreatureFilter:
+            return storage.CreatureFilter(
+                self.level,
+                self.rarities,
+                [_SIZES[s] for s in self.sizes] if self.sizes is not None else None,
+                self.traits
+            )
 
     combatants: list[CombatantSpecification]
 
@@ -83,32 +133,8 @@ class EncounterSpecification:
         return EncounterSpecification([EncounterSpecification.CombatantSpecification.from_json(e)
                                        for e in json])
 
-    def resolve(self):
-        def to_pipeline(spec: EncounterSpecification.CombatantSpecification):
-            return [
-                {'$match': spec.to_mongo_query()},
-                {'$sample': {'size': 1}},
-                {
-                    '$project': {
-                        'name': 1,
-                        'level': '$system.details.level.value',
-                        'rarity': '$system.traits.rarity'
-                    }
-                }
-            ]
-
-        pipeline = [{
-                '$facet': {
-                    f'combatant{i}': to_pipeline(spec)
-                    for i, spec in enumerate(self.combatants)
-                }
-            },
-            {
-                '$project': {
-                    f'combatant{i}': {'$first': f'$combatant{i}'}
-                    for i in range(len(self.combatants))
-                }
-            }
-        ]
-        [results] = list(mongo_client.db.npc.aggregate(pipeline))
-        return [{'quantity': c.quantity, **r} for c, r in zip(self.combatants, results.values())]
+    def resolve(self, index: creature_index.CreatureIndex | None = None,
+                rng: random.Random | None = None):
+        index = index or creature_index.index()
+        results = [index.sample(c.to_filter(), rng) for c in self.combatants]
+        return [{'quantity': c.quantity, **(r or {})} for c, r in zip(self.combatants, results)]
@@ -0,0 +1,77 @@
+import dataclasses
+import random
+from typing import Iterator
+
+from ttrpg_scribe.pf2e_compendium.foundry import creature_index
+from ttrpg_scribe.pf2e_compendium.foundry.storage import CreatureFilter, Document
+
+# The number of level combinations grows quickly with both, so requests are kept within these
+MAX_PARTY_SIZE = 8
+MAX_CREATURES = 12
+
+
+def budget(party_size: int, threat: str) -> int:
+    from ttrpg_scribe.pf2e_compendium.flask import Pf2ePlugin
+    for threshold, name in Pf2ePlugin.threat_thresholds(party_size):
+        if name.lower() == threat.lower():
+            return threshold
+    raise ValueError(f'Unknown threat {threat}')
+
+
+def level_combinations(xp_by_level: dict[int, int], budget: int, max_creatures: int
+                       ) -> Iterator[list[tuple[int, int]]]:
+    # Most valuable first, so a level that can't fill what's left prunes everything after it
+    levels = sorted(xp_by_level.items(), key=lambda t: t[1], reverse=True)
+
+    def search(i: int, remaining: int, creatures: int) -> Iterator[list[tuple[int, int]]]:
+        if remaining == 0:
+            yield []
+            return
+        if i == len(levels) or creatures == 0:
+            return
+        level, xp = levels[i]
+        if xp * creatures < remaining:
+            return
+        for count in range(min(creatures, remaining // xp), -1, -1):
+            for rest in search(i + 1, remaining - count * xp, creatures - count):
+                yield [(level, count), *rest] if count else rest
+
+    return search(0, budget, max_creatures)
+
+
+def solve(party_level: int, party_size: int, threat: str, filter: CreatureFilter,
+          limit: int = 10, max_creatures: int = 8, rng: random.Random | None = None,
+          index: creature_index.CreatureIndex | None = None) -> list[Document]:
+    from ttrpg_scribe.pf2e_compendium.flask import Pf2ePlugin
+    for name, value, maximum in [('Party size', party_size, MAX_PARTY_SIZE),
+                                 ('Max creatures', max_creatures, MAX_CREATURES)]:
+        if not isinstance(value, int) or not 1 <= value <= maximum:
+            raise ValueError(f'{name} must be between 1 and {maximum}, not {value}')
+    rng = rng or random.Random()
+    index = index or creature_index.index()
+    xp_budget = budget(party_size, threat)
+
+    def at_level(level: int) -> CreatureFilter:
+        return dataclasses.replace(filter, level=level)
+
+    # Creatures more than 4 levels below the party are worth nothing, and the table stops at +4
+    xp_by_level = {level: Pf2ePlugin.creature_xp(level, party_level)
+                   for level in range(party_level - 4, party_level + 5)
+                   if index.count(at_level(level)) > 0}
+    combinations = list(level_combinations(xp_by_level, xp_budget, max_creatures))
+    rng.shuffle(combinations)
+
+    encounters: list[Document] = []
+    seen: set[tuple[tuple[str, int], ...]] = set()
+    # Combinations are revisited for more creatures, but small pools may run out of new ones
+    for attempt in range(max(len(combinations), limit) * 3 if combinations else 0):
+        if len(encounters) == limit:
+            break
+        combatants = [{'quantity': count, **index.sample(at_level(level), rng)}  # type: ignore
+                      for level, count in combinations[attempt % len(combinations)]]
+        key = tuple(sorted((c['_id'], c['quantity']) for c in combatants))
+        if key in seen:
+            continue
+        seen.add(key)
+        encounters.append({'xp': xp_budget, 'combatants': combatants})
+    return encounters